@@ -1,61 +1,231 @@
 import asyncio
-import time
-from typing import Dict, Optional
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Set, Any
+
+from django.conf import settings
+
+from lib.analysis.sequence_buffer import SequenceBuffer
+from lib.analysis.worker_pool import get_process_pool
+from lib.genes.compiled_organism import CompiledOrganism
+from lib.genes.fasta_index import FastaIndex
 from lib.genes.gene_list import GeneList
+from lib.genes.genes import Gene
+from lib.utilities.array_store import source_stamp, SourceStamp
+
+
+class _Entry:
+    def __init__(self, gene_list: GeneList, size: int, stamp: SourceStamp):
+        self.gene_list = gene_list
+        self.size = size
+        self.stamp = stamp
 
 
 class FastaCache:
+    """
+    Loaded organisms by the path of their file, bounded by their estimated size in memory.
+
+    Least recently used organisms are evicted once the budget is exceeded, except pinned ones
+    (e.g. the hot organisms of `FASTA_CACHE_PINNED`). A file that changed on disk is loaded again.
+    Loads run on a thread and every file is loaded once at a time; requests for a file being
+    loaded wait for that load, from whichever event loop they run on.
+    """
+
     _instance = None
-    _cache: Dict[str, GeneList] = {}
-    _locks: Dict[str, asyncio.Lock] = {}
-    _last_access: Dict[str, float] = {}
-    _cache_ttl = 3600
 
     @classmethod
     def get_instance(cls):
         if cls._instance is None:
-            cls._instance = FastaCache()
+            cls._instance = FastaCache(budget_bytes=settings.FASTA_CACHE_MB << 20)
+            from analysis.utils.file_utils import find_fasta_file
+            for filename in cls._pinned_filenames():
+                file_path = find_fasta_file(filename)
+                if file_path:
+                    cls._instance.pin(file_path)
         return cls._instance
 
-    def __init__(self):
-        self._cache = {}
-        self._locks = {}
-        self._last_access = {}
+    def __init__(self, budget_bytes: int):
+        """
+        :param budget_bytes: Size limit of the unpinned organisms, 0 keeps only pinned ones
+        """
+        self.budget_bytes = budget_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._used = 0
+        self._pinned: Set[str] = set()
+        # Files being loaded, bounded by the loads in flight
+        self._loading: Set[str] = set()
+        self._condition = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     async def get_gene_list(self, file_path: str) -> GeneList:
-        now = time.time()
+        gene_list = self._lookup(file_path)
+        if gene_list is not None:
+            return gene_list
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_gene_list_sync, file_path)
 
-        if file_path not in self._locks:
-            self._locks[file_path] = asyncio.Lock()
+    def get_gene_list_sync(self, file_path: str) -> GeneList:
+        """Variant of `get_gene_list` for threads without an event loop, blocks while the file loads"""
+        with self._condition:
+            while True:
+                gene_list = self._lookup(file_path)
+                if gene_list is not None:
+                    return gene_list
+                if file_path not in self._loading:
+                    break
+                self._condition.wait()
+            self._loading.add(file_path)
+            self.misses += 1
 
-        if file_path in self._cache and now - self._last_access[file_path] < self._cache_ttl:
-            self._last_access[file_path] = now
-            return self._cache[file_path]
+        try:
+            stamp = source_stamp(file_path)
+            print(f"[DEBUG] Loading file from disk: {file_path}")
+            gene_list, compiled = self._load(file_path)
+            if compiled is not None:
+                # The compiled organism holds the packed sequences already
+                SequenceBuffer.publish_existing(file_path, compiled.path, gene_list.genes)
+            elif gene_list.columns is not None and gene_list.columns.indexed is not None:
+                # Sequences are read from the file once an analysis needs them
+                SequenceBuffer.defer(file_path, gene_list.genes)
+            else:
+                try:
+                    SequenceBuffer.publish(file_path, gene_list.genes)
+                except OSError as e:
+                    print(f"[DEBUG] Could not publish sequence buffer for {file_path}: {e}")
+            size = gene_list.memory_size()
+            print(f"[DEBUG] Loaded {len(gene_list.genes)} genes, {len(gene_list.errors)} errors, "
+                  f"~{size >> 20} MB.")
 
-        async with self._locks[file_path]:
-            if file_path in self._cache and now - self._last_access[file_path] < self._cache_ttl:
-                self._last_access[file_path] = now
-                return self._cache[file_path]
+            with self._condition:
+                self._store(file_path, _Entry(gene_list, size, stamp))
+            return gene_list
+        finally:
+            with self._condition:
+                self._loading.discard(file_path)
+                self._condition.notify_all()
 
-            print(f"[DEBUG] Loading file from disk: {file_path}")
+    def get_gene(self, file_path: str, gene_id: str) -> Optional[Gene]:
+        """
+        Returns one gene of an organism, from the organism if it is loaded, otherwise read from its
+        file without loading the organism into the cache (see `GeneList.read_gene`).
+        """
+        gene_list = self._lookup(file_path)
+        if gene_list is not None:
+            return next((gene for gene in gene_list.genes if gene.geneId == gene_id), None)
+        return GeneList.read_gene(file_path, gene_id)
+
+    def warm_up(self) -> None:
+        """
+        Loads the pinned organisms, e.g. in the server process before it forks its workers.
+        Plain FASTA files without an index are indexed first, with the process pool (see `FastaIndex`).
+        Values computed lazily per gene are computed here, and sequence buffers are published,
+        so workers read the genes they inherit without writing to (and so copying) their memory pages.
+        """
+        with self._condition:
+            file_paths = sorted(self._pinned)
+        for file_path in file_paths:
+            try:
+                if CompiledOrganism.for_fasta(file_path) is None:
+                    FastaIndex.for_fasta(file_path, build=True, executor=get_process_pool())
+                gene_list = self.get_gene_list_sync(file_path)
+            except Exception as e:
+                print(f"[DEBUG] Could not warm up {file_path}: {e}")
+                continue
+            for gene in gene_list.genes:
+                gene.geneCode
+            SequenceBuffer.for_key(file_path)
+        print(f"[DEBUG] Warmed up {len(file_paths)} organisms: {self.stats()}")
+
+    def pin(self, file_path: str) -> None:
+        """Keeps an organism loaded once it is, regardless of the budget"""
+        with self._condition:
+            self._pinned.add(file_path)
+
+    def unpin(self, file_path: str) -> None:
+        with self._condition:
+            self._pinned.discard(file_path)
+            self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "pinned": len(self._pinned & self._entries.keys()),
+                "used_bytes": self._used,
+                "budget_bytes": self.budget_bytes,
+            }
+
+    def _lookup(self, file_path: str) -> Optional[GeneList]:
+        with self._condition:
+            entry = self._entries.get(file_path)
+            if entry is None:
+                return None
+            try:
+                current = source_stamp(file_path) == entry.stamp
+            except OSError:
+                current = False
+            if not current:
+                self._remove(file_path)
+                return None
+            self._entries.move_to_end(file_path)
+            self.hits += 1
+            return entry.gene_list
+
+    def _store(self, file_path: str, entry: _Entry) -> None:
+        previous = self._entries.pop(file_path, None)
+        if previous is not None:
+            self._used -= previous.size
+        self._entries[file_path] = entry
+        self._used += entry.size
+        self._evict()
+
+    def _evict(self) -> None:
+        unpinned = sum(entry.size for file_path, entry in self._entries.items() if file_path not in self._pinned)
+        for file_path in list(self._entries):
+            if unpinned <= self.budget_bytes:
+                break
+            if file_path in self._pinned:
+                continue
+            print(f"[DEBUG] Evicting {file_path} from the FASTA cache")
+            unpinned -= self._entries[file_path].size
+            self._remove(file_path)
+            self.evictions += 1
 
-            async def _load():
-                print(f"[DEBUG] Opening file: {file_path}")
-                import aiofiles
-                async with aiofiles.open(file_path, 'r') as f:
-                    data = await f.read()
-                    print(f"[DEBUG] File read complete. Data size: {len(data)} bytes")
+    def _remove(self, file_path: str) -> None:
+        entry = self._entries.pop(file_path)
+        self._used -= entry.size
+        SequenceBuffer.withdraw(file_path)
 
-                print("[DEBUG] Starting FASTA parsing...")
-                genes, errors = await GeneList.parse_fasta(data)
-                print(f"[DEBUG] FASTA parsing complete. Parsed {len(genes)} genes, {len(errors)} errors.")
+    @staticmethod
+    def _pinned_filenames() -> List[str]:
+        if "*" not in settings.FASTA_CACHE_PINNED:
+            return settings.FASTA_CACHE_PINNED
 
-                print("[DEBUG] Creating GeneList instance...")
-                return GeneList.from_list(genes=genes, errors=errors)
+        from lib.analysis.organism_presets import OrganismPresets
+        # Read from the preset files only, access records are not needed
+        if not OrganismPresets._organisms:
+            OrganismPresets.reload_data()
+        return [organism.filename for organism in OrganismPresets._organisms]
 
-            gene_list = await _load()
+    @staticmethod
+    def _load(file_path: str) -> Tuple[GeneList, Optional[CompiledOrganism]]:
+        """
+        Opens the compiled organism of a file if it is up to date, loads the file through its index
+        (see `FastaIndex`) otherwise, and parses it if it has none. Indexes are not built here, while
+        a request waits, but by the `build_fasta_index` management command or at warm-up.
+        """
+        compiled = CompiledOrganism.for_fasta(file_path)
+        if compiled is not None:
+            print(f"[DEBUG] Opening compiled organism: {compiled.path}")
+            return GeneList.from_compiled(compiled, source=file_path), compiled
 
-            self._cache[file_path] = gene_list
-            self._last_access[file_path] = now
+        index = FastaIndex.for_fasta(file_path)
+        if index is not None:
+            return GeneList.from_index(index, source=file_path), None
 
-            return gene_list
\ No newline at end of file
+        print("[DEBUG] Starting FASTA parsing...")
+        return GeneList.parse_file(file_path), None
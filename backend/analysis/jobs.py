@@ -0,0 +1,234 @@
+import asyncio
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import transaction, connection, close_old_connections
+from django.utils import timezone
+
+from analysis.models import AnalysisJob
+from analysis.result_cache import ResultCache, analysis_key, apply_stage_colors
+from analysis.utils.file_utils import find_fasta_file
+from analysis.views.analysis_utils import create_gene_model, process_analysis_results, save_analysis_history, \
+    get_stage_color_preferences
+from lib.analysis.motif_presets import MotifPresets
+from lib.analysis.organism_presets import OrganismPresets
+from lib.genes.gene_model import AnalysisCancelled
+
+# How often idle workers look for queued jobs, and running jobs report progress and check for cancellation
+POLL_INTERVAL = 1.0
+# Running jobs without a heartbeat for this long lost their worker (e.g. a recycled server process)
+STALE_AFTER = timedelta(minutes=2)
+
+
+class JobLimitError(Exception):
+    """Raised when a job cannot be queued because the queue or the user's limit is full"""
+
+
+class JobCancelled(AnalysisCancelled):
+    pass
+
+
+_workers: List[threading.Thread] = []
+_workers_pid: Optional[int] = None
+_workers_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def enqueue(user, organism, motifs: List[str], stages: List[str], params: dict) -> AnalysisJob:
+    """
+    Queues an analysis of a user and makes sure this process runs job workers.
+    :raises JobLimitError: If the queue is full or the user has too many queued or running jobs
+    """
+    with transaction.atomic():
+        # Serializes the limit checks of each user
+        type(user).objects.select_for_update().filter(pk=user.pk).first()
+
+        active = AnalysisJob.objects.filter(user=user, status__in=AnalysisJob.ACTIVE_STATUSES).count()
+        if active >= settings.ANALYSIS_JOB_USER_LIMIT:
+            raise JobLimitError(f"At most {settings.ANALYSIS_JOB_USER_LIMIT} analyses can run at once")
+        if AnalysisJob.objects.filter(status=AnalysisJob.QUEUED).count() >= settings.ANALYSIS_JOB_QUEUE_SIZE:
+            raise JobLimitError("The analysis queue is full, try again later")
+
+        job = AnalysisJob.objects.create(
+            user=user,
+            organism=organism.name,
+            organism_filename=organism.filename,
+            motifs=motifs,
+            stages=stages,
+            settings=params,
+        )
+
+    ensure_workers()
+    _wakeup.set()
+    return job
+
+
+def cancel(job: AnalysisJob) -> AnalysisJob:
+    """
+    Cancels a job. Queued jobs are cancelled at once, running jobs after their current motif.
+    """
+    cancelled = AnalysisJob.objects.filter(pk=job.pk, status=AnalysisJob.QUEUED).update(
+        status=AnalysisJob.CANCELLED,
+        finished_at=timezone.now(),
+    )
+    if not cancelled:
+        AnalysisJob.objects.filter(pk=job.pk, status=AnalysisJob.RUNNING).update(cancel_requested=True)
+    job.refresh_from_db()
+    return job
+
+
+def ensure_workers() -> None:
+    """Starts the job worker threads of this process, if not running yet"""
+    global _workers, _workers_pid
+    with _workers_lock:
+        if _workers_pid != os.getpid():
+            # Threads do not survive a fork
+            _workers, _workers_pid = [], os.getpid()
+        _workers = [worker for worker in _workers if worker.is_alive()]
+        while len(_workers) < settings.ANALYSIS_JOB_WORKERS:
+            worker = threading.Thread(target=_work, name=f"analysis-job-worker-{len(_workers)}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def _work() -> None:
+    worker_name = f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+    while True:
+        try:
+            close_old_connections()
+            _fail_stale_jobs()
+            job = _claim(worker_name)
+            if job is None:
+                _wakeup.wait(POLL_INTERVAL)
+                _wakeup.clear()
+                continue
+            _run(job)
+        except Exception as e:
+            print(f"ERROR in analysis job worker: {e}")
+            traceback.print_exc()
+            _wakeup.wait(POLL_INTERVAL)
+
+
+def _claim(worker_name: str) -> Optional[AnalysisJob]:
+    """Takes the oldest queued job, skipping jobs other workers are claiming"""
+    with transaction.atomic():
+        job = (
+            AnalysisJob.objects.select_for_update(skip_locked=True)
+            .filter(status=AnalysisJob.QUEUED)
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+        now = timezone.now()
+        job.status = AnalysisJob.RUNNING
+        job.worker = worker_name
+        job.started_at = now
+        job.heartbeat_at = now
+        job.save(update_fields=['status', 'worker', 'started_at', 'heartbeat_at'])
+        return job
+
+
+def _fail_stale_jobs() -> None:
+    AnalysisJob.objects.filter(
+        status=AnalysisJob.RUNNING,
+        heartbeat_at__lt=timezone.now() - STALE_AFTER,
+    ).update(status=AnalysisJob.FAILED, error="The analysis worker stopped", finished_at=timezone.now())
+
+
+def _run(job: AnalysisJob) -> None:
+    cancel_requested = threading.Event()
+    finished = threading.Event()
+    progress = {"value": 0.0}
+    monitor = threading.Thread(
+        target=_monitor, args=(job.pk, progress, cancel_requested, finished), daemon=True
+    )
+    monitor.start()
+
+    def _on_series(series):
+        progress["value"] = gene_model.analysisProgress or 0.0
+        # Makes GeneModel.analyze stop, the status is then set to cancelled
+        if cancel_requested.is_set():
+            raise JobCancelled()
+
+    status, fields = AnalysisJob.FAILED, {}
+    try:
+        gene_model, file_path, organism = _prepare(job)
+        # Loaded here, the ORM cannot be used from the event loop below
+        user = job.user
+
+        cache = ResultCache.get_instance()
+        cache_key = analysis_key(file_path, organism, gene_model)
+
+        async def _compute():
+            await gene_model.loadFastaFromFile(file_path, organism)
+            if not await gene_model.analyze(on_series=_on_series):
+                return None
+            return await process_analysis_results(gene_model)
+
+        async def _analyze():
+            cached_results, _ = await cache.get_or_compute(cache_key, _compute)
+            if cached_results is None:
+                return None, None
+
+            filtered_results = apply_stage_colors(cached_results, await get_stage_color_preferences(user))
+            history = await save_analysis_history(
+                user,
+                organism.name,
+                organism.filename,
+                filtered_results,
+                job.motifs,
+                job.stages,
+                job.settings,
+            )
+            return filtered_results, history
+
+        filtered_results, history = asyncio.run(_analyze())
+        if cancel_requested.is_set():
+            status = AnalysisJob.CANCELLED
+        elif filtered_results is None:
+            fields = {"error": "Analysis failed"}
+        else:
+            status = AnalysisJob.DONE
+            fields = {"filtered_results": filtered_results, "history": history, "progress": 1.0}
+    except JobCancelled:
+        status = AnalysisJob.CANCELLED
+    except Exception as e:
+        traceback.print_exc()
+        fields = {"error": str(e)}
+    finally:
+        finished.set()
+        monitor.join()
+
+    AnalysisJob.objects.filter(pk=job.pk).update(status=status, finished_at=timezone.now(), **fields)
+
+
+def _prepare(job: AnalysisJob):
+    organism = OrganismPresets.get_organism_by_filename(job.organism_filename)
+    if not organism:
+        raise ValueError("Organism not found")
+    file_path = find_fasta_file(organism.filename)
+    if not file_path:
+        raise ValueError("Organism file not found")
+
+    motifs = MotifPresets.get_motifs_by_names(job.motifs)
+    return create_gene_model(motifs, job.stages, job.settings), file_path, organism
+
+
+def _monitor(job_id, progress: dict, cancel_requested: threading.Event, finished: threading.Event) -> None:
+    """
+    Records the progress and heartbeat of a running job and picks up cancellation requests.
+    Runs on its own thread, as the analysis thread runs an event loop and cannot use the ORM.
+    """
+    try:
+        while not finished.wait(POLL_INTERVAL):
+            AnalysisJob.objects.filter(pk=job_id).update(progress=progress["value"], heartbeat_at=timezone.now())
+            if AnalysisJob.objects.filter(pk=job_id, cancel_requested=True).exists():
+                cancel_requested.set()
+    finally:
+        connection.close()
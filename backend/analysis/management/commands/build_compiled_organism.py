@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from analysis.utils.file_utils import find_fasta_file
+from lib.analysis.organism_presets import OrganismPresets
+from lib.genes.compiled_organism import CompiledOrganism
+from lib.genes.gene_list import GeneList
+
+
+class Command(BaseCommand):
+    help = "Compiles organism FASTA files into memory-mapped organisms, opened instead of the FASTA files when present."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'filenames', nargs='*',
+            help="Organism filenames in DATA_DIR/fasta_files (defaults to all preset organisms)"
+        )
+
+    def handle(self, *args, **options):
+        filenames = options['filenames'] or [organism.filename for organism in OrganismPresets.get_organisms()]
+
+        for filename in filenames:
+            file_path = find_fasta_file(filename)
+            if not file_path:
+                self.stderr.write(f"{filename}: file not found")
+                continue
+            if CompiledOrganism.is_compiled(file_path):
+                self.stderr.write(f"{filename}: only the compiled organism exists, nothing to compile")
+                continue
+
+            try:
+                gene_list = GeneList.parse_file(file_path)
+                CompiledOrganism.compile(CompiledOrganism.path_for(file_path), gene_list.columns, gene_list.errors,
+                                         fasta_path=file_path)
+            except Exception as e:
+                self.stderr.write(f"{filename}: {e}")
+                continue
+
+            self.stdout.write(
+                f"{filename}: compiled {len(gene_list.genes)} genes with {len(gene_list.stageKeys)} stages "
+                f"({len(gene_list.errors)} errors)"
+            )
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from analysis.utils.file_utils import find_fasta_file
+from lib.analysis.organism_presets import OrganismPresets
+from lib.genes.fasta_reader import FastaBlockIndex, is_bgzf
+
+
+class Command(BaseCommand):
+    help = "Indexes the records of BGZF compressed organism files, so single genes are read without inflating the file."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'filenames', nargs='*',
+            help="Organism filenames in DATA_DIR/fasta_files (defaults to all preset organisms)"
+        )
+
+    def handle(self, *args, **options):
+        filenames = options['filenames'] or [organism.filename for organism in OrganismPresets.get_organisms()]
+
+        for filename in filenames:
+            file_path = find_fasta_file(filename)
+            if not file_path:
+                self.stderr.write(f"{filename}: file not found")
+                continue
+            if not is_bgzf(file_path):
+                self.stderr.write(f"{filename}: {file_path} is not BGZF compressed, skipped")
+                continue
+
+            try:
+                index = FastaBlockIndex.build(file_path)
+                index.save(FastaBlockIndex.path_for(file_path), fasta_path=file_path)
+            except Exception as e:
+                self.stderr.write(f"{filename}: {e}")
+                continue
+
+            self.stdout.write(f"{filename}: indexed {len(index.gene_ids)} records")
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from analysis.utils.file_utils import find_fasta_file
+from lib.analysis.organism_presets import OrganismPresets
+from lib.analysis.worker_pool import get_process_pool
+from lib.genes.fasta_index import FastaIndex
+
+
+class Command(BaseCommand):
+    help = "Indexes the sequences of plain organism FASTA files, so organisms are loaded without reading them."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'filenames', nargs='*',
+            help="Organism filenames in DATA_DIR/fasta_files (defaults to all preset organisms)"
+        )
+
+    def handle(self, *args, **options):
+        filenames = options['filenames'] or [organism.filename for organism in OrganismPresets.get_organisms()]
+
+        for filename in filenames:
+            file_path = find_fasta_file(filename)
+            if not file_path:
+                self.stderr.write(f"{filename}: file not found")
+                continue
+            if not FastaIndex.can_index(file_path):
+                self.stderr.write(f"{filename}: {file_path} is not a plain FASTA file, skipped")
+                continue
+
+            try:
+                index = FastaIndex.build(file_path, executor=get_process_pool())
+                index.save(FastaIndex.path_for(file_path))
+            except Exception as e:
+                self.stderr.write(f"{filename}: {e}")
+                continue
+
+            self.stdout.write(f"{filename}: indexed {index.gene_count} genes, "
+                              f"{index.inline_count} sequences stored in the index")
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from analysis.utils.file_utils import find_fasta_file
+from lib.analysis.fm_index import FmIndex
+from lib.analysis.organism_presets import OrganismPresets
+from lib.genes.gene_list import GeneList
+
+
+class Command(BaseCommand):
+    help = "Builds the FM-index of organism FASTA files, used by the analysis with MOTIF_SCAN_BACKEND=fm."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'filenames', nargs='*',
+            help="Organism filenames in DATA_DIR/fasta_files (defaults to all preset organisms)"
+        )
+        parser.add_argument('--sample-rate', type=int, default=FmIndex.SAMPLE_RATE,
+                            help="Distance of the sampled suffix array positions")
+
+    def handle(self, *args, **options):
+        filenames = options['filenames'] or [organism.filename for organism in OrganismPresets.get_organisms()]
+
+        for filename in filenames:
+            file_path = find_fasta_file(filename)
+            if not file_path:
+                self.stderr.write(f"{filename}: file not found")
+                continue
+
+            try:
+                gene_list = GeneList.load_from_file(file_path)
+                index = FmIndex.build(gene_list, sample_rate=options['sample_rate'])
+                index.save(FmIndex.path_for(file_path), fasta_path=file_path)
+            except Exception as e:
+                self.stderr.write(f"{filename}: {e}")
+                continue
+
+            self.stdout.write(
+                f"{filename}: indexed {len(index.bwt)} symbols of {len(index.gene_ids)} genes "
+                f"({int(index.irregular.sum())} scanned live)"
+            )
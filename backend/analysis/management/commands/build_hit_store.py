@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from analysis.utils.file_utils import find_fasta_file
+from lib.analysis.hit_store import HitStore
+from lib.analysis.motif_presets import MotifPresets
+from lib.analysis.organism_presets import OrganismPresets
+from lib.genes.gene_list import GeneList
+
+
+class Command(BaseCommand):
+    help = "Precomputes the hits of all preset motifs in organism FASTA files, used by the analysis when present."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'filenames', nargs='*',
+            help="Organism filenames in DATA_DIR/fasta_files (defaults to all preset organisms)"
+        )
+
+    def handle(self, *args, **options):
+        filenames = options['filenames'] or [organism.filename for organism in OrganismPresets.get_organisms()]
+        motifs = MotifPresets.get_presets()
+        if not motifs:
+            self.stderr.write("No preset motifs found")
+            return
+
+        for filename in filenames:
+            file_path = find_fasta_file(filename)
+            if not file_path:
+                self.stderr.write(f"{filename}: file not found")
+                continue
+
+            try:
+                gene_list = GeneList.load_from_file(file_path)
+                store = HitStore.build(gene_list, motifs)
+                store.save(HitStore.path_for(file_path), fasta_path=file_path)
+            except Exception as e:
+                self.stderr.write(f"{filename}: {e}")
+                continue
+
+            self.stdout.write(
+                f"{filename}: stored {len(store.gene_deltas)} hits of {len(store.motifs)} motifs "
+                f"in {len(gene_list.genes)} genes"
+            )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from analysis.utils.file_utils import find_fasta_file
+from lib.analysis.kmer_index import KmerIndex
+from lib.analysis.organism_presets import OrganismPresets
+from lib.genes.gene_list import GeneList
+
+
+class Command(BaseCommand):
+    help = "Builds the k-mer index of organism FASTA files, used by the analysis when present."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'filenames', nargs='*',
+            help="Organism filenames in DATA_DIR/fasta_files (defaults to all preset organisms)"
+        )
+        parser.add_argument('--k', type=int, default=KmerIndex.DEFAULT_K, help="k-mer length")
+
+    def handle(self, *args, **options):
+        filenames = options['filenames'] or [organism.filename for organism in OrganismPresets.get_organisms()]
+
+        for filename in filenames:
+            file_path = find_fasta_file(filename)
+            if not file_path:
+                self.stderr.write(f"{filename}: file not found")
+                continue
+
+            try:
+                gene_list = GeneList.load_from_file(file_path)
+                index = KmerIndex.build(gene_list, k=options['k'])
+                index.save(KmerIndex.path_for(file_path), fasta_path=file_path)
+            except Exception as e:
+                self.stderr.write(f"{filename}: {e}")
+                continue
+
+            self.stdout.write(
+                f"{filename}: indexed {len(index.positions)} windows of {len(index.gene_ids)} genes "
+                f"({int(index.irregular.sum())} scanned live)"
+            )
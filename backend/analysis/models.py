@@ -1,3 +1,5 @@
+import uuid
+
 from django.contrib.auth.models import User, Group
 from django.core.exceptions import ValidationError
 from django.db import models
@@ -19,6 +21,56 @@ class AnalysisHistory(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
 
+class AnalysisJob(models.Model):
+    """
+    An analysis run in the background, see `analysis.jobs`.
+    The table is the job queue: server processes claim queued jobs and record progress and results here.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    )
+    ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='analysis_jobs'
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    organism = models.CharField(max_length=255)
+    organism_filename = models.CharField(max_length=255)
+    motifs = models.JSONField(default=list)
+    stages = models.JSONField(default=list)
+    settings = models.JSONField(default=dict)
+    progress = models.FloatField(default=0.0)
+    cancel_requested = models.BooleanField(default=False)
+    filtered_results = models.JSONField(null=True, blank=True)
+    history = models.ForeignKey(
+        AnalysisHistory,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='jobs'
+    )
+    error = models.TextField(blank=True, default='')
+    worker = models.CharField(max_length=255, blank=True, default='')
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+
 class OrganismAccess(models.Model):
     PUBLIC = 'public'
     GROUP = 'group'
@@ -0,0 +1,248 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from lib.utilities.array_store import content_hash
+
+# Bump when the analysis changes its results, so older cache entries are not served
+CACHE_VERSION = 1
+
+
+class ResultCache:
+    """
+    Analysis results by a hash of everything they depend on, see `analysis_key`.
+
+    Results are kept in memory (least recently used first out) and in a directory of JSON files
+    (least recently read first out), both bounded by their encoded size. Entries never need
+    invalidation: changed inputs, including the content of the FASTA file, give a different key.
+
+    Concurrent computations of the same key are coalesced across the processes of a host with a
+    lock file per key (see `get_or_compute`): the first one computes, the others wait for its lock
+    and then read the result from the disk tier. Without the disk tier, they are not coalesced.
+    """
+
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = ResultCache(
+                memory_bytes=settings.RESULT_CACHE_MEMORY_MB << 20,
+                disk_dir=str(settings.RESULT_CACHE_DIR),
+                disk_bytes=settings.RESULT_CACHE_DISK_MB << 20,
+            )
+        return cls._instance
+
+    def __init__(self, memory_bytes: int, disk_dir: Optional[str], disk_bytes: int):
+        """
+        :param memory_bytes: Size limit of the memory tier, 0 disables it
+        :param disk_dir: Directory of the disk tier
+        :param disk_bytes: Size limit of the disk tier, 0 disables it
+        """
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir if disk_dir and disk_bytes > 0 else None
+        self.disk_bytes = disk_bytes
+        self.lock_dir = os.path.join(self.disk_dir, "locks") if self.disk_dir else None
+        self._memory: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry[0]
+
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                encoded = f.read()
+            value = json.loads(encoded)
+            # The modification time orders the disk tier for eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+
+        self._remember(key, value, len(encoded))
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        encoded = json.dumps(value).encode()
+        self._remember(key, value, len(encoded))
+
+        if self.disk_dir is None or len(encoded) > self.disk_bytes:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            path = self._disk_path(key)
+            tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            with open(tmp_path, 'wb') as f:
+                f.write(encoded)
+            os.replace(tmp_path, path)
+            self._evict_disk()
+        except OSError as e:
+            print(f"[DEBUG] Could not write analysis result cache entry: {e}")
+
+    async def get_or_compute(self, key: str,
+                             compute: Callable[[], Awaitable[Optional[Any]]]) -> Tuple[Optional[Any], bool]:
+        """
+        Returns the cached value of a key, computing it if no other request is computing it already.
+
+        Waiting callers get the value from the disk tier. Without the disk tier every caller computes
+        on its own. Callers that waited for a computation that left nothing on disk (it failed, its
+        result exceeds the disk tier or could not be written) compute at once, not one after another.
+        :param compute: Computes the value, returning None on failure (which is not cached)
+        :return: The value, and whether it came from the cache
+        """
+        value = self.get(key)
+        if value is not None:
+            return value, True
+        if self.disk_dir is None:
+            return await self._compute(key, compute), False
+
+        async with self.single_flight(key) as waited:
+            value = self.get(key)
+            if value is not None:
+                return value, True
+            if not waited:
+                return await self._compute(key, compute), False
+        return await self._compute(key, compute), False
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+        value = await compute()
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    @asynccontextmanager
+    async def single_flight(self, key: str):
+        """
+        Holds the lock of a key, waiting while another thread or process of this host holds it.
+        Callers should check the cache again once they have the lock.
+        :return: Whether the lock was held by someone else meanwhile
+        """
+        fd, waited = await asyncio.get_running_loop().run_in_executor(None, self._lock_key, key)
+        try:
+            yield waited
+        finally:
+            self._unlock_key(key, fd)
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(self.lock_dir, f"{key}.lock")
+
+    def _lock_key(self, key: str) -> Tuple[int, bool]:
+        os.makedirs(self.lock_dir, exist_ok=True)
+        path = self._lock_path(key)
+        waited = False
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                waited = True
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                    return fd, waited
+            except FileNotFoundError:
+                pass
+            # The previous holder removed the file while we waited, lock the current one
+            waited = True
+            os.close(fd)
+
+    def _unlock_key(self, key: str, fd: int) -> None:
+        # Removed before unlocking, so no lock files are left behind
+        try:
+            os.unlink(self._lock_path(key))
+        except OSError:
+            pass
+        os.close(fd)
+
+    def _remember(self, key: str, value: Any, size: int) -> None:
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_used -= previous[1]
+            self._memory[key] = (value, size)
+            self._memory_used += size
+            while self._memory_used > self.memory_bytes:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_used -= evicted_size
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _evict_disk(self) -> None:
+        entries = []
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        used = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if used <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            used -= size
+
+
+def analysis_key(file_path: str, organism, gene_model) -> str:
+    """
+    Canonical hash of the inputs of an analysis: the FASTA content, the motifs (names and definitions),
+    the stages in order, the stage selection and the analysis options.
+    """
+    stage_selection = gene_model.getSelectedStages()
+    options = gene_model.getOptions()
+    inputs: Dict[str, Any] = {
+        "version": CACHE_VERSION,
+        "fasta": content_hash(file_path),
+        "take_first_transcript_only": bool(organism.take_first_transcript_only) if organism else None,
+        "motifs": [[motif.name, list(motif.definitions)] for motif in gene_model.getMotifs()],
+        "stages": list(stage_selection.selectedStages),
+        "strategy": stage_selection.strategy.value if stage_selection.strategy else None,
+        "selection": stage_selection.selection.value if stage_selection.selection else None,
+        "percentile": stage_selection.percentile,
+        "count": stage_selection.count,
+        "min": options.min,
+        "max": options.max,
+        "bucket_size": options.bucketSize,
+        "align_marker": options.alignMarker,
+    }
+    canonical = json.dumps(inputs, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def apply_stage_colors(filtered_results: List[Dict[str, Any]],
+                       stage_color_preferences: Dict[str, str]) -> List[Dict[str, Any]]:
+    """Returns cached results with the user's stage colors, leaving the cached entries unchanged."""
+    colored = []
+    for result in filtered_results:
+        name = result["name"]
+        stage_name = name.split(' - ')[0] if ' - ' in name else name
+        color = stage_color_preferences.get(stage_name)
+        if color is None:
+            colored.append(result)
+        else:
+            colored.append({**result, "color": color, "distribution": {**result["distribution"], "color": color}})
+    return colored
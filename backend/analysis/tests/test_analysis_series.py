@@ -0,0 +1,53 @@
+import random
+import unittest
+from unittest import mock
+
+from analysis.tests.utils import baseline_matches, random_sequence
+from lib.analysis.analysis_series import AnalysisSeries
+from lib.analysis.motif import Motif
+from lib.analysis.motif_scanner import Re2MotifScanner
+from lib.genes.gene_list import GeneList
+from lib.genes.genes import Gene
+
+MOTIFS = [
+    Motif("box", ["TATAAA", "CACGTG"]),
+    Motif("palindrome", ["ACGT"]),
+    Motif("degenerate", ["NRY", "WWSW"]),
+    Motif("repeat", ["AA"]),
+]
+
+
+def gene_list_of(sequences):
+    genes = [Gene(f"G{i}.1", sequence, f">G{i}.1", []) for i, sequence in enumerate(sequences)]
+    return GeneList.from_list(genes=genes, errors=[])
+
+
+class MultiMotifScanTest(unittest.TestCase):
+    """All motifs scanned in one pass find what scanning every motif definition on its own found"""
+
+    def test_matches_per_motif_scan(self):
+        rng = random.Random(1)
+        gene_list = gene_list_of([random_sequence(rng, rng.randint(0, 400), "ACGTN") for _ in range(120)])
+
+        for no_overlaps in (True, False):
+            series = AnalysisSeries.run_many(gene_list, MOTIFS, [m.name for m in MOTIFS], ["#000000"] * len(MOTIFS),
+                                             0, 400, 30, no_overlaps=no_overlaps, backend='re2')
+            for motif, motif_series in zip(MOTIFS, series):
+                found = sorted((r.gene.geneId, r.raw_position, r.match, r.matched_sequence) for r in motif_series.result)
+                expected = sorted(
+                    (gene.geneId, *match)
+                    for gene in gene_list.genes
+                    for match in baseline_matches(gene.data, motif, no_overlaps)
+                )
+                self.assertEqual(found, expected, f"{motif.name}, no_overlaps={no_overlaps}")
+
+    def test_scan_failure_fails_the_analysis(self):
+        gene_list = gene_list_of(["ACGTACGT", "TATAAA"])
+        with mock.patch.object(Re2MotifScanner, 'scan_genes', side_effect=RuntimeError("scan failed")):
+            with self.assertRaises(RuntimeError):
+                AnalysisSeries.run_many(gene_list, MOTIFS, [m.name for m in MOTIFS], ["#000000"] * len(MOTIFS),
+                                        0, 400, 30, backend='re2')
+
+
+if __name__ == '__main__':
+    unittest.main()
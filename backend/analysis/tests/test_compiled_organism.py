@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from analysis.tests.utils import write_fasta
+from lib.genes.compiled_organism import CompiledOrganism
+from lib.genes.gene_list import GeneList
+
+
+class CompiledOrganismTest(unittest.TestCase):
+    """Compiled organisms hold the genes of their FASTA file and are ignored once it changes"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.fasta_path = f"{self.directory}/organism.fasta"
+        write_fasta(self.fasta_path, 120, seed=2)
+        self.parsed = GeneList.parse_file(self.fasta_path)
+        CompiledOrganism.compile(CompiledOrganism.path_for(self.fasta_path), self.parsed.columns, self.parsed.errors,
+                                 fasta_path=self.fasta_path)
+
+    def assertSameGenes(self, compiled):
+        self.assertIsNotNone(compiled)
+        self.assertEqual([gene.to_dict() for gene in compiled.columns().genes()],
+                         [gene.to_dict() for gene in self.parsed.genes])
+
+    def test_for_fasta(self):
+        self.assertSameGenes(CompiledOrganism.for_fasta(self.fasta_path))
+        self.assertSameGenes(CompiledOrganism.for_fasta(CompiledOrganism.path_for(self.fasta_path)))
+
+    def test_changed_source(self):
+        write_fasta(self.fasta_path, 100, seed=3)
+        self.assertIsNone(CompiledOrganism.for_fasta(self.fasta_path))
+
+    def test_missing_source(self):
+        os.remove(self.fasta_path)
+        self.assertSameGenes(CompiledOrganism.for_fasta(self.fasta_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
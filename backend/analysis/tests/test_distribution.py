@@ -0,0 +1,74 @@
+import random
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from lib.analysis.distribution import Distribution
+from lib.genes.gene_list import GeneList
+from lib.genes.genes import Gene
+
+
+def baseline_run(distribution: Distribution, results, total_genes_count: int):
+    """
+    Bins hits like `Distribution.run` did before it was vectorized, one hit at a time.
+    :return: (bucket -> hit count, bucket -> gene IDs, total count, genes with motif)
+    """
+    counts, gene_counts = {}, {}
+    for result in results:
+        offset = 0
+        if distribution.align_marker is not None and distribution.align_marker in result.gene.markers:
+            offset = result.gene.markers[distribution.align_marker]
+        position = result.position - offset
+        if position < distribution.min or position > distribution.max:
+            continue
+        interval_index = int((position - distribution.min) // distribution.bucket_size)
+        counts[interval_index] = counts.get(interval_index, 0) + 1
+        gene_counts.setdefault(interval_index, set()).add(result.gene.geneId)
+    return counts, gene_counts, len(results), len({result.gene.geneId for result in results})
+
+
+class DistributionTest(unittest.TestCase):
+    """The vectorized distribution bins hits like the per-hit loop it replaced"""
+
+    def setUp(self):
+        rng = random.Random(11)
+        genes = [Gene(f"G{i}.1", "", f">G{i}.1", [], markers={"tss": rng.randint(0, 500)} if i % 3 else None)
+                 for i in range(200)]
+        self.gene_list = GeneList.from_list(genes=genes, errors=[])
+        self.gene_indices = np.array([rng.randrange(len(genes)) for _ in range(5000)], dtype=np.int64)
+        self.positions = np.array([rng.randint(-100, 1100) for _ in range(5000)], dtype=np.int64)
+
+    def test_matches_per_hit_loop(self):
+        for minimal, maximal, bucket_size, align_marker in [(0, 1000, 30, None), (0, 990, 30, None),
+                                                           (-200, 600, 50, "tss"), (0, 1000, 1000, "tss")]:
+            with self.subTest(minimal=minimal, maximal=maximal, bucket_size=bucket_size, align_marker=align_marker):
+                self.assertSameBuckets(Distribution(minimal, maximal, bucket_size, "motif", None, align_marker))
+
+    def test_without_hits(self):
+        distribution = Distribution(0, 1000, 30, "motif", None)
+        distribution.run(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), self.gene_list.genes, 200)
+        self.assertEqual(distribution.dataPoints, [])
+        self.assertEqual((distribution.totalCount, distribution.totalGenesWithMotifCount), (0, 0))
+
+    def assertSameBuckets(self, distribution: Distribution):
+        genes = self.gene_list.genes
+        marker_offsets = self.gene_list.marker_offsets(distribution.align_marker) if distribution.align_marker else None
+        distribution.run(self.positions, self.gene_indices, genes, len(genes), marker_offsets)
+
+        results = [SimpleNamespace(gene=genes[gene_index], position=int(position))
+                   for gene_index, position in zip(self.gene_indices.tolist(), self.positions.tolist())]
+        counts, gene_counts, total_count, genes_with_motif = baseline_run(distribution, results, len(genes))
+
+        self.assertEqual(len(distribution.dataPoints), distribution.num_buckets)
+        for i, data_point in enumerate(distribution.dataPoints):
+            self.assertEqual(data_point.count, counts.get(i, 0), data_point.label)
+            self.assertEqual(data_point.genes, gene_counts.get(i, set()), data_point.label)
+            self.assertEqual(data_point.genesCount, len(gene_counts.get(i, set())), data_point.label)
+            self.assertAlmostEqual(data_point.percent, counts.get(i, 0) / total_count)
+        self.assertEqual(distribution.totalCount, total_count)
+        self.assertEqual(distribution.totalGenesWithMotifCount, genes_with_motif)
+
+
+if __name__ == '__main__':
+    unittest.main()
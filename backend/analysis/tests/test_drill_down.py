@@ -0,0 +1,121 @@
+import asyncio
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIClient
+
+from analysis.fasta_cache import FastaCache
+from analysis.tests.utils import write_fasta
+from analysis.views import analysis_views
+from analysis.views.analysis_utils import create_gene_model
+from lib.analysis.analysis_series import AnalysisSeries
+from lib.analysis.hit_store import HitStore
+from lib.analysis.hit_table import HitTable
+from lib.analysis.motif import Motif
+from lib.analysis.organism import Organism
+from lib.genes.gene_list import GeneList
+
+MOTIF = Motif("degenerate", ["NRY", "WWSW"])
+PARAMS = {"percentile": 0.5, "min": 0, "max": 900, "bucket_size": 30}
+
+
+class DrillDownTest(SimpleTestCase):
+    """Drill-downs count the hits of a series by the code matched at a degenerate position"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.fasta_path = f"{self.directory}/organism.fasta"
+        write_fasta(self.fasta_path, 300, seed=6)
+        self.organism = Organism("Organism", "organism.fasta", take_first_transcript_only=False)
+
+        for target, attribute, value in [(FastaCache, '_instance', None),
+                                         (analysis_views, '_drill_down_series', type(analysis_views._drill_down_series)()),
+                                         (analysis_views, '_drill_down_series_used', 0)]:
+            patcher = mock.patch.object(target, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _series(self, stage="s1"):
+        gene_model = create_gene_model([MOTIF], [stage], PARAMS)
+        return asyncio.run(analysis_views._drill_down_series_of(gene_model, self.fasta_path, self.organism, MOTIF,
+                                                                stage))
+
+    def test_counts(self):
+        series = self._series()
+        for pattern, position, bucket_min, bucket_max in [("NRY", None, None, None), ("NRY", 0, None, None),
+                                                         ("NGY", 2, 100, 400), ("WWSW", 2, None, 300)]:
+            with self.subTest(pattern=pattern, position=position):
+                results = series.drill_down(pattern, position, bucket_min=bucket_min, bucket_max=bucket_max)
+                oriented = self._oriented_hits(series, bucket_min, bucket_max)
+                matching = [sequence for sequence in oriented if self._matches(pattern, sequence)]
+                self.assertTrue(results)
+                for result in results:
+                    count = sum(self._matches(result.pattern, sequence) for sequence in matching)
+                    self.assertEqual(result.count, count, result.pattern)
+                    self.assertEqual(result.share, count / len(matching) if matching else None)
+                    self.assertEqual(result.share_of_all, count / len(oriented) if oriented else None)
+
+    def test_hit_store(self):
+        HitStore.build(GeneList.load_from_file(self.fasta_path), [MOTIF]).save(
+            HitStore.path_for(self.fasta_path), fasta_path=self.fasta_path)
+        expected = self._series("__ALL__")
+        FastaCache._instance = None
+
+        with mock.patch.object(AnalysisSeries, '_scan_async', side_effect=AssertionError("scanned")):
+            series = self._series("__ALL__")
+        self.assertEqual([result.to_dict() for result in series.drill_down("NRY")],
+                         [result.to_dict() for result in expected.drill_down("NRY")])
+
+    def test_memory_budget(self):
+        series = self._series()
+        size = analysis_views._series_size(series)
+        with override_settings(DRILL_DOWN_CACHE_MB=1):
+            for key in range((1 << 20) // size + 2):
+                analysis_views._remember_drill_down_series(str(key), series)
+            self.assertLessEqual(analysis_views._drill_down_series_used, 1 << 20)
+            self.assertIsNone(analysis_views._cached_drill_down_series("0"))
+            self.assertIs(analysis_views._cached_drill_down_series(str(key)), series)
+
+    def test_invalid_parameters(self):
+        client = APIClient()
+        body = {"filename": "organism.fasta", "motif": MOTIF.name, "stage": "s1", "params": PARAMS}
+
+        async def motifs(names):
+            return [MOTIF]
+
+        with mock.patch.object(analysis_views.OrganismPresets, 'get_organism_by_filename', return_value=self.organism), \
+                mock.patch.object(analysis_views, 'check_organism_access', return_value=True), \
+                mock.patch.object(analysis_views, 'get_motifs_by_names', motifs), \
+                mock.patch.object(analysis_views, 'find_fasta_file', return_value=self.fasta_path):
+            for extra in ({"position": "first"}, {"position": 1.5}, {"position": 3}, {"bucket": {"min": "x"}},
+                          {"bucket": [0, 100]}, {"pattern": "NRYAA"}, {"pattern": 7}):
+                response = client.post("/api/analysis/drill_down/", {**body, **extra}, format="json")
+                self.assertEqual(response.status_code, 400, extra)
+
+            response = client.post("/api/analysis/drill_down/", {**body, "position": "1"}, format="json")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([result["pattern"] for result in response.json()["results"]], ["NAY", "NGY"])
+
+    @staticmethod
+    def _oriented_hits(series, bucket_min, bucket_max):
+        """The sequences of the hits in a bucket, reverse strand hits reverse complemented"""
+        offsets = series.gene_list.marker_offsets(series.distribution.align_marker) \
+            if series.distribution.align_marker else None
+        sequences = []
+        hits = series.hits
+        for row in range(len(hits)):
+            gene_index = int(hits.gene_indices[row])
+            position = int(hits.positions[row]) - (int(offsets[gene_index]) if offsets is not None else 0)
+            if (bucket_min is not None and position < bucket_min) or (bucket_max is not None and position >= bucket_max):
+                continue
+            start, end = int(hits.raw_positions[row]), int(hits.ends[row])
+            sequence = series.gene_list.genes[gene_index].data[start:end]
+            sequences.append(sequence if hits.strands[row] == HitTable.FORWARD else Motif.reverse_complement(sequence))
+        return sequences
+
+    @staticmethod
+    def _matches(pattern, sequence):
+        return len(pattern) == len(sequence) and Motif.to_reg_exp(pattern, strict=True).search(sequence) is not None
@@ -0,0 +1,62 @@
+import shutil
+import tempfile
+import unittest
+
+from Bio import bgzf
+
+from analysis.tests.utils import write_fasta
+from lib.genes.fasta_reader import FastaBlockIndex
+from lib.genes.gene_list import GeneList
+
+
+class FastaBlockIndexTest(unittest.TestCase):
+    """Genes read through the block index are the genes parsing the whole file gives"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def _compress(self, fasta_path: str) -> str:
+        path = f"{fasta_path}.gz"
+        with open(fasta_path, 'rb') as source, bgzf.BgzfWriter(path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        return path
+
+    def assertReadsParsedGenes(self, path: str, chunk_size: int):
+        index = FastaBlockIndex.build(path, chunk_size=chunk_size)
+        genes = GeneList.parse_file(path).genes
+        self.assertEqual(index.gene_ids.tolist(), [gene.geneId for gene in genes])
+        parsed = {}
+        for gene in genes:
+            parsed.setdefault(gene.geneId, gene.to_dict())
+        for gene_id, gene in parsed.items():
+            read = index.read_gene(path, gene_id)
+            self.assertIsNotNone(read, gene_id)
+            self.assertEqual(read.to_dict(), gene, gene_id)
+        self.assertIsNone(index.read_gene(path, "AT0G0.0"))
+
+    def test_read_gene(self):
+        # Spans several BGZF blocks
+        fasta_path = f"{self.directory}/organism.fasta"
+        write_fasta(fasta_path, 400, seed=5)
+        self.assertReadsParsedGenes(self._compress(fasta_path), 1 << 20)
+
+    def test_header_across_chunks(self):
+        fasta_path = f"{self.directory}/organism.fasta"
+        with open(fasta_path, 'w') as f:
+            f.write(">AT1G1.1 a long header that spans several chunks>of the stream\nACGT\nAC\n")
+            f.write(">AT1G2.1\nGGG\n>AT1G3.1 gene\r\nTT\r\n>AT1G1.1 duplicate\nCC\n>AT1G4.1")
+        path = self._compress(fasta_path)
+        for chunk_size in (1, 2, 3, 7, 16, 64):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertReadsParsedGenes(path, chunk_size)
+
+        write_fasta(fasta_path, 30, seed=6)
+        path = self._compress(fasta_path)
+        for chunk_size in (5, 11, 29):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertReadsParsedGenes(path, chunk_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
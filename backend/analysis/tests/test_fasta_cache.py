@@ -0,0 +1,86 @@
+import shutil
+import tempfile
+import unittest
+
+from analysis.fasta_cache import FastaCache
+from analysis.tests.utils import write_fasta
+
+
+class FastaCacheTest(unittest.TestCase):
+    """Least recently used organisms are evicted once the budget is exceeded, pinned ones are kept"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        # Organisms of the same size
+        self.paths = []
+        for name in ("a", "b", "c"):
+            path = f"{self.directory}/{name}.fasta"
+            write_fasta(path, 40, seed=1)
+            self.paths.append(path)
+        # As loaded by the cache, e.g. through an index
+        measured = self.cache(1 << 40)
+        measured.get_gene_list_sync(self.paths[0])
+        self.size = measured.stats()["used_bytes"]
+
+    def cache(self, budget_bytes: int) -> FastaCache:
+        cache = FastaCache(budget_bytes=budget_bytes)
+        self.addCleanup(lambda: [cache._remove(path) for path in list(cache._entries)])
+        return cache
+
+    def test_least_recently_used_evicted(self):
+        a, b, c = self.paths
+        cache = self.cache(2 * self.size)
+        gene_list = cache.get_gene_list_sync(a)
+        cache.get_gene_list_sync(b)
+        self.assertIs(cache.get_gene_list_sync(a), gene_list)
+        cache.get_gene_list_sync(c)
+
+        self.assertEqual(list(cache._entries), [a, c])
+        self.assertEqual(cache.stats(), {
+            "hits": 1, "misses": 3, "evictions": 1, "entries": 2, "pinned": 0,
+            "used_bytes": 2 * self.size, "budget_bytes": 2 * self.size,
+        })
+        self.assertIs(cache.get_gene_list_sync(a), gene_list)
+        cache.get_gene_list_sync(b)
+        self.assertEqual(list(cache._entries), [a, b])
+        self.assertEqual(cache.stats()["misses"], 4)
+
+    def test_pinned_kept(self):
+        a, b, c = self.paths
+        cache = self.cache(self.size)
+        cache.pin(a)
+        for path in self.paths:
+            cache.get_gene_list_sync(path)
+
+        # Pinned organisms do not count against the budget
+        self.assertEqual(list(cache._entries), [a, c])
+        stats = cache.stats()
+        self.assertEqual((stats["pinned"], stats["evictions"], stats["used_bytes"]), (1, 1, 2 * self.size))
+
+        cache.unpin(a)
+        self.assertEqual(list(cache._entries), [c])
+        self.assertEqual(cache.stats()["used_bytes"], self.size)
+
+    def test_zero_budget(self):
+        a, b, _ = self.paths
+        cache = self.cache(0)
+        cache.pin(a)
+        cache.get_gene_list_sync(a)
+        gene_list = cache.get_gene_list_sync(b)
+
+        self.assertEqual(len(gene_list.genes), 40)
+        self.assertEqual(list(cache._entries), [a])
+
+    def test_changed_file_loaded_again(self):
+        a = self.paths[0]
+        cache = self.cache(3 * self.size)
+        cache.get_gene_list_sync(a)
+        write_fasta(a, 10, seed=2)
+
+        self.assertEqual(len(cache.get_gene_list_sync(a).genes), 10)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
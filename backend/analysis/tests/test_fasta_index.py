@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+import numpy as np
+
+from analysis.fasta_cache import FastaCache
+from analysis.tests.utils import write_fasta
+from lib.genes.fasta_index import FastaIndex
+from lib.genes.gene_list import GeneList
+
+
+class FastaIndexTest(unittest.TestCase):
+    """Organisms loaded through their index have the genes of the parsed file, indexes are not built on load"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.fasta_path = f"{self.directory}/organism.fasta"
+        self.index_path = FastaIndex.path_for(self.fasta_path)
+        write_fasta(self.fasta_path, 120, seed=4, alphabet="ACGTacgtN")
+        with open(self.fasta_path, 'a') as f:
+            # Sequences the layout does not describe, and a record that fails to parse
+            f.write(">AT9G1.1 uneven\nACGTAC\nAC\nACGT\n>AT9G2.1 notes\nACG\n;note\nTTA\n>no id here\nAAA\n")
+        self.parsed = GeneList.parse_file(self.fasta_path)
+        self.addCleanup(self._forget)
+
+    def _forget(self):
+        FastaIndex._opened.pop(self.index_path, None)
+        FastaIndex._unsaved.pop(self.index_path, None)
+
+    def assertSameGenes(self, gene_list):
+        self.assertEqual([gene.to_dict() for gene in gene_list.genes], [gene.to_dict() for gene in self.parsed.genes])
+        self.assertEqual([str(e) for e in gene_list.errors], [str(e) for e in self.parsed.errors])
+
+    def test_lazy_load(self):
+        index = FastaIndex.build(self.fasta_path)
+        index.save(self.index_path)
+        self.assertGreater(index.inline_count, 0)
+
+        gene_list = GeneList.load_from_file(self.fasta_path)
+        self.assertIs(gene_list.columns.indexed, FastaIndex.for_fasta(self.fasta_path))
+        self.assertSameGenes(gene_list)
+
+    def test_not_built_on_load(self):
+        self.assertSameGenes(GeneList.load_from_file(self.fasta_path))
+        self.assertSameGenes(FastaCache(budget_bytes=1 << 30).get_gene_list_sync(self.fasta_path))
+        self.assertFalse(os.path.exists(self.index_path))
+        self.assertIsNone(FastaIndex.for_fasta(self.fasta_path))
+
+    def test_built_at_warm_up(self):
+        cache = FastaCache(budget_bytes=0)
+        cache.pin(self.fasta_path)
+        cache.warm_up()
+        self.addCleanup(cache._remove, self.fasta_path)
+
+        self.assertTrue(os.path.isdir(self.index_path))
+        self.assertIsNotNone(cache.get_gene_list_sync(self.fasta_path).columns.indexed)
+        self.assertSameGenes(cache.get_gene_list_sync(self.fasta_path))
+
+    def test_failed_save_not_retried(self):
+        with mock.patch.object(FastaIndex, 'save', side_effect=OSError("read-only")) as save:
+            for _ in range(2):
+                FastaIndex._opened.pop(self.index_path, None)
+                index = FastaIndex.for_fasta(self.fasta_path, build=True)
+                self.assertSameGenes(GeneList.from_index(index, source=self.fasta_path))
+            self.assertEqual(save.call_count, 1)
+
+            # A changed file is saved again
+            write_fasta(self.fasta_path, 10, seed=5)
+            FastaIndex.for_fasta(self.fasta_path, build=True)
+            self.assertEqual(save.call_count, 2)
+
+
+class ParallelBuildTest(unittest.TestCase):
+    """Indexes built from byte ranges parsed in parallel are the index built in one pass"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.executor = ProcessPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+
+    def assertSameIndex(self, fasta_path: str, range_bytes: int):
+        serial = FastaIndex.build(fasta_path)
+        with mock.patch.object(FastaIndex, 'RANGE_BYTES', range_bytes):
+            parallel = FastaIndex.build(fasta_path, executor=self.executor)
+
+        self.assertEqual(parallel.meta, serial.meta)
+        self.assertEqual(parallel._arrays.keys(), serial._arrays.keys())
+        for key, array in serial._arrays.items():
+            np.testing.assert_array_equal(parallel._arrays[key], array, err_msg=key)
+        parsed = GeneList.parse_file(fasta_path)
+        self.assertEqual([gene.to_dict() for gene in GeneList.from_index(parallel, source=fasta_path).genes],
+                         [gene.to_dict() for gene in parsed.genes])
+
+    def test_build(self):
+        fasta_path = f"{self.directory}/organism.fasta"
+        write_fasta(fasta_path, 300, seed=8)
+        with open(fasta_path, 'a') as f:
+            f.write(">AT9G1.1 a>b\nACGTAC\nAC>AT9G2.1\r\nGG\r\n>no id here\nAAA\n>\n>AT9G3.1")
+        for range_bytes in (1, 97, 4096, 1 << 20):
+            with self.subTest(range_bytes=range_bytes):
+                self.assertSameIndex(fasta_path, range_bytes)
+
+    def test_empty_file(self):
+        fasta_path = f"{self.directory}/empty.fasta"
+        open(fasta_path, 'w').close()
+        self.assertSameIndex(fasta_path, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
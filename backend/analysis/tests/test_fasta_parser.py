@@ -0,0 +1,73 @@
+import shutil
+import tempfile
+import unittest
+
+from analysis.tests.utils import write_fasta
+from lib.genes.fasta_parser import iter_fasta_records, iter_string_lines
+from lib.genes.gene_list import GeneList
+from lib.genes.genes import Gene
+
+SAMPLES = [
+    "",
+    "\n\n",
+    ">AT1G1.1 gene\nACGT\nAC\n>AT1G2.1\nGGG\n",
+    ">AT1G1.1 gene\nACGT",
+    # `>` inside headers and sequence lines starts a new record, like `split('>')` does
+    ">AT1G1.1 a>b\nACGT\n>AT1G2.1\nAC>AT1G3.1\nGT\n",
+    ">>AT1G1.1\nACGT\n>\n>  \n\n>AT1G2.1\nGG\n\n\n",
+    "junk before\n>AT1G1.1\nACGT\n",
+    # Windows line ends
+    ">AT1G1.1 gene\r\n;TRANSCRIPTION_RATES {\"s1\": 1}\r\nACGT\r\nAC\r\n>AT1G2.1\r\nGG\r\n",
+    ">AT1G1.1\n;MARKERS {\"tss\": 2}\nAC\n>AT1G1.1\nTT\n>no id here\nAAA\n",
+]
+
+
+def baseline_records(data: str):
+    """Records of FASTA data as the organism loader cut them before it parsed record by record"""
+    return [('>' + chunk).split('\n') for chunk in data.split('>') if chunk.strip()]
+
+
+class FastaParserTest(unittest.TestCase):
+    """Parsing record by record gives the records (and genes) of splitting the whole file at `>`"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_records(self):
+        for data in SAMPLES + [self._random_fasta()]:
+            with self.subTest(data=data[:40]):
+                self.assertEqual(list(iter_fasta_records(iter_string_lines(data))), baseline_records(data))
+
+    def test_files(self):
+        for i, data in enumerate(SAMPLES + [self._random_fasta()]):
+            path = f"{self.directory}/{i}.fasta"
+            with open(path, 'w', newline='') as f:
+                f.write(data)
+            with self.subTest(data=data[:40]):
+                # Both read the file in text mode, which translates line ends
+                with open(path, 'r') as f:
+                    expected = baseline_records(f.read())
+                with open(path, 'r') as f:
+                    self.assertEqual(list(iter_fasta_records(f)), expected)
+
+                expected_genes, expected_errors = [], []
+                for record in expected:
+                    try:
+                        expected_genes.append(Gene.from_fasta(record))
+                    except Exception as e:
+                        expected_errors.append(str(e))
+                gene_list = GeneList.parse_file(path)
+                self.assertEqual([gene.to_dict() for gene in gene_list.genes],
+                                 [gene.to_dict() for gene in expected_genes])
+                self.assertEqual([str(error) for error in gene_list.errors], expected_errors)
+
+    def _random_fasta(self) -> str:
+        path = f"{self.directory}/random.fasta"
+        write_fasta(path, 200, seed=9)
+        with open(path) as f:
+            return f.read()
+
+
+if __name__ == '__main__':
+    unittest.main()
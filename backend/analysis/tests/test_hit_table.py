@@ -0,0 +1,92 @@
+import random
+import unittest
+
+import numpy as np
+
+from lib.analysis.hit_table import HitTable, first_fit
+
+
+def baseline_filter(hits):
+    """
+    Non-overlap filtering like the analysis did before it was vectorized: hits of one gene
+    sorted by position (ties in table order), then each kept if it starts at or after the end
+    of the last kept hit.
+    :param hits: (row, start, end) of the hits of one group, in table order
+    :return: Rows of the kept hits
+    """
+    kept, last_end = [], None
+    for row, start, end in sorted(hits, key=lambda hit: hit[1]):
+        if last_end is None or start >= last_end:
+            kept.append(row)
+            last_end = end
+    return kept
+
+
+class HitTableTest(unittest.TestCase):
+    """Vectorized non-overlap filtering keeps the hits of the greedy per-gene loop"""
+
+    def setUp(self):
+        rng = random.Random(13)
+        self.definitions = ["AC", "TATAAA", "NRY", "CACGTGNNNNCACGTG", "A"]
+        count = 4000
+        self.table = HitTable(
+            self.definitions,
+            np.array([rng.randrange(60) for _ in range(count)]),
+            np.array([rng.randrange(500) for _ in range(count)]),
+            np.array([rng.randrange(len(self.definitions)) for _ in range(count)]),
+            np.array([rng.randrange(2) for _ in range(count)]),
+        )
+        # Scanners report hits grouped by gene, in definition order and then by position
+        self.table = self.table.take(np.lexsort((self.table.raw_positions, self.table.definition_ids,
+                                                 self.table.gene_indices)))
+
+    def test_first_fit(self):
+        rng = random.Random(17)
+        for _ in range(20):
+            count = rng.randint(0, 300)
+            groups = np.sort(np.array([rng.randrange(5) for _ in range(count)], dtype=np.int64))
+            starts = np.array([rng.randrange(200) for _ in range(count)], dtype=np.int64)
+            order = np.lexsort((starts, groups))
+            groups, starts = groups[order], starts[order]
+            ends = starts + np.array([rng.randint(1, 30) for _ in range(count)], dtype=np.int64)
+
+            expected = [
+                row
+                for group in set(groups.tolist())
+                for row in baseline_filter([(row, int(starts[row]), int(ends[row]))
+                                            for row in np.flatnonzero(groups == group)])
+            ]
+            self.assertEqual(np.flatnonzero(first_fit(groups, starts, ends)).tolist(), sorted(expected))
+
+    def test_without_overlaps(self):
+        self.assertEqual(self._rows(self.table.without_overlaps()), self._expected(lambda row: 0))
+
+    def test_without_overlaps_by_strand(self):
+        self.assertEqual(self._rows(self.table.without_overlaps(by_strand=True)),
+                         self._expected(lambda row: int(self.table.strands[row])))
+
+    def _expected(self, strand_of):
+        """The kept hits by the baseline filter, within every gene and group of `strand_of`"""
+        groups = {}
+        for row in range(len(self.table)):
+            groups.setdefault((int(self.table.gene_indices[row]), strand_of(row)), []).append(
+                (row, int(self.table.raw_positions[row]), int(self.table.ends[row])))
+        kept = [row for hits in groups.values() for row in baseline_filter(hits)]
+        return sorted(self._hit(row) for row in kept)
+
+    def _rows(self, table):
+        hits = [(int(table.gene_indices[row]), int(table.raw_positions[row]),
+                 table.definitions[int(table.definition_ids[row])], int(table.strands[row]))
+                for row in range(len(table))]
+        # Kept hits are ordered by gene and position
+        self.assertEqual(hits, sorted(hits, key=lambda hit: hit[:2]))
+        return sorted(hits)
+
+    def _hit(self, row):
+        table = self.table
+        return (int(table.gene_indices[row]), int(table.raw_positions[row]),
+                self.definitions[int(table.definition_ids[row])], int(table.strands[row]))
+
+
+if __name__ == '__main__':
+    unittest.main()
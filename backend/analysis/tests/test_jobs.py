@@ -0,0 +1,104 @@
+import asyncio
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from analysis import jobs
+from analysis.fasta_cache import FastaCache
+from analysis.models import AnalysisJob
+from analysis.result_cache import ResultCache
+from analysis.tests.utils import STAGES, write_fasta
+from analysis.views.analysis_utils import create_gene_model
+from lib.analysis.motif import Motif
+from lib.analysis.organism import Organism
+from lib.genes.gene_model import GeneModel
+
+MOTIFS = [
+    Motif("box", ["TATAAA", "CACGTG"]),
+    Motif("degenerate", ["NRY"]),
+]
+
+
+class JobTest(TransactionTestCase):
+    """Jobs run to completion, stop when cancelled and are failed once their worker is gone"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.fasta_path = f"{self.directory}/organism.fasta"
+        write_fasta(self.fasta_path, 200, seed=4)
+        self.organism = Organism("Organism", "organism.fasta", take_first_transcript_only=False)
+        self.user = User.objects.create(username="user")
+
+        cache = ResultCache(memory_bytes=64 << 20, disk_dir=f"{self.directory}/results", disk_bytes=64 << 20)
+        for target, attribute, value in [(ResultCache, '_instance', cache),
+                                         (FastaCache, '_instance', None),
+                                         (jobs, 'POLL_INTERVAL', 0.01),
+                                         (jobs, '_prepare', self._prepare)]:
+            patcher = mock.patch.object(target, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _prepare(self, job):
+        return create_gene_model(MOTIFS, job.stages, job.settings), self.fasta_path, self.organism
+
+    def _job(self, **fields) -> AnalysisJob:
+        return AnalysisJob.objects.create(user=self.user, organism="Organism", organism_filename="organism.fasta",
+                                          motifs=[motif.name for motif in MOTIFS], stages=STAGES, **fields)
+
+    def test_run(self):
+        self.assertIsNone(jobs._claim("worker"))
+
+        self._job()
+        job = jobs._claim("worker")
+        self.assertEqual(job.status, AnalysisJob.RUNNING)
+        jobs._run(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.DONE, job.error)
+        self.assertEqual(len(job.filtered_results), len(MOTIFS) * len(STAGES))
+        self.assertIsNotNone(job.history)
+
+    def test_cancel_queued(self):
+        job = jobs.cancel(self._job())
+        self.assertEqual(job.status, AnalysisJob.CANCELLED)
+        self.assertIsNone(jobs._claim("worker"))
+
+    def test_cancel_running(self):
+        self._job()
+        job = jobs._claim("worker")
+        self.assertTrue(jobs.cancel(job).cancel_requested)
+
+        load = GeneModel.loadFastaFromFile
+
+        async def slow_load(gene_model, *args):
+            # Leaves the monitor time to pick up the cancellation
+            await asyncio.sleep(0.3)
+            await load(gene_model, *args)
+
+        with mock.patch.object(GeneModel, 'loadFastaFromFile', slow_load):
+            jobs._run(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.CANCELLED)
+        self.assertIsNone(job.filtered_results)
+        self.assertIsNone(ResultCache.get_instance().get(
+            jobs.analysis_key(self.fasta_path, self.organism, self._prepare(job)[0])))
+
+    def test_stale_jobs(self):
+        now = timezone.now()
+        stale = self._job(status=AnalysisJob.RUNNING, heartbeat_at=now - jobs.STALE_AFTER - timedelta(seconds=1))
+        alive = self._job(status=AnalysisJob.RUNNING, heartbeat_at=now)
+
+        jobs._fail_stale_jobs()
+
+        stale.refresh_from_db()
+        alive.refresh_from_db()
+        self.assertEqual(stale.status, AnalysisJob.FAILED)
+        self.assertTrue(stale.error)
+        self.assertEqual(alive.status, AnalysisJob.RUNNING)
@@ -0,0 +1,64 @@
+import random
+import re
+import unittest
+
+from analysis.tests.utils import random_sequence
+from lib.analysis.motif import Motif
+from lib.analysis.motif_scanner import get_scanner
+
+MOTIFS = [
+    Motif("box", ["TATAAA", "CACGTG"]),
+    Motif("palindrome", ["ACGT"]),
+    Motif("degenerate", ["NRY", "WWSW"]),
+    Motif("repeat", ["AA"]),
+]
+
+# Concrete and degenerate codes, unknown characters and lowercase nucleotides
+ALPHABET = "ACGTACGTACGTNRYWX" + "acgt"
+
+
+def hits(table, definitions):
+    return sorted(
+        (int(gene), int(position), definitions[int(definition)])
+        for gene, position, definition in zip(table.gene_indices, table.raw_positions, table.definition_ids)
+    )
+
+
+class BitmaskScannerTest(unittest.TestCase):
+    """The bitmask backend finds the matches of the re2 backend, and every overlapping match on request"""
+
+    def setUp(self):
+        rng = random.Random(3)
+        self.sequences = [random_sequence(rng, rng.randint(0, 300), ALPHABET) for _ in range(80)] + ["", "AAAA"]
+
+    def test_non_overlapping_matches_re2(self):
+        re2_tables = get_scanner(MOTIFS, 're2').scan_many(self.sequences)
+        scanner = get_scanner(MOTIFS, 'bitmask')
+        for motif, expected, table in zip(MOTIFS, re2_tables, scanner.scan_many(self.sequences)):
+            self.assertEqual(hits(table, table.definitions), hits(expected, expected.definitions), motif.name)
+
+    def test_overlapping_matches(self):
+        scanner = get_scanner(MOTIFS, 'bitmask', overlapping=True)
+        for motif, table in zip(MOTIFS, scanner.scan_many(self.sequences)):
+            expected = sorted(
+                (gene, match.start(), definition)
+                for gene, sequence in enumerate(self.sequences)
+                for definition in dict.fromkeys(motif.definitions + motif.reverse_definitions)
+                # A lookahead finds a match at every position, also where matches overlap
+                for match in re.finditer(f"(?=({Motif.to_pattern(definition)}))", sequence)
+            )
+            self.assertEqual(hits(table, table.definitions), expected, motif.name)
+
+    def test_overlapping_counts_every_repeat(self):
+        sequences = ["AAAA"]
+        motifs = [Motif("repeat", ["AA"])]
+        self.assertEqual(len(get_scanner(motifs, 'bitmask').scan_many(sequences)[0]), 2)
+        self.assertEqual(len(get_scanner(motifs, 'bitmask', overlapping=True).scan_many(sequences)[0]), 3)
+
+    def test_re2_rejects_overlapping(self):
+        with self.assertRaises(ValueError):
+            get_scanner(MOTIFS, 're2', overlapping=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
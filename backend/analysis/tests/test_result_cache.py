@@ -0,0 +1,162 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from analysis.result_cache import ResultCache
+
+
+def entry(size: int):
+    """A value whose JSON encoding takes `size` bytes"""
+    return ["x" * (size - 4)]
+
+
+class ResultCacheTest(unittest.TestCase):
+    """Both tiers evict the least recently used entries once over their size"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def _cache(self, memory_bytes=1000, disk_bytes=1000):
+        return ResultCache(memory_bytes=memory_bytes, disk_dir=f"{self.directory}/results", disk_bytes=disk_bytes)
+
+    def test_memory_eviction(self):
+        cache = self._cache(memory_bytes=1000, disk_bytes=0)
+        for key in "abc":
+            cache.put(key, entry(400))
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), entry(400))
+
+        # `b` was used more recently than `c`
+        cache.put("d", entry(400))
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.get("b"), entry(400))
+        self.assertEqual(cache.get("d"), entry(400))
+
+        cache.put("e", entry(2000))
+        self.assertIsNone(cache.get("e"))
+
+    def test_disk_eviction(self):
+        cache = self._cache(memory_bytes=0, disk_bytes=1000)
+        for i, key in enumerate("abc"):
+            cache.put(key, entry(400))
+            # Reads and writes order the entries by modification time
+            os.utime(cache._disk_path(key), ns=(i * 10 ** 9, i * 10 ** 9))
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), entry(400))
+
+        cache.put("d", entry(400))
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.get("b"), entry(400))
+        self.assertEqual(cache.get("d"), entry(400))
+
+        # Other processes see the disk tier
+        self.assertEqual(self._cache(memory_bytes=0).get("d"), entry(400))
+
+    def test_waiters_without_disk_result(self):
+        # Results over the size of the disk tier cannot be handed to the waiting callers
+        cache = self._cache(memory_bytes=0, disk_bytes=100)
+        running, overlapped = set(), []
+
+        async def compute(name):
+            running.add(name)
+            await asyncio.sleep(0.2)
+            overlapped.append(set(running))
+            running.discard(name)
+            return entry(400)
+
+        async def run():
+            first = asyncio.ensure_future(cache.get_or_compute("key", lambda: compute("first")))
+            await asyncio.sleep(0.05)
+            waiters = [cache.get_or_compute("key", lambda name=name: compute(name)) for name in ("second", "third")]
+            return await asyncio.gather(first, *waiters)
+
+        results = asyncio.run(run())
+        self.assertEqual([cached for _, cached in results], [False, False, False])
+        # The waiters computed together once the first computation was done, not one after another
+        self.assertIn({"second", "third"}, overlapped)
+        self.assertNotIn("first", set().union(*overlapped[1:]))
+
+    def test_without_disk_tier(self):
+        cache = self._cache(memory_bytes=0, disk_bytes=0)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return entry(10)
+
+        async def run():
+            return await asyncio.gather(*[cache.get_or_compute("key", compute) for _ in range(3)])
+
+        asyncio.run(run())
+        self.assertEqual(len(calls), 3)
+        self.assertFalse(os.path.exists(f"{self.directory}/results"))
+
+
+def compute_in_process(directory: str, started, results) -> None:
+    """Computes "key" in another process, holding the lock until `started` is acknowledged"""
+    cache = ResultCache(memory_bytes=1000, disk_dir=f"{directory}/results", disk_bytes=1000)
+
+    async def compute():
+        started.set()
+        await asyncio.sleep(0.5)
+        return ["other process"]
+
+    results.put(asyncio.run(cache.get_or_compute("key", compute)))
+
+
+class SingleFlightTest(unittest.TestCase):
+    """Concurrent callers of the same key compute it once and share the result"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.cache = ResultCache(memory_bytes=1000, disk_dir=f"{self.directory}/results", disk_bytes=1000)
+
+    def test_concurrent_callers(self):
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return ["result"]
+
+        async def run():
+            return await asyncio.gather(*[self.cache.get_or_compute("key", compute) for _ in range(2)])
+
+        self.assertEqual(sorted(asyncio.run(run()), key=lambda result: result[1]),
+                         [(["result"], False), (["result"], True)])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(os.listdir(self.cache.lock_dir), [])
+
+    def test_other_process(self):
+        context = multiprocessing.get_context("spawn")
+        started, results = context.Event(), context.Queue()
+        process = context.Process(target=compute_in_process, args=(self.directory, started, results))
+        process.start()
+        self.addCleanup(process.join)
+        self.assertTrue(started.wait(30))
+
+        async def compute():
+            raise AssertionError("computed twice")
+
+        self.assertEqual(asyncio.run(self.cache.get_or_compute("key", compute)), (["other process"], True))
+        self.assertEqual(results.get(timeout=30), (["other process"], False))
+
+    def test_failed_computation(self):
+        async def fail():
+            return None
+
+        async def compute():
+            return ["result"]
+
+        self.assertEqual(asyncio.run(self.cache.get_or_compute("key", fail)), (None, False))
+        self.assertEqual(asyncio.run(self.cache.get_or_compute("key", compute)), (["result"], False))
+
+
+if __name__ == '__main__':
+    unittest.main()
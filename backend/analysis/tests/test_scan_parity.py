@@ -0,0 +1,139 @@
+import asyncio
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import settings
+from analysis.tests.utils import STAGES, write_fasta
+from lib.analysis.analysis_series import AnalysisSeries
+from lib.analysis.hit_store import HitStore
+from lib.analysis.motif import Motif
+from lib.analysis.sequence_buffer import SequenceBuffer
+from lib.analysis.worker_pool import PRELOAD, get_process_pool, shutdown_process_pool, is_resident
+from lib.genes.fasta_index import FastaIndex
+from lib.genes.gene_list import GeneList
+from lib.genes.stage_selection import StageSelection, FilterStrategy, FilterSelection
+
+MOTIFS = [
+    Motif("box", ["TATAAA", "CACGTG"]),
+    Motif("degenerate", ["NRY"]),
+    Motif("weak", ["WWSW"]),
+]
+
+
+class ScanParityTest(unittest.TestCase):
+    """
+    Analyses of an indexed plain FASTA file find the same hits whichever way the sequences reach
+    the scan: live from the genes, from the sequence buffer, from a HitStore or from workers
+    holding the organism (`preload` pool mode). Stage filters sort the organism's genes by
+    expression level before the sequence buffer is published, so rows in file order and rows
+    in gene list order differ.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fasta_path = f"{self.directory}/organism.fasta"
+        write_fasta(self.fasta_path, 450, seed=7)
+        # Indexed like by the `build_fasta_index` management command
+        FastaIndex.build(self.fasta_path).save(FastaIndex.path_for(self.fasta_path))
+        # Scanned live, from genes that are not rows of a loaded organism
+        parsed = GeneList.parse_file(self.fasta_path)
+        self.expected = self._analyze(GeneList.from_list(genes=parsed.genes, errors=parsed.errors))
+
+    def tearDown(self):
+        SequenceBuffer.withdraw(self.fasta_path)
+        shutdown_process_pool()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_sequence_buffer(self):
+        self.assertSameHits(self._analyze(self._load()))
+
+    def test_hit_store(self):
+        HitStore.build(GeneList.load_from_file(self.fasta_path), MOTIFS).save(
+            HitStore.path_for(self.fasta_path), fasta_path=self.fasta_path)
+        gene_list = self._load()
+
+        with mock.patch.object(AnalysisSeries, '_scan_async', side_effect=AssertionError("scanned")):
+            self.assertSameHits(self._analyze(gene_list))
+
+    def test_preload(self):
+        with mock.patch.object(settings, 'ANALYSIS_POOL_MODE', PRELOAD, create=True):
+            self._start_workers()
+            self.assertSameHits(self._analyze(self._load()))
+
+    def test_preload_failure(self):
+        gene_list = self._load()
+        with mock.patch.object(settings, 'ANALYSIS_POOL_MODE', PRELOAD, create=True), \
+                mock.patch.object(GeneList, 'load_from_file', side_effect=MemoryError):
+            # Workers inherit the failing load
+            self._start_workers()
+            self.assertSameHits(self._analyze(gene_list))
+            self.assertFalse(is_resident(self.fasta_path))
+
+    def test_recycled_workers(self):
+        with mock.patch.object(settings, 'ANALYSIS_POOL_MAX_TASKS', 1, create=True):
+            self._start_workers()
+            self.assertSameHits(self._analyze(self._load()))
+
+    def test_preload_rejects_other_genes(self):
+        gene_list = self._load()
+        # The file changed since the organism was loaded
+        write_fasta(self.fasta_path, 440, seed=8)
+
+        with mock.patch.object(settings, 'ANALYSIS_POOL_MODE', PRELOAD, create=True):
+            self._start_workers()
+            with self.assertRaisesRegex(ValueError, "expected 450 genes"):
+                self._analyze(gene_list, backend='re2')
+
+    @staticmethod
+    def _start_workers() -> None:
+        """Starts the workers of a new pool, so they do not inherit organisms loaded by the test"""
+        shutdown_process_pool()
+        get_process_pool().submit(int).result()
+
+    def _load(self) -> GeneList:
+        """Loads the organism like `FastaCache` does, publishing its sequences on first use"""
+        gene_list = GeneList.load_from_file(self.fasta_path)
+        self.assertIsNotNone(gene_list.columns.indexed)
+        SequenceBuffer.defer(self.fasta_path, gene_list.genes)
+        return gene_list
+
+    @staticmethod
+    def _analyze(gene_list: GeneList, backend=None):
+        selection = StageSelection(STAGES, FilterStrategy.top, FilterSelection.percentile, 0.4)
+        gene_lists = [gene_list.filter(stage, selection) for stage in STAGES] + [gene_list]
+        return asyncio.run(AnalysisSeries.run_stages_async(
+            gene_lists=gene_lists,
+            motifs=MOTIFS,
+            names=[[motif.name for motif in MOTIFS] for _ in gene_lists],
+            colors=[["#000000" for _ in MOTIFS] for _ in gene_lists],
+            minimal=0,
+            maximal=1000,
+            bucket_size=30,
+            align_marker="tss",
+            backend=backend,
+        ))
+
+    def assertSameHits(self, stage_series):
+        """Checks the hits (by gene ID) and distributions of every series, listing the series that differ"""
+        self.assertEqual([len(list_series) for list_series in stage_series],
+                         [len(list_series) for list_series in self.expected])
+        differing = [
+            f"{stage_index}: {series.name}"
+            for stage_index, (list_series, expected_series) in enumerate(zip(stage_series, self.expected))
+            for series, expected in zip(list_series, expected_series)
+            if self._hits(series) != self._hits(expected)
+        ]
+        self.assertEqual(differing, [])
+
+    @staticmethod
+    def _hits(series):
+        return (
+            [(result.gene.geneId, result.raw_position, result.match) for result in series.result],
+            series.distribution.to_dict(),
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
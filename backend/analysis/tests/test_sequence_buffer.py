@@ -0,0 +1,35 @@
+import os
+import shutil
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+from lib.analysis.sequence_buffer import SequenceBuffer
+from lib.genes.genes import Gene
+
+DiskUsage = namedtuple("DiskUsage", ["total", "used", "free"])
+
+
+class SequenceBufferTest(unittest.TestCase):
+    """Buffers go to the temporary directory when `/dev/shm` has no room for them"""
+
+    def setUp(self):
+        self.genes = [Gene(f"G{i}.1", "ACGT" * (i + 1), f">G{i}.1", []) for i in range(50)]
+        self.addCleanup(SequenceBuffer.withdraw, "organism")
+
+    def test_full_shared_memory(self):
+        with mock.patch.object(shutil, 'disk_usage', return_value=DiskUsage(64 << 20, 64 << 20, 0)):
+            buffer = SequenceBuffer.publish("organism", self.genes)
+        self.assertFalse(buffer.path.startswith("/dev/shm/"))
+        self.assertEqual(SequenceBuffer.read(buffer.path, buffer.rows_of(self.genes[::-1])),
+                         [gene.data for gene in self.genes[::-1]])
+
+    @unittest.skipUnless(os.path.isdir("/dev/shm"), "no /dev/shm")
+    def test_shared_memory(self):
+        with mock.patch.object(shutil, 'disk_usage', return_value=DiskUsage(2 << 30, 0, 2 << 30)):
+            buffer = SequenceBuffer.publish("organism", self.genes)
+        self.assertTrue(buffer.path.startswith("/dev/shm/"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import random
+import shutil
+import tempfile
+import unittest
+
+from analysis.tests.utils import random_sequence
+from lib.analysis.fm_index import FmIndex
+from lib.analysis.kmer_index import KmerIndex
+from lib.analysis.motif import Motif
+from lib.analysis.motif_scanner import get_scanner
+from lib.analysis.sequence_index import IndexScanner
+from lib.genes.gene_list import GeneList
+from lib.genes.genes import Gene
+
+MOTIFS = [
+    Motif("box", ["TATAAA", "CACGTG"]),
+    Motif("short", ["ACG"]),
+    Motif("degenerate", ["NRY", "WWSWNNRY"]),
+    Motif("repeat", ["AAAAAAAAAA"]),
+]
+
+
+def hits(table, genes):
+    return sorted(
+        (genes[int(gene)].geneId, int(position), table.definitions[int(definition)])
+        for gene, position, definition in zip(table.gene_indices, table.raw_positions, table.definition_ids)
+    )
+
+
+class SequenceIndexTest(unittest.TestCase):
+    """Index-backed scans find the same hits as the re2 backend"""
+
+    def setUp(self):
+        rng = random.Random(5)
+        sequences = [random_sequence(rng, rng.randint(0, 400), "ACGT") for _ in range(150)]
+        # Degenerate and unknown codes, lowercase nucleotides and long repeats
+        sequences += [random_sequence(rng, rng.randint(1, 300), "ACGTACGTNRYWX") for _ in range(20)]
+        sequences += [random_sequence(rng, rng.randint(1, 300), "ACGTacgt") for _ in range(10)]
+        sequences += ["A" * 40, "N", ""]
+        genes = [Gene(f"G{i}.1", sequence, f">G{i}.1", []) for i, sequence in enumerate(sequences)]
+        # Genes sharing an ID with another gene
+        genes += [Gene("G0.1", random_sequence(rng, 200), ">G0.1", []),
+                  Gene("G7.1", genes[7].data, ">G7.1", [])]
+        self.gene_list = GeneList.from_list(genes=genes, errors=[])
+
+        # Analyses scan subsets of the organism, in an order of their own
+        self.requested = list(self.gene_list.genes)
+        rng.shuffle(self.requested)
+        self.requested = self.requested[:120] + [Gene("OTHER.1", "TATAAACGT", ">OTHER.1", [])]
+
+    def test_kmer_index(self):
+        self.assertSameHits(KmerIndex.build(self.gene_list, k=4))
+
+    def test_fm_index(self):
+        self.assertSameHits(FmIndex.build(self.gene_list, block_size=16, sample_rate=4))
+
+    def test_fm_index_counts_overlapping_matches(self):
+        index = FmIndex.build(self.gene_list, block_size=16, sample_rate=4)
+        tables = get_scanner(MOTIFS, 'bitmask', overlapping=True).scan_many([gene.data for gene in self.gene_list.genes])
+        for motif, table in zip(MOTIFS, tables):
+            for definition in dict.fromkeys(motif.definitions + motif.reverse_definitions):
+                expected = sum(table.definitions[int(d)] == definition for d in table.definition_ids)
+                self.assertEqual(index.count(definition), expected, definition)
+
+    def test_saved_index(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        fasta_path = f"{directory}/organism.fasta"
+        with open(fasta_path, 'w') as f:
+            f.write("".join(f">{gene.geneId}\n{gene.data}\n" for gene in self.gene_list.genes))
+
+        KmerIndex.build(self.gene_list, k=4).save(KmerIndex.path_for(fasta_path), fasta_path=fasta_path)
+        self.assertSameHits(KmerIndex.for_fasta(fasta_path))
+
+        with open(fasta_path, 'a') as f:
+            f.write(">NEW.1\nACGT\n")
+        self.assertIsNone(KmerIndex.for_fasta(fasta_path))
+
+    def assertSameHits(self, index):
+        expected = get_scanner(MOTIFS, 're2').scan_genes(self.requested)
+        found = IndexScanner(index, MOTIFS).scan_genes(self.requested)
+        for motif, expected_table, table in zip(MOTIFS, expected, found):
+            self.assertEqual(hits(table, self.requested), hits(expected_table, self.requested), motif.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import json
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from analysis.fasta_cache import FastaCache
+from analysis.result_cache import ResultCache
+from analysis.tests.utils import STAGES, write_fasta
+from analysis.views import analysis_views
+from analysis.views.analysis_utils import create_gene_model, process_single_analysis
+from lib.analysis.motif import Motif
+from lib.analysis.organism import Organism
+
+MOTIFS = [
+    Motif("box", ["TATAAA", "CACGTG"]),
+    Motif("degenerate", ["NRY"]),
+    Motif("weak", ["WWSW"]),
+]
+
+
+@override_settings(ANALYSIS_STREAM_WORKERS=1)
+class StreamAnalysisTest(SimpleTestCase):
+    """Streamed analyses go through the result cache and stop once the client disconnects"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.fasta_path = f"{self.directory}/organism.fasta"
+        write_fasta(self.fasta_path, 300, seed=3)
+        self.organism = Organism("Organism", "organism.fasta", take_first_transcript_only=False)
+        self.cache = ResultCache(memory_bytes=64 << 20, disk_dir=f"{self.directory}/results", disk_bytes=64 << 20)
+
+        for target, attribute, value in [(ResultCache, '_instance', self.cache),
+                                         (FastaCache, '_instance', None),
+                                         (analysis_views, '_stream_executor', None)]:
+            patcher = mock.patch.object(target, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _stream(self):
+        gene_model = create_gene_model(MOTIFS, STAGES, {})
+        return analysis_views._stream_analysis(gene_model, self.fasta_path, self.organism, None,
+                                               [m.name for m in MOTIFS], STAGES, {}, "ndjson")
+
+    def _finish_producers(self):
+        """Waits for the producers submitted so far, the executor runs one at a time"""
+        analysis_views._get_stream_executor().submit(lambda: None).result()
+
+    def test_stream(self):
+        events = [json.loads(line) for line in self._stream()]
+        self.assertEqual([event["type"] for event in events],
+                         ["progress"] + ["series"] * len(MOTIFS) * len(STAGES) + ["complete"])
+        self.assertFalse(events[-1]["cached"])
+
+        cached_events = [json.loads(line) for line in self._stream()]
+        self.assertTrue(cached_events[-1]["cached"])
+        self.assertEqual([event["series"] for event in cached_events if event["type"] == "series"],
+                         [event["series"] for event in events if event["type"] == "series"])
+
+    def test_disconnect(self):
+        closed = threading.Event()
+
+        def process_after_close(series):
+            closed.wait(10)
+            return process_single_analysis(series)
+
+        stream = self._stream()
+        with mock.patch.object(analysis_views, 'process_single_analysis', side_effect=process_after_close):
+            self.assertEqual(json.loads(next(stream))["type"], "progress")
+            stream.close()
+            closed.set()
+            self._finish_producers()
+
+        # The analysis stopped and left nothing in the cache, the next stream computes it
+        events = [json.loads(line) for line in self._stream()]
+        self.assertEqual(events[-1]["type"], "complete")
+        self.assertFalse(events[-1]["cached"])
@@ -0,0 +1,33 @@
+import unittest
+from unittest import mock
+
+import settings
+from lib.analysis import worker_pool
+
+
+class RunTaskTest(unittest.TestCase):
+    """Workers over the memory limit drop their resident organisms after a task"""
+
+    def setUp(self):
+        worker_pool._resident["organism.fasta"] = (["ACGT"], 0)
+        self.addCleanup(worker_pool._resident.clear)
+
+    def test_over_limit(self):
+        with mock.patch.object(settings, 'ANALYSIS_POOL_MAX_MEMORY_MB', 1, create=True):
+            self.assertEqual(worker_pool.run_task(lambda: 42), 42)
+        self.assertEqual(worker_pool._resident, {})
+
+    def test_under_limit(self):
+        with mock.patch.object(settings, 'ANALYSIS_POOL_MAX_MEMORY_MB', 1 << 20, create=True):
+            worker_pool.run_task(lambda: 42)
+        self.assertIn("organism.fasta", worker_pool._resident)
+
+    def test_failed_task(self):
+        with mock.patch.object(settings, 'ANALYSIS_POOL_MAX_MEMORY_MB', 1, create=True):
+            with self.assertRaises(ZeroDivisionError):
+                worker_pool.run_task(lambda: 1 // 0)
+        self.assertEqual(worker_pool._resident, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import json
+import random
+from typing import List, Tuple
+
+import re2
+
+from lib.analysis.motif import Motif
+
+STAGES = ["s1", "s2"]
+
+
+def write_fasta(path: str, gene_count: int, seed: int, alphabet: str = "ACGT") -> None:
+    """Writes an organism with random sequences, expression levels and markers"""
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        for i in range(gene_count):
+            f.write(f">AT{i // 2}G{i}.{i % 2 + 1} gene {i}\n")
+            rates = {stage: round(rng.random() * 100, 3) for stage in STAGES if rng.random() > 0.1}
+            f.write(f";TRANSCRIPTION_RATES {json.dumps(rates)}\n")
+            if i % 3 == 0:
+                f.write(f";MARKERS {json.dumps({'tss': rng.randint(1, 200)})}\n")
+            sequence = random_sequence(rng, rng.randint(0, 900), alphabet)
+            for start in range(0, len(sequence), 60):
+                f.write(sequence[start:start + 60] + "\n")
+
+
+def random_sequence(rng: random.Random, length: int, alphabet: str = "ACGT") -> str:
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def baseline_matches(sequence: str, motif: Motif, no_overlaps: bool) -> List[Tuple[int, str, str]]:
+    """
+    The matches of a motif in a sequence as the analysis found them before the scan backends:
+    every forward and reverse complement definition searched with its own regular expression,
+    then overlapping matches dropped by raw position.
+    :return: (raw position, matched definition, matched sequence) of every match
+    """
+    results = []
+    definitions = {**motif.reg_exp, **motif.reverse_complement_reg_exp}
+    for definition, regex in definitions.items():
+        regex = re2.compile(regex) if isinstance(regex, str) else regex
+        for match in regex.finditer(sequence):
+            results.append((match.start(), definition, match.group(0)))
+
+    if not no_overlaps:
+        return results
+    results.sort(key=lambda result: result[0])
+    included, last_end = [], -1
+    for result in results:
+        if result[0] >= last_end:
+            included.append(result)
+            last_end = result[0] + len(result[2])
+    return included
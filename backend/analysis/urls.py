@@ -2,11 +2,17 @@
 from django.urls import path
 
 from analysis.views.analysis_views import run_analysis, get_analysis_history_list, \
-    get_analysis_details
+    get_analysis_details, drill_down
+from analysis.views.job_views import submit_job, get_job, cancel_job
 from analysis.views.organism_views import list_organisms, get_organism_details
 
 urlpatterns = [
     path('analyze/', run_analysis, name='run_analysis'),
+    path('drill_down/', drill_down, name='drill_down'),
+
+    path('jobs/', submit_job, name='submit_job'),
+    path('jobs/<uuid:job_id>/', get_job, name='get_job'),
+    path('jobs/<uuid:job_id>/cancel/', cancel_job, name='cancel_job'),
     
     path('history/', get_analysis_history_list, name='analysis_history'),
     path('history/<int:analysis_id>/', get_analysis_details, name="get_analysis_details"),
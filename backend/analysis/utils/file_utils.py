@@ -3,6 +3,9 @@ from typing import Optional
 
 from django.conf import settings
 
+from lib.genes.compiled_organism import CompiledOrganism
+from lib.genes.fasta_reader import COMPRESSED_EXTENSIONS
+
 
 def find_fasta_file(organism_filename: Optional[str]) -> Optional[str]:
     if not organism_filename:
@@ -12,18 +15,23 @@ def find_fasta_file(organism_filename: Optional[str]) -> Optional[str]:
     if not fasta_dir.exists():
         return None
 
-    candidates = [organism_filename]
+    # The plain and compressed variants of the file name, the given one first
     root, ext = os.path.splitext(organism_filename)
-
-    if ext.lower() == '.zip':
-        candidates.append(root)
-    else:
-        candidates.append(f"{organism_filename}.zip")
+    base = root if ext.lower() in COMPRESSED_EXTENSIONS else organism_filename
+    candidates = list(dict.fromkeys(
+        [organism_filename, base] + [f"{base}{extension}" for extension in COMPRESSED_EXTENSIONS]
+    ))
 
     for fname in candidates:
         path = fasta_dir / fname
         if path.exists():
             return str(path)
 
+    # Deployments may ship only the compiled organism (see `build_compiled_organism`)
+    for fname in candidates:
+        path = fasta_dir / f"{fname}{CompiledOrganism.SUFFIX}"
+        if path.is_dir():
+            return str(path)
+
     return None
 
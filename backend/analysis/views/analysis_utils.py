@@ -2,6 +2,29 @@ from asgiref.sync import sync_to_async
 
 from analysis.models import AnalysisHistory
 from auth_app.models import UserColorPreference
+from lib.genes.gene_model import GeneModel, AnalysisOptions
+from lib.genes.stage_selection import StageSelection, FilterStrategy, FilterSelection
+
+
+def create_gene_model(motifs, stages, params):
+    """Creates a GeneModel for the motifs, stages and parameters of an analysis request."""
+    gene_model = GeneModel()
+    gene_model.analysisOptions = AnalysisOptions.fromJson(params)
+    gene_model.setMotifs(motifs)
+    strategy_str = params.get("strategy", "top").lower()
+    selection_str = params.get("selection", "percentile").lower()
+    strategy = FilterStrategy.top if strategy_str == "top" else FilterStrategy.bottom
+    selection = FilterSelection.percentile if selection_str == "percentile" else FilterSelection.fixed
+    percentile = float(params.get("percentile", 0.9))
+    count = int(params.get("count", 3200))
+    gene_model.setStageSelection(StageSelection(
+        selectedStages=stages,
+        strategy=strategy,
+        selection=selection,
+        percentile=percentile,
+        count=count,
+    ))
+    return gene_model
 
 
 def process_single_analysis(analysis):
@@ -30,13 +53,36 @@ def process_single_analysis(analysis):
                     "genes_percent": dp.genes_percent
                 }
                 for dp in analysis.distribution.dataPoints
-            ] if analysis.distribution.dataPoints else []
+            ]
         },
     }
 
 
 async def process_analysis_results(gene_model, user=None):
     """Process analysis results with proper async handling."""
+    stage_color_preferences = await get_stage_color_preferences(user)
+
+    filtered_results = []
+    for analysis in gene_model.analyses:
+        filtered_results.append(process_series(analysis, stage_color_preferences))
+
+    return filtered_results
+
+
+def process_series(analysis, stage_color_preferences):
+    """Applies the user's stage color to a series and processes it into a serializable format."""
+    stage_name = analysis.name.split(
+        ' - ')[0] if ' - ' in analysis.name else analysis.name
+
+    if stage_name in stage_color_preferences:
+        color = stage_color_preferences[stage_name]
+        analysis.color = color
+        analysis.distribution.color = color
+    return process_single_analysis(analysis)
+
+
+async def get_stage_color_preferences(user):
+    """Get the user's stage colors as a dictionary mapping stage name to color."""
     stage_color_preferences = {}
 
     if user:
@@ -44,18 +90,7 @@ async def process_analysis_results(gene_model, user=None):
         for pref in preferences:
             stage_color_preferences[pref['name']] = pref['color']
 
-    filtered_results = []
-    for analysis in gene_model.analyses:
-        stage_name = analysis.name.split(
-            ' - ')[0] if ' - ' in analysis.name else analysis.name
-
-        if user and stage_name in stage_color_preferences:
-            color = stage_color_preferences[stage_name]
-            analysis.color = color
-            analysis.distribution.color = color
-        filtered_results.append(process_single_analysis(analysis))
-
-    return filtered_results
+    return stage_color_preferences
 
 
 async def get_user_preferences(user):
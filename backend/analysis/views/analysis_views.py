@@ -1,20 +1,30 @@
 import json
+import queue
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
+from typing import Tuple
 
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from pandas import DataFrame
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from asgiref.sync import sync_to_async, async_to_sync
+from django.conf import settings
 from analysis.models import AnalysisHistory
 from analysis.utils.file_utils import find_fasta_file
-from analysis.views.analysis_utils import process_analysis_results, save_analysis_history
+from analysis.result_cache import ResultCache, analysis_key, apply_stage_colors
+from analysis.views.analysis_utils import process_analysis_results, save_analysis_history, \
+    get_stage_color_preferences, process_single_analysis, create_gene_model
 from analysis.views.organism_views import check_organism_access
+from lib.analysis.motif import Motif
 from lib.analysis.organism_presets import OrganismPresets
-from lib.genes.gene_model import GeneModel, AnalysisOptions
-from lib.genes.stage_selection import StageSelection, FilterStrategy, FilterSelection
+from lib.analysis.analysis_series import AnalysisSeries
+from lib.genes.gene_model import AnalysisCancelled, GeneModel
 import nest_asyncio
 import asyncio
 
@@ -53,6 +63,12 @@ async def get_motifs_by_names(motif_names):
             "motifs": openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_STRING)),
             "stages": openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_STRING)),
             "params": openapi.Schema(type=openapi.TYPE_OBJECT),
+            "stream": openapi.Schema(
+                type=openapi.TYPE_STRING,
+                enum=["ndjson", "sse"],
+                description="Stream every series as soon as it is complete, as newline-delimited JSON "
+                            "or Server-Sent Events. Events: progress, series, complete, error.",
+            ),
         },
         required=["organism", "motifs", "stages"],
     ),
@@ -90,33 +106,38 @@ async def run_analysis(request):
 
         real_motifs = await get_motifs_by_names(motifs)
 
-        gene_model = GeneModel()
-        gene_model.analysisOptions = AnalysisOptions.fromJson(params)
-        gene_model.setMotifs(real_motifs)
-        strategy_str = params.get("strategy", "top").lower()
-        selection_str = params.get("selection", "percentile").lower()
-        strategy = FilterStrategy.top if strategy_str == "top" else FilterStrategy.bottom
-        selection = FilterSelection.percentile if selection_str == "percentile" else FilterSelection.fixed
-        percentile = float(params.get("percentile", 0.9))
-        count = int(params.get("count", 3200))
-        gene_model.setStageSelection(StageSelection(
-            selectedStages=stages,
-            strategy=strategy,
-            selection=selection,
-            percentile=percentile,
-            count=count,
-        ))
+        gene_model = create_gene_model(real_motifs, stages, params)
 
         file_path = await sync_to_async(find_fasta_file, thread_sensitive=True)(organism.filename)
         if not file_path:
             return JsonResponse({"error": "Organism file not found"}, status=404)
 
-        await gene_model.loadFastaFromFile(file_path, organism)
-        success = await gene_model.analyze()
-        if not success:
+        stream_format = _stream_format(data.get("stream") or request.query_params.get("stream"))
+        if stream_format:
+            response = StreamingHttpResponse(
+                _stream_analysis(gene_model, file_path, organism, user, motifs, stages, params, stream_format),
+                content_type=STREAM_CONTENT_TYPES[stream_format],
+            )
+            response["Cache-Control"] = "no-cache"
+            response["X-Accel-Buffering"] = "no"
+            return response
+
+        cache = ResultCache.get_instance()
+        cache_key = await sync_to_async(analysis_key, thread_sensitive=False)(file_path, organism, gene_model)
+
+        async def _compute():
+            await gene_model.loadFastaFromFile(file_path, organism)
+            if not await gene_model.analyze():
+                return None
+            # Cached without the user's stage colors, they are applied to every response
+            return await process_analysis_results(gene_model)
+
+        # Identical requests running at the same time wait for the first one and share its results
+        cached_results, cached = await cache.get_or_compute(cache_key, _compute)
+        if cached_results is None:
             return JsonResponse({"error": "Analysis failed"}, status=500)
 
-        filtered_results = await process_analysis_results(gene_model, user)
+        filtered_results = apply_stage_colors(cached_results, await get_stage_color_preferences(user))
         if user and user.is_authenticated:
             await save_analysis_history(
                 user,
@@ -128,14 +149,315 @@ async def run_analysis(request):
                 params,
             )
 
-        return JsonResponse({"message": "Analysis complete", "results": filtered_results}, status=200)
+        return JsonResponse({"message": "Analysis complete", "results": filtered_results, "cached": cached},
+                            status=200)
 
     except Exception as e:
-        import traceback
         print(f"ERROR in run_analysis: {e}")
         traceback.print_exc()
         return JsonResponse({"error": str(e)}, status=500)
 
+STREAM_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+
+def _stream_format(value):
+    """Returns the streaming format requested by the `stream` parameter, None for a single JSON response."""
+    if value is True or str(value).lower() in ("true", "1", "ndjson"):
+        return "ndjson"
+    if str(value).lower() == "sse":
+        return "sse"
+    return None
+
+
+def _format_event(event, stream_format):
+    if stream_format == "sse":
+        return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+    return json.dumps(event) + "\n"
+
+
+# Runs the producers of streamed analyses, each with its own event loop, see `_stream_analysis`
+_stream_executor = None
+_stream_executor_lock = threading.Lock()
+
+
+def _get_stream_executor():
+    global _stream_executor
+    with _stream_executor_lock:
+        if _stream_executor is None:
+            _stream_executor = ThreadPoolExecutor(max_workers=settings.ANALYSIS_STREAM_WORKERS,
+                                                  thread_name_prefix="analysis-stream")
+        return _stream_executor
+
+
+def _stream_analysis(gene_model, file_path, organism, user, motifs, stages, params, stream_format):
+    """
+    Runs the analysis on the stream executor and yields an event for every series as soon as it is complete.
+    Analyses wait for a free producer once `ANALYSIS_STREAM_WORKERS` are streaming. When the client
+    disconnects, the analysis stops after its current motif and no history is saved.
+    """
+    events = queue.Queue()
+    disconnected = threading.Event()
+
+    async def _produce():
+        try:
+            if disconnected.is_set():
+                return
+            stage_color_preferences = await get_stage_color_preferences(user)
+            cache = ResultCache.get_instance()
+            cache_key = await sync_to_async(analysis_key, thread_sensitive=False)(file_path, organism, gene_model)
+
+            async def _analyze():
+                await gene_model.loadFastaFromFile(file_path, organism)
+                events.put({"type": "progress", "progress": 0.0})
+                results = []
+
+                def _on_series(series):
+                    if disconnected.is_set():
+                        raise AnalysisCancelled()
+                    results.append(process_single_analysis(series))
+                    events.put({
+                        "type": "series",
+                        "index": len(results) - 1,
+                        "progress": gene_model.analysisProgress,
+                        "series": apply_stage_colors(results[-1:], stage_color_preferences)[0],
+                    })
+
+                return results if await gene_model.analyze(on_series=_on_series) else None
+
+            # Waits while an identical analysis is running, then streams its cached results
+            cached_results, cached = await cache.get_or_compute(cache_key, _analyze)
+            if cached_results is None:
+                events.put({"type": "error", "error": "Analysis failed"})
+                return
+
+            if cached:
+                for index, result in enumerate(cached_results):
+                    events.put({
+                        "type": "series",
+                        "index": index,
+                        "progress": (index + 1) / len(cached_results),
+                        "series": apply_stage_colors([result], stage_color_preferences)[0],
+                    })
+
+            filtered_results = apply_stage_colors(cached_results, stage_color_preferences)
+            if user and user.is_authenticated and not disconnected.is_set():
+                await save_analysis_history(
+                    user,
+                    organism.name,
+                    organism.filename,
+                    filtered_results,
+                    motifs,
+                    stages,
+                    params,
+                )
+            events.put({
+                "type": "complete",
+                "message": "Analysis complete",
+                "count": len(filtered_results),
+                "cached": cached,
+            })
+        except AnalysisCancelled:
+            print(f"[DEBUG] Streamed analysis of {file_path} stopped, the client disconnected")
+        except Exception as e:
+            print(f"ERROR in run_analysis stream: {e}")
+            traceback.print_exc()
+            events.put({"type": "error", "error": str(e)})
+        finally:
+            events.put(None)
+
+    _get_stream_executor().submit(asyncio.run, _produce())
+
+    try:
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            yield _format_event(event, stream_format)
+    finally:
+        # Also reached when the response is closed before the analysis completed
+        disconnected.set()
+
+
+# Series recently drilled down in this process by analysis key, least recently used first, so
+# repeated drill-downs skip the scan. Bounded by `DRILL_DOWN_CACHE_MB`, see `_series_size`.
+_drill_down_series: "OrderedDict[str, Tuple[AnalysisSeries, int]]" = OrderedDict()
+_drill_down_series_used = 0
+# Drill-downs run on several threads
+_drill_down_series_lock = threading.Lock()
+
+
+def _series_size(series):
+    """Memory held by a drill-down series beyond the organism: its hits and its list of genes"""
+    return series.hits.nbytes + 8 * len(series.gene_list.genes)
+
+
+def _cached_drill_down_series(key):
+    with _drill_down_series_lock:
+        entry = _drill_down_series.get(key)
+        if entry is None:
+            return None
+        _drill_down_series.move_to_end(key)
+        return entry[0]
+
+
+def _remember_drill_down_series(key, series):
+    global _drill_down_series_used
+    size = _series_size(series)
+    budget = settings.DRILL_DOWN_CACHE_MB << 20
+    if size > budget:
+        return
+    with _drill_down_series_lock:
+        previous = _drill_down_series.pop(key, None)
+        if previous is not None:
+            _drill_down_series_used -= previous[1]
+        _drill_down_series[key] = (series, size)
+        _drill_down_series_used += size
+        while _drill_down_series_used > budget:
+            _, (_, evicted_size) = _drill_down_series.popitem(last=False)
+            _drill_down_series_used -= evicted_size
+
+
+async def _drill_down_series_of(gene_model, file_path, organism, motif, stage):
+    """
+    The series of one motif and stage. The organism comes from the FastaCache and the hits from its
+    HitStore when one was built (see `AnalysisSeries.run_async`), only other motifs are scanned.
+    :return: The series, None if the organism has no such stage
+    """
+    await gene_model.loadFastaFromFile(file_path, organism)
+    source_genes = gene_model.sourceGenes
+    if stage == "__ALL__":
+        gene_list = source_genes
+    elif stage in source_genes.stageKeys:
+        gene_list = source_genes.filter(stage=stage, stageSelection=gene_model.getSelectedStages())
+    else:
+        return None
+
+    options = gene_model.getOptions()
+    name = f"{'all' if stage == '__ALL__' else stage} - {motif.name}"
+    return await AnalysisSeries.run_async(
+        gene_list, motif, name, GeneModel.randomColorOf(name),
+        options.min, options.max, options.bucketSize, align_marker=options.alignMarker,
+    )
+
+
+def _optional_int(value):
+    """Parses an optional integer parameter, raising ValueError for anything else"""
+    if value is None:
+        return None
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise ValueError(value)
+    return int(value)
+
+
+@swagger_auto_schema(
+    method='post',
+    operation_description="Break the hits of one series down by the nucleotide matched at a degenerate motif position.",
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            "filename": openapi.Schema(type=openapi.TYPE_STRING),
+            "motif": openapi.Schema(type=openapi.TYPE_STRING, description="Name of the motif of the series"),
+            "stage": openapi.Schema(type=openapi.TYPE_STRING, description="Stage of the series, __ALL__ for all genes"),
+            "params": openapi.Schema(type=openapi.TYPE_OBJECT, description="The params of the analysis"),
+            "pattern": openapi.Schema(
+                type=openapi.TYPE_STRING,
+                description="A motif definition, possibly narrowed by earlier drill-downs (default: first definition)",
+            ),
+            "position": openapi.Schema(
+                type=openapi.TYPE_INTEGER,
+                description="Position in the pattern (default: first degenerate position)",
+            ),
+            "bucket": openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    "min": openapi.Schema(type=openapi.TYPE_INTEGER),
+                    "max": openapi.Schema(type=openapi.TYPE_INTEGER),
+                },
+                description="Only hits in <min; max) of the distribution",
+            ),
+        },
+        required=["filename", "motif", "stage"],
+    ),
+    responses={
+        200: "Drill-down results",
+        400: "Invalid pattern or position",
+        403: "Access denied",
+        404: "Organism or motif not found",
+    },
+)
+@api_view(["POST"])
+@async_view
+async def drill_down(request):
+    try:
+        data = request.data
+        filename = data.get("filename", "")
+        params = data.get("params", {})
+        stage = data.get("stage")
+        bucket = data.get("bucket") or {}
+        if not isinstance(bucket, dict):
+            return JsonResponse({"error": "Bucket must be an object"}, status=400)
+        user = getattr(request, "_user", None)
+
+        @sync_to_async(thread_sensitive=True)
+        def _fetch_org():
+            org = OrganismPresets.get_organism_by_filename(filename)
+            if not org:
+                return None, "Organism not found"
+            if not check_organism_access(user, org):
+                return None, "Access denied"
+            return org, None
+
+        organism, error = await _fetch_org()
+        if error:
+            return JsonResponse({"error": error}, status=403 if error == "Access denied" else 404)
+
+        motifs = await get_motifs_by_names([data.get("motif")])
+        if not motifs or not stage:
+            return JsonResponse({"error": "Motif not found"}, status=404)
+        motif = motifs[0]
+
+        pattern = data.get("pattern") or motif.definitions[0]
+        if not isinstance(pattern, str) or Motif.validate([pattern]) is not None \
+                or len(pattern) not in {len(d) for d in motif.definitions}:
+            return JsonResponse({"error": "Pattern does not fit the motif"}, status=400)
+        try:
+            position = _optional_int(data.get("position"))
+            bucket_min = _optional_int(bucket.get("min"))
+            bucket_max = _optional_int(bucket.get("max"))
+        except (TypeError, ValueError):
+            return JsonResponse({"error": "Position and bucket bounds must be integers"}, status=400)
+        if position is not None and not (0 <= position < len(pattern)):
+            return JsonResponse({"error": "Position out of range"}, status=400)
+
+        file_path = await sync_to_async(find_fasta_file, thread_sensitive=True)(organism.filename)
+        if not file_path:
+            return JsonResponse({"error": "Organism file not found"}, status=404)
+
+        gene_model = create_gene_model([motif], [stage], params)
+        cache_key = await sync_to_async(analysis_key, thread_sensitive=False)(file_path, organism, gene_model)
+        series = _cached_drill_down_series(cache_key)
+        if series is None:
+            series = await _drill_down_series_of(gene_model, file_path, organism, motif, stage)
+            if series is None:
+                return JsonResponse({"error": "Stage not found"}, status=404)
+            _remember_drill_down_series(cache_key, series)
+
+        results = series.drill_down(pattern, position, bucket_min=bucket_min, bucket_max=bucket_max)
+        return JsonResponse({
+            "name": series.name,
+            "pattern": pattern,
+            "results": [result.to_dict() for result in results],
+        }, status=200)
+
+    except Exception as e:
+        print(f"ERROR in drill_down: {e}")
+        traceback.print_exc()
+        return JsonResponse({"error": str(e)}, status=500)
+
+
 @swagger_auto_schema(
     method='get',
     operation_description="Retrieve a list of the user's past analyses.",
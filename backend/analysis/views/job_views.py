@@ -0,0 +1,122 @@
+from django.http import JsonResponse
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+
+from analysis import jobs
+from analysis.models import AnalysisJob
+from analysis.utils.file_utils import find_fasta_file
+from analysis.views.organism_views import check_organism_access
+from lib.analysis.organism_presets import OrganismPresets
+
+
+def serialize_job(job: AnalysisJob):
+    result = {
+        "id": str(job.id),
+        "status": job.status,
+        "progress": job.progress,
+        "organism": job.organism,
+        "file_name": job.organism_filename,
+        "motifs": job.motifs,
+        "stages": job.stages,
+        "created_at": job.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        "started_at": job.started_at.strftime("%Y-%m-%d %H:%M:%S") if job.started_at else None,
+        "finished_at": job.finished_at.strftime("%Y-%m-%d %H:%M:%S") if job.finished_at else None,
+    }
+    if job.status == AnalysisJob.DONE:
+        result["results"] = job.filtered_results
+        result["history_id"] = job.history_id
+    if job.status == AnalysisJob.FAILED:
+        result["error"] = job.error
+    return result
+
+
+@swagger_auto_schema(
+    method='post',
+    operation_description="Queue an analysis to run in the background. Poll the returned job for its results.",
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            "organism": openapi.Schema(type=openapi.TYPE_STRING),
+            "filename": openapi.Schema(type=openapi.TYPE_STRING),
+            "motifs": openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_STRING)),
+            "stages": openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_STRING)),
+            "params": openapi.Schema(type=openapi.TYPE_OBJECT),
+        },
+        required=["filename", "motifs", "stages"],
+    ),
+    responses={
+        202: "Analysis queued",
+        400: "Missing parameters",
+        403: "Access denied",
+        404: "Organism not found",
+        429: "Too many queued analyses",
+    },
+)
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def submit_job(request):
+    data = request.data
+    filename = data.get("filename", "")
+    motifs = data.get("motifs", [])
+    stages = data.get("stages", [])
+    params = data.get("params", {})
+    if not motifs or not stages:
+        return JsonResponse({"error": "Motifs and stages are required"}, status=400)
+
+    organism = OrganismPresets.get_organism_by_filename(filename)
+    if not organism:
+        return JsonResponse({"error": "Organism not found"}, status=404)
+    if not check_organism_access(request.user, organism):
+        return JsonResponse({"error": "Access denied"}, status=403)
+    if not find_fasta_file(organism.filename):
+        return JsonResponse({"error": "Organism file not found"}, status=404)
+
+    try:
+        job = jobs.enqueue(request.user, organism, motifs, stages, params)
+    except jobs.JobLimitError as e:
+        return JsonResponse({"error": str(e)}, status=429)
+
+    return JsonResponse({"id": str(job.id), "status": job.status}, status=202)
+
+
+@swagger_auto_schema(
+    method='get',
+    operation_description="Retrieve the status, progress and (once done) results of an analysis job.",
+    responses={
+        200: openapi.Response("Job retrieved successfully"),
+        404: "Job not found"
+    }
+)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def get_job(request, job_id):
+    try:
+        job = AnalysisJob.objects.get(id=job_id, user=request.user)
+    except AnalysisJob.DoesNotExist:
+        return JsonResponse({"error": "Job not found"}, status=404)
+
+    if job.status in AnalysisJob.ACTIVE_STATUSES:
+        # Jobs queued by a recycled server process are picked up by this one
+        jobs.ensure_workers()
+    return JsonResponse(serialize_job(job))
+
+
+@swagger_auto_schema(
+    method='post',
+    operation_description="Cancel an analysis job. Queued jobs stop at once, running jobs after the current motif.",
+    responses={
+        200: openapi.Response("Cancellation requested"),
+        404: "Job not found"
+    }
+)
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def cancel_job(request, job_id):
+    try:
+        job = AnalysisJob.objects.get(id=job_id, user=request.user)
+    except AnalysisJob.DoesNotExist:
+        return JsonResponse({"error": "Job not found"}, status=404)
+
+    return JsonResponse(serialize_job(jobs.cancel(job)))
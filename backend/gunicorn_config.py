@@ -1,3 +1,5 @@
+import gc
+
 bind = "0.0.0.0:8000"
 workers = 3
 worker_class = "sync"
@@ -7,3 +9,26 @@ max_requests_jitter = 50
 graceful_timeout = 300
 keepalive = 5
 worker_connections = 1000
+
+# The application is loaded once in the master, and the hot organisms with it (see `when_ready`),
+# so workers (also the ones replacing recycled workers) share them copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    from django.db import connections
+    from analysis.fasta_cache import FastaCache
+    from lib.analysis.worker_pool import shutdown_process_pool
+
+    FastaCache.get_instance().warm_up()
+    # Workers open their own connections, and their own process pool
+    connections.close_all()
+    shutdown_process_pool()
+
+
+def pre_fork(server, worker):
+    # Garbage is collected first, so freed objects leave no holes in the pages workers share.
+    # The remaining objects of the master are then never collected in the worker, so the
+    # collector does not write to their pages
+    gc.collect()
+    gc.freeze()
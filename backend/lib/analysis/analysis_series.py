@@ -1,31 +1,43 @@
 import json
-from concurrent.futures import ProcessPoolExecutor
 from functools import partial
-from typing import List, Dict, Optional, Any
-import re2
-from collections import defaultdict
+from typing import List, Dict, Optional, Any, Tuple
+
+import numpy as np
+
+import settings
 from lib.analysis.analysis_result import AnalysisResult
+from lib.analysis.bitmask_scanner import definition_masks, sequence_masks, COMPLEMENT_MASKS
 from lib.analysis.distribution import Distribution
+from lib.analysis.fm_index import FmIndex
+from lib.analysis.hit_store import HitStore
+from lib.analysis.hit_table import HitTable, HitResults
+from lib.analysis.kmer_index import KmerIndex
 from lib.analysis.motif import Motif
+from lib.analysis.motif_scanner import get_scanner, MotifScanner
+from lib.analysis.sequence_buffer import SequenceBuffer
+from lib.analysis.sequence_index import IndexScanner
+from lib.analysis.worker_pool import get_process_pool, resident_sequences, run_task, is_resident, mark_not_resident, \
+    OrganismNotResident
+from lib.genes.gene_columns import GeneColumns
 from lib.genes.gene_list import GeneList
+from lib.genes.genes import Gene
 
-_process_pool = None
+# Scan backends answered from an index prebuilt next to the FASTA file, see `settings.MOTIF_SCAN_BACKEND`
+INDEX_BACKENDS = {
+    'kmer': KmerIndex,
+    'fm': FmIndex,
+}
 
-def get_process_pool(max_workers=None):
-    global _process_pool
-    if _process_pool is None:
-        import multiprocessing
-        if max_workers is None:
-            cpu_count = multiprocessing.cpu_count()
-            max_workers = max(1, min(cpu_count - 1, 4))
-        _process_pool = ProcessPoolExecutor(max_workers=max_workers)
-    return _process_pool
+# Order of the codes in drill-down results: concrete nucleotides first
+DRILL_DOWN_ORDER = "AGCTURYWSMKBHDVN"
+# Hits read at once by drill-downs
+DRILL_DOWN_CHUNK = 1 << 18
 
 class AnalysisSeries:
     """Represents one series in the analysis"""
 
     def __init__(self, gene_list: GeneList, motif: Motif, name: str, color: str, stroke: int = 4, visible: bool = True,
-                 no_overlaps: bool = True, result: Optional[List[AnalysisResult]] = None,
+                 no_overlaps: bool = True, hits: Optional[HitTable] = None,
                  distribution: Optional[Distribution] = None):
         """
         :param gene_list: The GeneList analysis was run on
@@ -35,7 +47,7 @@ class AnalysisSeries:
         :param stroke: The stroke width of the series
         :param visible: Whether the series is visible
         :param no_overlaps: Whether to filter overlapping matches
-        :param result: The results of the analysis
+        :param hits: The hits of the analysis, gene indices refer to `gene_list.genes`
         :param distribution: The distribution of the analysis
         """
         self.gene_list = gene_list
@@ -45,9 +57,14 @@ class AnalysisSeries:
         self.stroke = stroke
         self.visible = visible
         self.no_overlaps = no_overlaps
-        self.result = result or []
+        self.hits = hits if hits is not None else HitTable.empty()
         self.distribution = distribution
 
+    @property
+    def result(self) -> HitResults:
+        """The results of the analysis, as AnalysisResult objects created on access"""
+        return HitResults(self.hits, self.gene_list.genes, self.motif)
+
     def copy_with(self, color: Optional[str] = None, stroke: Optional[int] = None, visible: Optional[bool] = None):
         """Returns a copy of the AnalysisSeries with optional modifications"""
         return AnalysisSeries(
@@ -58,7 +75,7 @@ class AnalysisSeries:
             stroke=stroke if stroke is not None else self.stroke,
             visible=visible if visible is not None else self.visible,
             no_overlaps=self.no_overlaps,
-            result=self.result,
+            hits=self.hits,
             distribution=self.distribution
         )
 
@@ -66,77 +83,314 @@ class AnalysisSeries:
     async def run_async(cls, gene_list: GeneList, motif: Motif, name: str, color: str,
                         minimal: int, maximal: int, bucket_size: int,
                         align_marker: Optional[str] = None, no_overlaps: bool = True,
-                        stroke: int = 4, visible: bool = True):
+                        stroke: int = 4, visible: bool = True, backend: Optional[str] = None):
+        series = await cls.run_many_async(gene_list, [motif], [name], [color], minimal, maximal, bucket_size,
+                                          align_marker=align_marker, no_overlaps=no_overlaps,
+                                          stroke=stroke, visible=visible, backend=backend)
+        return series[0]
+
+    @classmethod
+    async def run_many_async(cls, gene_list: GeneList, motifs: List[Motif], names: List[str], colors: List[str],
+                             minimal: int, maximal: int, bucket_size: int,
+                             align_marker: Optional[str] = None, no_overlaps: bool = True,
+                             stroke: int = 4, visible: bool = True,
+                             backend: Optional[str] = None) -> List["AnalysisSeries"]:
+        """
+        Runs several motifs over the same gene list, scanning every gene only once.
+        Returns one series per motif, in the same order as `motifs`.
+        :param backend: Name of the scan backend, see `get_scanner` and `INDEX_BACKENDS`
+        """
+        stored = cls._stored_tables(gene_list, motifs, no_overlaps, backend)
+        missing = [motif for motif, hits in zip(motifs, stored) if hits is None]
+        scanned = iter(await cls._scan_async(gene_list, missing, no_overlaps, backend) if missing else [])
+        tables = [hits if hits is not None else next(scanned) for hits in stored]
+
+        return [
+            cls._from_hits(gene_list, motif, name, color, hits, minimal, maximal, bucket_size,
+                           align_marker, no_overlaps, stroke, visible)
+            for motif, name, color, hits in zip(motifs, names, colors, tables)
+        ]
+
+    @classmethod
+    async def run_stages_async(cls, gene_lists: List[GeneList], motifs: List[Motif], names: List[List[str]],
+                               colors: List[List[str]], minimal: int, maximal: int, bucket_size: int,
+                               align_marker: Optional[str] = None, no_overlaps: bool = True,
+                               stroke: int = 4, visible: bool = True,
+                               backend: Optional[str] = None) -> List[List["AnalysisSeries"]]:
+        """
+        Runs several motifs over several (usually overlapping) gene lists, e.g. the genes of the selected stages.
+        Every motif is scanned once over the union of the gene lists, the hits are then split per gene list.
+        :param gene_lists: The gene lists, all filtered from the same organism
+        :param names: Series names, per gene list and motif
+        :param colors: Series colors, per gene list and motif
+        :return: The series per gene list, each in the same order as `motifs`
+        """
+        if not gene_lists:
+            return []
+
+        union_genes, gene_rows = cls._gene_union([gene_list.genes for gene_list in gene_lists])
+        union = gene_lists[0].copy_with(genes=union_genes)
+
+        stored = cls._stored_tables(union, motifs, no_overlaps, backend)
+        missing = [motif for motif, hits in zip(motifs, stored) if hits is None]
+        scanned = iter(await cls._scan_async(union, missing, no_overlaps, backend) if missing else [])
+        tables = [hits if hits is not None else next(scanned) for hits in stored]
+
+        return [
+            [
+                cls._from_hits(gene_list, motif, name, color, hits.remap_genes(index_of_gene), minimal, maximal,
+                               bucket_size, align_marker, no_overlaps, stroke, visible)
+                for motif, name, color, hits in zip(motifs, list_names, list_colors, tables)
+            ]
+            for gene_list, index_of_gene, list_names, list_colors in zip(gene_lists, gene_rows, names, colors)
+        ]
+
+    @staticmethod
+    def _gene_union(gene_lists: List[List[Gene]]) -> Tuple[List[Gene], List[np.ndarray]]:
+        """
+        Joins lists of genes, keeping each gene (by identity) once, in order of first appearance.
+        :return: The joined genes, and for every list the index of each joined gene in that list (-1 if absent)
+        """
+        union: List[Gene] = []
+        union_index: Dict[int, int] = {}
+        list_rows = []
+        for genes in gene_lists:
+            rows = np.empty(len(genes), dtype=np.int64)
+            for i, gene in enumerate(genes):
+                row = union_index.get(id(gene))
+                if row is None:
+                    row = union_index[id(gene)] = len(union)
+                    union.append(gene)
+                rows[i] = row
+            list_rows.append(rows)
+
+        index_of_gene = []
+        for rows in list_rows:
+            mask = np.full(len(union), -1, dtype=np.int64)
+            mask[rows] = np.arange(len(rows))
+            index_of_gene.append(mask)
+        return union, index_of_gene
+
+    @classmethod
+    async def _scan_async(cls, gene_list: GeneList, motifs: List[Motif], no_overlaps: bool,
+                          backend: Optional[str]) -> List[HitTable]:
+        """
+        Scans all genes of a gene list for the motifs.
+        Returns the hits for each motif, in the same order as `motifs`.
+        """
+        index_scanner, backend = cls._resolve_backends(gene_list, motifs, backend)
+        if index_scanner is not None:
+            return cls._filter_tables(index_scanner.scan_genes(gene_list.genes), no_overlaps)
         if len(gene_list.genes) < 10:
-            results = []
-            for gene in gene_list.genes:
-                results.extend(cls._find_matches(gene, motif, no_overlaps))
-        else:
-            executor = get_process_pool()
+            return cls._process_gene_batch(gene_list.genes, motifs, no_overlaps, backend)
+
+        executor = get_process_pool()
 
-            batch_size = 1000
-            results = []
+        batch_starts, batch_calls = cls._batch_calls(gene_list, 1000, motifs, no_overlaps, backend)
 
-            find_matches_fn = partial(cls._find_matches, motif=motif, no_overlaps=no_overlaps)
+        import asyncio
+        loop = asyncio.get_event_loop()
+        batch_tasks = [loop.run_in_executor(executor, run_task, batch_call) for batch_call in batch_calls]
+        try:
+            batch_tables = await asyncio.gather(*batch_tasks)
+        except OrganismNotResident as e:
+            # Scanned again with the sequences sent along
+            mark_not_resident(e.path)
+            return await cls._scan_async(gene_list, motifs, no_overlaps, backend)
+        return cls._join_batches(batch_tables, batch_starts, len(motifs))
 
-            import asyncio
-            for i in range(0, len(gene_list.genes), batch_size):
-                batch = gene_list.genes[i:i + batch_size]
+    @classmethod
+    def _scan(cls, gene_list: GeneList, motifs: List[Motif], no_overlaps: bool,
+              backend: Optional[str]) -> List[HitTable]:
+        """
+        Synchronous variant of `_scan_async`.
+        """
+        index_scanner, backend = cls._resolve_backends(gene_list, motifs, backend)
+        if index_scanner is not None:
+            return cls._filter_tables(index_scanner.scan_genes(gene_list.genes), no_overlaps)
+        if len(gene_list.genes) < 10:
+            return cls._process_gene_batch(gene_list.genes, motifs, no_overlaps, backend)
 
-                loop = asyncio.get_event_loop()
-                batch_results = await loop.run_in_executor(
-                    executor,
-                    cls._process_gene_batch,
-                    batch,
-                    find_matches_fn
-                )
-                results.extend(batch_results)
+        executor = get_process_pool()
 
-        distribution = Distribution(
-            min=minimal,
-            max=maximal,
-            bucket_size=bucket_size,
-            align_marker=align_marker,
-            name=name,
-            color=color
-        )
-        distribution.run(results, len(gene_list.genes))
+        batch_starts, batch_calls = cls._batch_calls(gene_list, 100, motifs, no_overlaps, backend)
+        futures = [executor.submit(run_task, batch_call) for batch_call in batch_calls]
+        try:
+            batch_tables = [future.result() for future in futures]
+        except OrganismNotResident as e:
+            mark_not_resident(e.path)
+            return cls._scan(gene_list, motifs, no_overlaps, backend)
+        return cls._join_batches(batch_tables, batch_starts, len(motifs))
+
+    @classmethod
+    def _stored_tables(cls, gene_list: GeneList, motifs: List[Motif], no_overlaps: bool,
+                       backend: Optional[str]) -> List[Optional[HitTable]]:
+        """
+        Looks the motifs up in the HitStore of the organism, if there is an up-to-date one
+        and no scan backend was explicitly requested.
+        :return: The hits of each motif, None for motifs that must be scanned
+        """
+        stored: List[Optional[HitTable]] = [None] * len(motifs)
+        if backend is not None or not motifs:
+            return stored
+
+        store = HitStore.for_fasta(gene_list.source)
+        if store is None:
+            return stored
+        # The store refers to genes by their row in the file, as gene views do
+        columns, rows = GeneColumns.rows_of(gene_list.genes)
+        if columns is None or len(columns) != store.gene_count or columns.gene_checksum() != store.gene_checksum:
+            return stored
+
+        for i, motif in enumerate(motifs):
+            hits = store.hits_for(motif, rows)
+            if hits is not None:
+                stored[i] = cls._filter_tables([hits], no_overlaps)[0]
+        return stored
+
+    @staticmethod
+    def _process_gene_batch(gene_batch: List[Gene], motifs: List[Motif], no_overlaps: bool,
+                            backend: Optional[str] = None) -> List[HitTable]:
+        """
+        Scans a batch of genes for all motifs at once.
+        Returns the hits for each motif, in the same order as `motifs`, gene indices refer to `gene_batch`.
+        Scan failures are raised to the caller, so they fail the analysis instead of dropping the hits.
+        """
+        scanner = get_scanner(motifs, backend)
+        return AnalysisSeries._filter_tables(scanner.scan_genes(gene_batch), no_overlaps)
+
+    @staticmethod
+    def _process_buffer_batch(buffer_path: str, rows: np.ndarray, motifs: List[Motif], no_overlaps: bool,
+                              backend: Optional[str] = None) -> List[HitTable]:
+        """
+        Variant of `_process_gene_batch` reading the sequences from a SequenceBuffer.
+        Gene indices of the hits refer to `rows`.
+        """
+        scanner = get_scanner(motifs, backend)
+        return AnalysisSeries._filter_tables(scanner.scan_many(SequenceBuffer.read(buffer_path, rows)), no_overlaps)
 
-        return cls(
-            gene_list=gene_list,
-            motif=motif,
-            name=name,
-            color=color,
-            stroke=stroke,
-            visible=visible,
-            no_overlaps=no_overlaps,
-            result=results,
-            distribution=distribution
-        )
     @staticmethod
-    def _process_gene_batch(gene_batch, find_matches_fn):
-        all_results = []
-        for gene in gene_batch:
-            gene_results = find_matches_fn(gene)
-            all_results.extend(gene_results)
-        return all_results
+    def _process_resident_batch(source: str, rows: np.ndarray, gene_count: int, gene_checksum: int,
+                                motifs: List[Motif], no_overlaps: bool,
+                                backend: Optional[str] = None) -> List[HitTable]:
+        """
+        Variant of `_process_gene_batch` reading the sequences from the organism resident in the
+        worker (see `worker_pool`). Gene indices of the hits refer to `rows`, rows in the file.
+        Fails if the worker's organism does not hold the caller's genes, rather than scanning others.
+        """
+        scanner = get_scanner(motifs, backend)
+        sequences = resident_sequences(source, rows.tolist(), gene_count, gene_checksum)
+        return AnalysisSeries._filter_tables(scanner.scan_many(sequences), no_overlaps)
+
+    @classmethod
+    def _batch_calls(cls, gene_list: GeneList, batch_size: int, motifs: List[Motif], no_overlaps: bool,
+                     backend: Optional[str]) -> Tuple[List[int], List[partial]]:
+        """
+        Splits the scan of a gene list into batches for the process pool. When the genes are
+        rows of a loaded organism, batches carry only the rows: workers read them from the
+        organism resident in the worker (`preload` pool mode, by file row) or from the
+        SequenceBuffer (by buffer row).
+        :return: (index of the first gene of every batch, a picklable call for every batch)
+        """
+        genes = gene_list.genes
+        batch_starts = list(range(0, len(genes), batch_size))
+
+        if is_resident(gene_list.source):
+            columns, file_rows = GeneColumns.rows_of(genes)
+            if columns is not None:
+                return batch_starts, [
+                    partial(cls._process_resident_batch, gene_list.source, file_rows[i:i + batch_size], len(columns),
+                            columns.gene_checksum(), motifs, no_overlaps, backend)
+                    for i in batch_starts
+                ]
+
+        buffer = SequenceBuffer.for_key(gene_list.source)
+        rows = buffer.rows_of(genes) if buffer is not None else None
+        if rows is not None:
+            return batch_starts, [
+                partial(cls._process_buffer_batch, buffer.path, rows[i:i + batch_size], motifs, no_overlaps, backend)
+                for i in batch_starts
+            ]
+        return batch_starts, [
+            partial(cls._process_gene_batch, genes[i:i + batch_size], motifs, no_overlaps, backend)
+            for i in batch_starts
+        ]
+
+    @staticmethod
+    def _join_batches(batch_tables: List[List[HitTable]], batch_starts: List[int], motif_count: int) -> List[HitTable]:
+        """
+        Joins the per-motif hits of consecutive gene batches.
+        :param batch_starts: The index of the first gene of every batch
+        """
+        return [
+            HitTable.concatenate([tables[motif_index] for tables in batch_tables], gene_offsets=batch_starts)
+            for motif_index in range(motif_count)
+        ]
+
+    @staticmethod
+    def _resolve_backends(gene_list: GeneList, motifs: List[Motif],
+                          backend: Optional[str]) -> Tuple[Optional[MotifScanner], str]:
+        """
+        Picks the scan backend. Index backends are used when the index of the organism was built,
+        otherwise genes are scanned live. Without an explicit backend, `settings.MOTIF_SCAN_BACKEND`
+        is used, and a prebuilt k-mer index is preferred over live scan backends.
+        :return: (scanner backed by an index or None, name of the live scan backend)
+        """
+        requested = backend or getattr(settings, 'MOTIF_SCAN_BACKEND', 're2')
+        live_backend = 're2' if requested in INDEX_BACKENDS else requested
+
+        if requested in INDEX_BACKENDS:
+            index_classes = [INDEX_BACKENDS[requested]]
+        elif backend is None:
+            index_classes = [KmerIndex]
+        else:
+            index_classes = []
+
+        if gene_list.source:
+            for index_class in index_classes:
+                index = index_class.for_fasta(gene_list.source)
+                if index is not None:
+                    return IndexScanner(index, motifs), live_backend
+        return None, live_backend
+
+    @staticmethod
+    def _filter_tables(tables: List[HitTable], no_overlaps: bool) -> List[HitTable]:
+        if not no_overlaps:
+            return tables
+        return [AnalysisSeries.filter_overlapping_hits(hits) for hits in tables]
+
     @classmethod
     def run(cls, gene_list: GeneList, motif: Motif, name: str, color: str, minimal: int, maximal: int,
             bucket_size: int, align_marker: Optional[str] = None, no_overlaps: bool = True,
-            stroke: int = 4, visible: bool = True):
-        if len(gene_list.genes) < 10:
-            results = []
-            for gene in gene_list.genes:
-                results.extend(cls._find_matches(gene, motif, no_overlaps))
-        else:
-            executor = get_process_pool()
+            stroke: int = 4, visible: bool = True, backend: Optional[str] = None):
+        return cls.run_many(gene_list, [motif], [name], [color], minimal, maximal, bucket_size,
+                            align_marker=align_marker, no_overlaps=no_overlaps, stroke=stroke, visible=visible,
+                            backend=backend)[0]
 
-            results = []
-            find_matches_fn = partial(cls._find_matches, motif=motif, no_overlaps=no_overlaps)
+    @classmethod
+    def run_many(cls, gene_list: GeneList, motifs: List[Motif], names: List[str], colors: List[str],
+                 minimal: int, maximal: int, bucket_size: int, align_marker: Optional[str] = None,
+                 no_overlaps: bool = True, stroke: int = 4, visible: bool = True,
+                 backend: Optional[str] = None) -> List["AnalysisSeries"]:
+        """
+        Synchronous variant of `run_many_async`.
+        """
+        stored = cls._stored_tables(gene_list, motifs, no_overlaps, backend)
+        missing = [motif for motif, hits in zip(motifs, stored) if hits is None]
+        scanned = iter(cls._scan(gene_list, missing, no_overlaps, backend) if missing else [])
+        tables = [hits if hits is not None else next(scanned) for hits in stored]
 
-            for batch_results in executor.map(find_matches_fn, gene_list.genes, chunksize=100):
-                results.extend(batch_results)
+        return [
+            cls._from_hits(gene_list, motif, name, color, hits, minimal, maximal, bucket_size,
+                           align_marker, no_overlaps, stroke, visible)
+            for motif, name, color, hits in zip(motifs, names, colors, tables)
+        ]
 
+    @classmethod
+    def _from_hits(cls, gene_list: GeneList, motif: Motif, name: str, color: str,
+                   hits: HitTable, minimal: int, maximal: int, bucket_size: int,
+                   align_marker: Optional[str], no_overlaps: bool, stroke: int,
+                   visible: bool) -> "AnalysisSeries":
         distribution = Distribution(
             min=minimal,
             max=maximal,
@@ -145,7 +399,8 @@ class AnalysisSeries:
             name=name,
             color=color
         )
-        distribution.run(results, len(gene_list.genes))
+        distribution.run(hits.positions, hits.gene_indices, gene_list.genes, len(gene_list.genes),
+                         marker_offsets=gene_list.marker_offsets(align_marker) if align_marker else None)
 
         return cls(
             gene_list=gene_list,
@@ -155,47 +410,21 @@ class AnalysisSeries:
             stroke=stroke,
             visible=visible,
             no_overlaps=no_overlaps,
-            result=results,
+            hits=hits,
             distribution=distribution
         )
+
     @property
-    def results_map(self) -> Dict[str, List[AnalysisResult]]:
+    def results_map(self) -> Dict[str, HitResults]:
         """Returns the results as a dictionary mapping gene ID to a list of AnalysisResult"""
-        results_dict = defaultdict(list)
-        for result in self.result:
-            results_dict[result.gene.geneId].append(result)
-        return results_dict
-
-    @staticmethod
-    def _find_matches(gene, motif, no_overlaps) -> List[AnalysisResult]:
-        try:
-            results = []
-            definitions = {**motif.reg_exp, **motif.reverse_complement_reg_exp}
-
-            for definition, regex in definitions.items():
-                if isinstance(regex, str):
-                    compiled_regex = re2.compile(regex)
-                else:
-                    compiled_regex = regex
-
-                matches = list(compiled_regex.finditer(gene.data))
-
-                for match in matches:
-                    mid_match_delta = len(match.group(0)) // 2
-                    results.append(AnalysisResult(
-                        gene=gene,
-                        motif=motif,
-                        raw_position=match.start(),
-                        position=match.start() + mid_match_delta,
-                        match=definition,
-                        matched_sequence=match.group(0),
-                    ))
-
-            if no_overlaps and results:
-                return AnalysisSeries.filter_overlapping_matches(results)
-            return results
-        except Exception as e:
-             return []
+        genes = self.gene_list.genes
+        order = np.argsort(self.hits.gene_indices, kind='stable')
+        gene_indices, first_rows = np.unique(self.hits.gene_indices[order], return_index=True)
+        ends = np.append(first_rows[1:], len(order))
+        return {
+            genes[gene_index].geneId: HitResults(self.hits.take(order[start:end]), genes, self.motif)
+            for gene_index, start, end in zip(gene_indices.tolist(), first_rows.tolist(), ends.tolist())
+        }
 
     @staticmethod
     def filter_overlapping_matches(results: List[AnalysisResult]) -> List[AnalysisResult]:
@@ -217,6 +446,103 @@ class AnalysisSeries:
 
         return included_results
 
+    @staticmethod
+    def filter_overlapping_hits(hits: HitTable, by_strand: bool = False) -> HitTable:
+        """
+        Columnar variant of `filter_overlapping_matches`, for all genes at once.
+        See `HitTable.without_overlaps`.
+        """
+        return hits.without_overlaps(by_strand=by_strand)
+
+    def drill_down(self, pattern: str, position: Optional[int] = None,
+                   bucket_min: Optional[int] = None, bucket_max: Optional[int] = None) -> List["DrillDownResult"]:
+        """
+        Breaks the hits matching a pattern down by the code matched at one of its degenerate positions.
+
+        Hits are read in the orientation of the motif definitions (reverse strand hits are reverse
+        complemented), and a hit matches a code when its nucleotide there is one the code accepts.
+        :param pattern: A definition of the motif, or a definition with some degenerate codes narrowed down
+        :param position: The position in the pattern to break down, the first degenerate one by default
+        :param bucket_min: Only hits at or after this position (after alignment, like in the distribution)
+        :param bucket_max: Only hits before this position
+        :return: One result per code `Motif.drill_down_codes` gives for the pattern code, where `share` is
+            relative to the hits matching the pattern and `share_of_all` to all hits (in the bucket)
+        """
+        if position is None:
+            position = next((i for i, code in enumerate(pattern) if Motif.drill_down_codes(code)), None)
+            if position is None:
+                return []
+        codes = sorted(Motif.drill_down_codes(pattern[position]), key=DRILL_DOWN_ORDER.index)
+
+        hits = self.hits
+        selected = np.ones(len(hits), dtype=bool)
+        if bucket_min is not None or bucket_max is not None:
+            positions = hits.positions.astype(np.int64)
+            if self.distribution is not None and self.distribution.align_marker is not None:
+                positions = positions - self.gene_list.marker_offsets(self.distribution.align_marker)[hits.gene_indices]
+            if bucket_min is not None:
+                selected &= positions >= bucket_min
+            if bucket_max is not None:
+                selected &= positions < bucket_max
+        all_count = int(np.count_nonzero(selected))
+
+        # Codes of the pattern-length hits matching the pattern, at the drilled position
+        selected &= hits.lengths == len(pattern)
+        rows = np.flatnonzero(selected)
+        rejected_by_pattern = np.invert(definition_masks(pattern))
+        matched_codes = []
+        for start in range(0, len(rows), DRILL_DOWN_CHUNK):
+            codes_at = self._oriented_masks(hits.take(rows[start:start + DRILL_DOWN_CHUNK]), len(pattern))
+            matching = np.all((codes_at & rejected_by_pattern) == 0, axis=1)
+            matched_codes.append(codes_at[matching, position])
+        matched_codes = np.concatenate(matched_codes) if matched_codes else np.zeros(0, dtype=np.uint8)
+        total = len(matched_codes)
+
+        results = []
+        for code in codes:
+            rejected = np.invert(definition_masks(code))[0]
+            count = int(np.count_nonzero((matched_codes & rejected) == 0))
+            results.append(DrillDownResult(
+                pattern=f"{pattern[:position]}{code}{pattern[position + 1:]}",
+                count=count,
+                share=count / total if total else None,
+                share_of_all=count / all_count if all_count else None,
+            ))
+        return results
+
+    def _oriented_masks(self, hits: HitTable, length: int) -> np.ndarray:
+        """
+        The codes of hits as masks (see `bitmask_scanner`), in the orientation of the motif definitions.
+        :return: Array of shape (hits, length)
+        """
+        sequence, gene_starts = self._joined_sequences()
+        offsets = np.arange(length, dtype=np.int64)
+        reverse = hits.strands == HitTable.REVERSE
+        starts = gene_starts[hits.gene_indices] + hits.raw_positions
+        # Reverse strand hits are read backwards, their codes are complemented below
+        indices = starts[:, None] + np.where(reverse[:, None], length - 1 - offsets, offsets)
+        masks = sequence_masks(sequence[indices.ravel()]).reshape(len(hits), length)
+        masks[reverse] = COMPLEMENT_MASKS[masks[reverse]]
+        return masks
+
+    def _joined_sequences(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The sequences of the genes as one byte array, and where each gene starts in it.
+        Uses the organism's SequenceBuffer when the genes are in it.
+        """
+        genes = self.gene_list.genes
+        buffer = SequenceBuffer.for_key(self.gene_list.source)
+        rows = buffer.rows_of(genes) if buffer is not None else None
+        if rows is not None:
+            sequence, offsets = SequenceBuffer.arrays(buffer.path)
+            return sequence, offsets[rows]
+
+        encoded = [gene.data.encode('ascii', 'replace') for gene in genes]
+        starts = np.zeros(len(encoded), dtype=np.int64)
+        if len(encoded) > 1:
+            np.cumsum([len(data) for data in encoded[:-1]], out=starts[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), starts
+
     def toJson(self) -> str:
         return json.dumps(self.to_dict())
 
@@ -229,7 +555,7 @@ class AnalysisSeries:
             "stroke": self.stroke,
             "visible": self.visible,
             "no_overlaps": self.no_overlaps,
-            "result": [r.to_dict() for r in self.result] if self.result else [],
+            "hits": self.hits.to_dict(),
             "distribution": self.distribution.to_dict() if self.distribution else None,
         }
 
@@ -237,7 +563,12 @@ class AnalysisSeries:
     def from_dict(cls, data: Dict[str, Any]) -> "AnalysisSeries":
         gene_list = GeneList.from_dict(data["geneList"])
         motif = Motif.from_dict(data["motif"])
-        result = [AnalysisResult.from_dict(r) for r in data.get("result", [])]
+        if "hits" in data:
+            hits = HitTable.from_dict(data["hits"])
+        else:
+            # Series serialized before hits were stored in columns have only `result`
+            results = [AnalysisResult.from_dict(r) for r in data.get("result", [])]
+            hits = HitTable.from_results(results, gene_list.genes)
         distribution = (Distribution.from_dict(data["distribution"])
                         if data.get("distribution") is not None else None)
         return cls(
@@ -248,7 +579,7 @@ class AnalysisSeries:
             stroke=data["stroke"],
             visible=data["visible"],
             no_overlaps=data["no_overlaps"],
-            result=result,
+            hits=hits,
             distribution=distribution,
         )
 
@@ -0,0 +1,133 @@
+from typing import List, Dict, Tuple
+
+import numpy as np
+
+from lib.analysis.hit_table import first_fit
+from lib.analysis.motif import Motif
+from lib.analysis.motif_scanner import MotifScanner
+
+# One bit per concrete nucleotide, plus a bit for any other character and one for gene separators
+A, C, G, T, U = 1, 2, 4, 8, 16
+OTHER = 32
+SEPARATOR = 64
+
+# Masks of the (possibly degenerate) codes, as they appear in sequences and in definitions
+NUCLEOTIDE_MASKS: Dict[str, int] = {
+    'A': A, 'C': C, 'G': G, 'T': T, 'U': U,
+    'R': A | G, 'Y': C | T, 'W': A | T, 'S': G | C,
+    'M': A | C, 'K': G | T,
+    'B': C | G | T, 'H': A | C | T, 'D': A | G | T, 'V': A | C | G,
+    'N': A | C | G | T,
+}
+
+_SEPARATOR_CHAR = '\n'
+
+_sequence_lookup = np.full(256, OTHER, dtype=np.uint8)
+for _code, _mask in NUCLEOTIDE_MASKS.items():
+    _sequence_lookup[ord(_code)] = _mask
+_sequence_lookup[ord(_SEPARATOR_CHAR)] = SEPARATOR
+
+# Mask of the complement of every mask (`U` pairs with `A`, like in `Motif.reverse_complements`)
+COMPLEMENT_MASKS = np.zeros(SEPARATOR << 1, dtype=np.uint8)
+for _mask in range(len(COMPLEMENT_MASKS)):
+    for _bit, _complement in ((A, T), (C, G), (G, C), (T, A), (U, A), (OTHER, OTHER), (SEPARATOR, SEPARATOR)):
+        if _mask & _bit:
+            COMPLEMENT_MASKS[_mask] |= _complement
+
+
+def sequence_masks(codes: np.ndarray) -> np.ndarray:
+    """Translates sequence bytes into their masks"""
+    return _sequence_lookup[codes]
+
+
+def definition_masks(definition: str) -> np.ndarray:
+    """
+    Translates a definition into the mask of sequence codes accepted at every position.
+
+    A sequence code matches a definition code when its nucleotides are a subset of the
+    definition code's nucleotides (e.g. `R` accepts `A`, `G` and `R`), which is exactly what
+    the character classes of `Motif.to_reg_exp` express. `N` accepts any character.
+    """
+    masks = np.empty(len(definition), dtype=np.uint8)
+    for i, code in enumerate(definition):
+        if code not in Motif.supported_nucleotides:
+            raise ValueError(f"Unsupported code `{code}`")
+        masks[i] = (SEPARATOR - 1) if code == 'N' else NUCLEOTIDE_MASKS[code]
+    return masks
+
+
+def encode_sequences(sequences: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encodes sequences into a single mask array, separated by a code that matches nothing.
+    :return: (masks, start offset of every sequence in masks)
+    """
+    joined = _SEPARATOR_CHAR.join(sequences).encode('ascii', 'replace')
+    masks = _sequence_lookup[np.frombuffer(joined, dtype=np.uint8)]
+    lengths = np.fromiter((len(sequence) + 1 for sequence in sequences), dtype=np.int64, count=len(sequences))
+    starts = np.zeros(len(sequences), dtype=np.int64)
+    if len(sequences) > 1:
+        np.cumsum(lengths[:-1], out=starts[1:])
+    return masks, starts
+
+
+def find_definition(masks: np.ndarray, definition_mask: np.ndarray) -> np.ndarray:
+    """
+    Finds every (also overlapping) start position where the definition matches.
+    :param masks: Encoded sequences, see `encode_sequences`
+    :param definition_mask: Encoded definition, see `definition_masks`
+    """
+    length = len(definition_mask)
+    windows = len(masks) - length + 1
+    if windows <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    rejected = np.invert(definition_mask)
+    matches = np.ones(windows, dtype=bool)
+    for i in range(length):
+        matches &= (masks[i:i + windows] & rejected[i]) == 0
+    return np.flatnonzero(matches)
+
+
+class BitmaskMotifScanner(MotifScanner):
+    """
+    Scan backend matching IUPAC codes as 4-bit nucleotide masks with NumPy.
+
+    All sequences of a batch are encoded into one `uint8` mask array, and every definition is
+    matched with one vectorized AND per definition position over the whole batch. Degenerate
+    definitions cost the same as concrete ones.
+
+    By default only non-overlapping matches of every definition are reported, the same as
+    `re2.finditer` does, so results can be cross-checked with `Re2MotifScanner`.
+    With `overlapping=True` every match position is reported.
+    """
+
+    def __init__(self, motifs: List[Motif], overlapping: bool = False):
+        """
+        :param motifs: The motifs to search for
+        :param overlapping: Whether to report overlapping matches of the same definition
+        """
+        super().__init__(motifs)
+        self.overlapping = overlapping
+        self._definition_masks = [definition_masks(definition) for definition in self.definitions]
+
+    def _find_definitions(self, sequences: List[str]) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        if not sequences:
+            return {}
+
+        masks, starts = encode_sequences(sequences)
+        matches: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+        for definition_index, definition_mask in enumerate(self._definition_masks):
+            length = len(definition_mask)
+            positions = find_definition(masks, definition_mask)
+            genes = np.searchsorted(starts, positions, side='right') - 1
+            offsets = positions - starts[genes]
+
+            if not self.overlapping:
+                keep = first_fit(genes, offsets, offsets + length)
+                genes, offsets = genes[keep], offsets[keep]
+
+            if len(genes):
+                matches[definition_index] = (genes, offsets)
+
+        return matches
@@ -1,7 +1,9 @@
-from typing import Optional, List, Dict, Set
-from dataclasses import dataclass
+from typing import Optional, List, Set
+from dataclasses import dataclass, field
 
-from lib.analysis.analysis_result import AnalysisResult
+import numpy as np
+
+from lib.genes.genes import Gene
 
 
 class Distribution:
@@ -19,8 +21,13 @@ class Distribution:
         self.name = name
         self.color = color
 
-        self._counts: Dict[int, int] = {}
-        self._genes: Dict[int, Set[str]] = {}
+        self._counts: Optional[np.ndarray] = None
+        self._genes_counts: Optional[np.ndarray] = None
+        # Distinct (bucket, gene index) pairs, sorted by bucket, and where each bucket starts in them
+        self._bucket_genes: Optional[np.ndarray] = None
+        self._bucket_starts: Optional[np.ndarray] = None
+        self._gene_list: List[Gene] = []
+        self._dataPoints: Optional[List["DistributionDataPoint"]] = None
         self._totalCount: int = 0
         self._totalGenesCount: int = 0
         self._totalGenesWithMotifCount: int = 0
@@ -37,58 +44,74 @@ class Distribution:
     def totalGenesWithMotifCount(self) -> int:
         return self._totalGenesWithMotifCount
 
+    @property
+    def num_buckets(self) -> int:
+        return (self.max - self.min) // self.bucket_size
+
     @property
     def dataPoints(self) -> List["DistributionDataPoint"]:
-        if not self._counts or not self._genes:
+        """The buckets of the distribution, created once after `run`"""
+        if self._dataPoints is not None:
+            return self._dataPoints
+        if self._counts is None:
             return []
 
         data_points = []
-        num_buckets = (self.max - self.min) // self.bucket_size
-
-        for i in range(num_buckets):
-            dp_min = self.min + i * self.bucket_size
-            dp_max = self.min + (i + 1) * self.bucket_size
-            count_value = self._counts.get(i, 0)
-            genes_set = self._genes.get(i, set())
-            # print(f"✅ DEBUG: Data point {dp_min}-{dp_max}: count={count_value} genes set count {len(genes_set)}")
+        for i, (count_value, genes_count) in enumerate(zip(self._counts.tolist(), self._genes_counts.tolist())):
             data_points.append(
                 DistributionDataPoint(
-                    min=dp_min,
-                    max=dp_max,
+                    min=self.min + i * self.bucket_size,
+                    max=self.min + (i + 1) * self.bucket_size,
                     count=count_value,
                     percent=(count_value / self._totalCount) if self._totalCount > 0 else 0.0,
-                    genes=genes_set,
-                    genes_percent=(len(genes_set) / self._totalGenesCount) if self._totalGenesCount > 0 else 0.0
+                    genes_count=genes_count,
+                    genes_percent=(genes_count / self._totalGenesCount) if self._totalGenesCount > 0 else 0.0,
+                    gene_indices=self._bucket_genes[self._bucket_starts[i]:self._bucket_starts[i + 1]],
+                    gene_list=self._gene_list,
                 )
             )
+        self._dataPoints = data_points
         return data_points
 
-    def run(self, results: List["AnalysisResult"], total_genes_count: int) -> None:
-        counts: Dict[int, int] = {}
-        gene_counts: Dict[int, Set[str]] = {}
-
-        for result in results:
-            offset = 0
-            if self.align_marker is not None and self.align_marker in result.gene.markers:
-                offset = result.gene.markers[self.align_marker]
-            position = result.position - offset
-            if position < self.min or position > self.max:
-                continue
-
-            interval_index = int((position - self.min) // self.bucket_size)
-
-            counts[interval_index] = counts.get(interval_index, 0) + 1
-
-            if interval_index not in gene_counts:
-                gene_counts[interval_index] = set()
-            gene_counts[interval_index].add(result.gene.geneId)
-
-        self._counts = counts
-        self._genes = {k: v for k, v in gene_counts.items()}
-
-        self._totalCount = len(results)
+    def run(self, positions: np.ndarray, gene_indices: np.ndarray, genes: List[Gene], total_genes_count: int,
+            marker_offsets: Optional[np.ndarray] = None) -> None:
+        """
+        Bins hits into the buckets.
+        :param positions: Position of every hit
+        :param gene_indices: Index of the gene of every hit, into `genes`
+        :param genes: The genes searched
+        :param total_genes_count: The number of genes searched
+        :param marker_offsets: Position of `align_marker` in every gene (see `GeneList.marker_offsets`),
+            subtracted from the hit positions
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        gene_indices = np.asarray(gene_indices, dtype=np.int64)
+        if self.align_marker is not None and marker_offsets is not None and len(positions):
+            positions = positions - marker_offsets[gene_indices]
+
+        # Hits at exactly `max` fall past the last bucket and are not shown, like hits outside <min; max>
+        in_range = (positions >= self.min) & (positions <= self.max)
+        num_buckets = self.num_buckets
+        buckets = (positions[in_range] - self.min) // self.bucket_size
+        shown = buckets < num_buckets
+        buckets, bucket_gene_indices = buckets[shown], gene_indices[in_range][shown]
+
+        if in_range.any():
+            self._counts = np.bincount(buckets, minlength=num_buckets)[:num_buckets]
+            pairs = np.unique(buckets * max(len(genes), 1) + bucket_gene_indices)
+            pair_buckets = pairs // max(len(genes), 1)
+            self._bucket_genes = pairs % max(len(genes), 1)
+            self._genes_counts = np.bincount(pair_buckets, minlength=num_buckets)[:num_buckets]
+            self._bucket_starts = np.zeros(num_buckets + 1, dtype=np.int64)
+            np.cumsum(self._genes_counts, out=self._bucket_starts[1:])
+        else:
+            self._counts = self._genes_counts = self._bucket_genes = self._bucket_starts = None
+        self._gene_list = genes
+        self._dataPoints = None
+
+        self._totalCount = len(positions)
         self._totalGenesCount = total_genes_count
-        self._totalGenesWithMotifCount = len({r.gene.geneId for r in results})
+        self._totalGenesWithMotifCount = len(np.unique(gene_indices))
 
     def to_dict(self) -> dict:
         return {
@@ -121,12 +144,19 @@ class DistributionDataPoint:
     max: int
     count: int
     percent: float
-    genes: Set[str]
+    genes_count: int
     genes_percent: float
+    gene_indices: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64), repr=False)
+    gene_list: List[Gene] = field(default_factory=list, repr=False)
+
+    @property
+    def genes(self) -> Set[str]:
+        """IDs of the genes with a hit in the bucket"""
+        return {self.gene_list[gene_index].geneId for gene_index in self.gene_indices.tolist()}
 
     @property
     def genesCount(self) -> int:
-        return len(self.genes)
+        return self.genes_count
 
     @property
     def label(self) -> str:
@@ -0,0 +1,216 @@
+from typing import Optional, Dict, Any
+
+import numpy as np
+
+from lib.analysis.bitmask_scanner import NUCLEOTIDE_MASKS, SEPARATOR, OTHER, definition_masks
+from lib.analysis.sequence_index import SequenceIndex, ranges
+from lib.genes.gene_list import GeneList
+
+# Alphabet of the indexed text: the terminator, the gene separator, the IUPAC codes and anything else
+_TERMINATOR = 0
+_SEPARATOR = 1
+_CODES = 'ACGTURYWSMKBHDVN'
+_OTHER = len(_CODES) + 2
+_SIGMA = _OTHER + 1
+
+_symbol_lookup = np.full(256, _OTHER, dtype=np.uint8)
+_symbol_lookup[ord('\n')] = _SEPARATOR
+for _symbol, _code in enumerate(_CODES, start=2):
+    _symbol_lookup[ord(_code)] = _symbol
+
+# Nucleotide mask of every symbol, a symbol matches a definition code if its mask is a subset
+_symbol_masks = np.array(
+    [SEPARATOR, SEPARATOR] + [NUCLEOTIDE_MASKS[code] for code in _CODES] + [OTHER],
+    dtype=np.uint8
+)
+
+
+class FmIndex(SequenceIndex):
+    """
+    FM-index (BWT of the suffix array) of an organism.
+
+    Definitions are answered by backward search: one rank lookup per definition code and
+    concrete symbol, so the cost of counting grows with the definition length and not with the
+    organism size. Degenerate codes branch the search into the symbols they allow, which keeps
+    the answer exact for all IUPAC codes in the sequences. Positions are then recovered from
+    a sampled suffix array.
+
+    Built offline by the `build_fm_index` management command.
+    """
+
+    SUFFIX = ".fmidx"
+    # Occurrence counts are stored for every BLOCK_SIZE-th BWT row
+    BLOCK_SIZE = 64
+    # Suffix array entries are stored for every SAMPLE_RATE-th text position
+    SAMPLE_RATE = 32
+    # Definitions branching into more suffix array ranges than this are scanned live instead
+    MAX_RANGES = 1 << 16
+    # Rows located at once, bounds the temporary (rows x BLOCK_SIZE) arrays of the rank lookups
+    LOCATE_CHUNK = 1 << 16
+
+    def __init__(self, gene_ids: np.ndarray, gene_starts: np.ndarray, gene_lengths: np.ndarray,
+                 irregular: np.ndarray, bwt: np.ndarray, symbol_starts: np.ndarray, checkpoints: np.ndarray,
+                 sampled_rows: np.ndarray, sampled_positions: np.ndarray,
+                 block_size: int = BLOCK_SIZE, sample_rate: int = SAMPLE_RATE):
+        """
+        :param bwt: The Burrows-Wheeler transform of the concatenated sequences, as symbols
+        :param symbol_starts: For every symbol, the number of smaller symbols in the text (the `C` array)
+        :param checkpoints: Occurrences of every symbol in bwt[:i * block_size], shape (rows / block_size + 1, symbols)
+        :param sampled_rows: Sorted BWT rows whose text position is sampled
+        :param sampled_positions: Text positions of the sampled rows
+        :param block_size: Distance of the checkpoints
+        :param sample_rate: Distance of the sampled text positions
+        """
+        super().__init__(gene_ids, gene_starts, gene_lengths, irregular)
+        self.bwt = bwt
+        self.symbol_starts = symbol_starts
+        self.checkpoints = checkpoints
+        self.sampled_rows = sampled_rows
+        self.sampled_positions = sampled_positions
+        self.block_size = block_size
+        self.sample_rate = sample_rate
+
+    @classmethod
+    def build(cls, gene_list: GeneList, block_size: int = BLOCK_SIZE, sample_rate: int = SAMPLE_RATE) -> "FmIndex":
+        """
+        Builds the index of all genes of a GeneList.
+        """
+        joined, gene_ids, gene_starts, gene_lengths, duplicated = cls.layout(gene_list.genes)
+        text = np.append(_symbol_lookup[np.frombuffer(joined, dtype=np.uint8)], _TERMINATOR).astype(np.uint8)
+
+        suffix_array = _suffix_array(text)
+        bwt = text[suffix_array - 1]
+
+        counts = np.bincount(text, minlength=_SIGMA)
+        symbol_starts = np.zeros(_SIGMA + 1, dtype=np.int64)
+        np.cumsum(counts, out=symbol_starts[1:])
+
+        checkpoints = np.zeros((len(bwt) // block_size + 1, _SIGMA), dtype=np.int64)
+        for symbol in range(_SIGMA):
+            checkpoints[1:, symbol] = np.cumsum(bwt == symbol)[block_size - 1::block_size]
+
+        sampled_rows = np.flatnonzero(suffix_array % sample_rate == 0)
+        sampled_positions = suffix_array[sampled_rows]
+
+        return cls(gene_ids, gene_starts, gene_lengths, duplicated, bwt, symbol_starts, checkpoints,
+                   sampled_rows, sampled_positions, block_size, sample_rate)
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            **super()._arrays(),
+            "bwt": self.bwt,
+            "symbol_starts": self.symbol_starts,
+            "checkpoints": self.checkpoints,
+            "sampled_rows": self.sampled_rows,
+            "sampled_positions": self.sampled_positions,
+        }
+
+    def _meta(self) -> Dict[str, Any]:
+        return {"block_size": self.block_size, "sample_rate": self.sample_rate}
+
+    def count(self, definition: str) -> Optional[int]:
+        """
+        Counts the (also overlapping) matches of a definition, without locating them.
+        :return: The number of matches, or None when the search branches into too many ranges
+        """
+        search = self._backward_search(definition)
+        if search is None:
+            return None
+        lows, highs = search
+        return int((highs - lows).sum())
+
+    def find(self, definition: str) -> Optional[np.ndarray]:
+        """
+        Finds every (also overlapping) match of a definition.
+        :return: Sorted positions in the concatenated sequences, or None when the search branches
+            into too many ranges and the definition should be scanned live
+        """
+        search = self._backward_search(definition)
+        if search is None:
+            return None
+        rows = ranges(*search)
+        chunks = [self._locate(rows[i:i + self.LOCATE_CHUNK]) for i in range(0, len(rows), self.LOCATE_CHUNK)]
+        return np.sort(np.concatenate(chunks)) if chunks else np.zeros(0, dtype=np.int64)
+
+    def _backward_search(self, definition: str):
+        """
+        :return: (lows, highs) of the BWT row ranges of all suffixes starting with a match
+        """
+        lows = np.zeros(1, dtype=np.int64)
+        highs = np.full(1, len(self.bwt), dtype=np.int64)
+
+        for mask in definition_masks(definition)[::-1]:
+            next_lows, next_highs = [], []
+            for symbol in np.flatnonzero((_symbol_masks & ~mask) == 0):
+                symbol_lows = self.symbol_starts[symbol] + self._occurrences(symbol, lows)
+                symbol_highs = self.symbol_starts[symbol] + self._occurrences(symbol, highs)
+                non_empty = symbol_lows < symbol_highs
+                next_lows.append(symbol_lows[non_empty])
+                next_highs.append(symbol_highs[non_empty])
+
+            lows = np.concatenate(next_lows) if next_lows else np.zeros(0, dtype=np.int64)
+            highs = np.concatenate(next_highs) if next_highs else np.zeros(0, dtype=np.int64)
+            if len(lows) > self.MAX_RANGES:
+                return None
+            if not len(lows):
+                break
+
+        return lows, highs
+
+    def _occurrences(self, symbols, rows: np.ndarray) -> np.ndarray:
+        """
+        Counts the occurrences of symbols in bwt[:rows], for every row.
+        :param symbols: A symbol, or an array of symbols of the same size as `rows`
+        """
+        symbols = np.broadcast_to(np.asarray(symbols, dtype=np.int64), rows.shape)
+        blocks = rows // self.block_size
+        block_starts = blocks * self.block_size
+        counts = self.checkpoints[blocks, symbols]
+
+        offsets = np.arange(self.block_size)
+        window = np.minimum(block_starts[:, None] + offsets[None, :], len(self.bwt) - 1)
+        inside = offsets[None, :] < (rows - block_starts)[:, None]
+        return counts + ((self.bwt[window] == symbols[:, None]) & inside).sum(axis=1)
+
+    def _locate(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Recovers the text positions of BWT rows by walking LF until a sampled row is reached.
+        """
+        positions = np.empty(len(rows), dtype=np.int64)
+        pending = np.arange(len(rows))
+        rows = rows.astype(np.int64)
+        steps = 0
+        while len(pending):
+            sample = np.minimum(np.searchsorted(self.sampled_rows, rows), len(self.sampled_rows) - 1)
+            sampled = self.sampled_rows[sample] == rows
+            positions[pending[sampled]] = self.sampled_positions[sample[sampled]] + steps
+
+            pending, rows = pending[~sampled], rows[~sampled]
+            symbols = self.bwt[rows].astype(np.int64)
+            rows = self.symbol_starts[symbols] + self._occurrences(symbols, rows)
+            steps += 1
+        return positions
+
+
+def _suffix_array(text: np.ndarray) -> np.ndarray:
+    """
+    Sorts the suffixes of a text ending with a unique smallest terminator, by prefix doubling.
+    """
+    size = len(text)
+    rank = text.astype(np.int64)
+    order = np.arange(size)
+    shift = 1
+    while True:
+        next_rank = np.full(size, -1, dtype=np.int64)
+        next_rank[:size - shift] = rank[shift:]
+        order = np.lexsort((next_rank, rank))
+
+        first, second = rank[order], next_rank[order]
+        boundary = np.ones(size, dtype=bool)
+        boundary[1:] = (first[1:] != first[:-1]) | (second[1:] != second[:-1])
+        rank = np.empty(size, dtype=np.int64)
+        rank[order] = np.cumsum(boundary) - 1
+
+        if rank[order[-1]] == size - 1:
+            return order
+        shift *= 2
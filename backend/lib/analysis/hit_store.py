@@ -0,0 +1,202 @@
+import os
+from typing import List, Dict, Optional, Tuple, Any
+
+import numpy as np
+
+from lib.analysis.hit_table import HitTable
+from lib.analysis.motif import Motif
+from lib.analysis.motif_scanner import get_scanner
+from lib.genes.gene_columns import gene_id_checksum
+from lib.genes.gene_list import GeneList
+from lib.utilities.array_store import save_arrays, load_arrays, source_stamp, content_hash, SourceStamp
+
+
+class HitStore:
+    """
+    Precomputed hits of the preset motifs for an organism.
+
+    Holds the raw hits (before non-overlap filtering) of every stored motif over all genes of a
+    FASTA file, with genes referenced by their row in the file. Motifs are keyed by their
+    definitions (`Motif.id`) and the store by the SHA-256 of the FASTA content, so renamed
+    motifs still match and a changed file is never answered from a stale store. The checksum
+    of the gene IDs in file order is kept too, so rows are only looked up for the same genes.
+
+    Columns are delta-encoded and stored in the smallest unsigned type that fits: gene rows
+    as the difference to the previous hit, positions as the difference to the previous hit of
+    the same gene and definition. Stores are built by the `build_hit_store` management command
+    and saved next to the FASTA file.
+    """
+
+    SUFFIX = ".hits"
+
+    _opened: Dict[str, Tuple[SourceStamp, "HitStore"]] = {}
+
+    def __init__(self, fasta_hash: str, gene_count: int, gene_checksum: int, motifs: Dict[str, Dict[str, Any]],
+                 gene_deltas: np.ndarray, position_deltas: np.ndarray, definition_ids: np.ndarray,
+                 strands: np.ndarray):
+        """
+        :param fasta_hash: SHA-256 of the FASTA file the hits were computed from
+        :param gene_count: The number of genes in the file
+        :param gene_checksum: Checksum of the gene IDs in file order, see `gene_id_checksum`
+        :param motifs: Map of motif ID -> {"start", "end": range of its hits, "definitions": its definitions}
+        :param gene_deltas: Gene row of every hit, minus the row of the previous hit of the motif
+        :param position_deltas: Start of every hit, minus the start of the previous hit of the same
+            gene and definition
+        :param definition_ids: Index of the matching definition, into the motif's definitions
+        :param strands: `HitTable.FORWARD` or `HitTable.REVERSE` for every hit
+        """
+        self.fasta_hash = fasta_hash
+        self.gene_count = gene_count
+        self.gene_checksum = gene_checksum
+        self.motifs = motifs
+        self.gene_deltas = gene_deltas
+        self.position_deltas = position_deltas
+        self.definition_ids = definition_ids
+        self.strands = strands
+
+    @classmethod
+    def path_for(cls, fasta_path: str) -> str:
+        return f"{fasta_path}{cls.SUFFIX}"
+
+    @classmethod
+    def build(cls, gene_list: GeneList, motifs: List[Motif], batch_size: int = 1000) -> "HitStore":
+        """
+        Scans all genes of a GeneList loaded from a FASTA file for the motifs.
+        """
+        motifs = list({motif.id: motif for motif in motifs}.values())
+        scanner = get_scanner(motifs, 're2')
+        # Rows are file rows, whatever order the gene list was sorted in
+        genes = gene_list.columns.genes() if gene_list.columns is not None else gene_list.genes
+
+        batch_starts = list(range(0, len(genes), batch_size))
+        batch_tables = [scanner.scan_genes(genes[i:i + batch_size]) for i in batch_starts]
+
+        entries: Dict[str, Dict[str, Any]] = {}
+        columns: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = []
+        start = 0
+        for motif_index, motif in enumerate(motifs):
+            hits = HitTable.concatenate([tables[motif_index] for tables in batch_tables], gene_offsets=batch_starts)
+
+            # Keep only the motif's own definitions, in its order
+            used = sorted(set(hits.definition_ids.tolist()))
+            remap = np.zeros(max(used, default=0) + 1, dtype=np.int64)
+            remap[used] = np.arange(len(used))
+            definition_ids = remap[hits.definition_ids]
+
+            gene_rows = hits.gene_indices.astype(np.int64)
+            positions = hits.raw_positions.astype(np.int64)
+            runs = _run_starts(gene_rows, definition_ids)
+            position_deltas = positions.copy()
+            position_deltas[~runs] = np.diff(positions)[~runs[1:]]
+            columns.append((np.diff(gene_rows, prepend=0), position_deltas, definition_ids, hits.strands))
+
+            entries[motif.id] = {
+                "start": start,
+                "end": start + len(hits),
+                "definitions": [hits.definitions[i] for i in used],
+            }
+            start += len(hits)
+
+        return cls(
+            content_hash(gene_list.source),
+            len(genes),
+            gene_id_checksum(gene.geneId for gene in genes),
+            entries,
+            *(_compact(np.concatenate([column[i] for column in columns]) if columns else np.zeros(0, dtype=np.uint8))
+              for i in range(4)),
+        )
+
+    def save(self, path: str, fasta_path: str) -> None:
+        save_arrays(
+            path,
+            {
+                "gene_deltas": self.gene_deltas,
+                "position_deltas": self.position_deltas,
+                "definition_ids": self.definition_ids,
+                "strands": self.strands,
+            },
+            {
+                "fasta_hash": self.fasta_hash,
+                "gene_count": self.gene_count,
+                "gene_checksum": self.gene_checksum,
+                "motifs": self.motifs,
+                **source_stamp(fasta_path),
+            }
+        )
+
+    @classmethod
+    def for_fasta(cls, fasta_path: Optional[str]) -> Optional["HitStore"]:
+        """
+        Returns the store of a FASTA file if one was built from its current content, None otherwise.
+        """
+        if not fasta_path:
+            return None
+        path = cls.path_for(fasta_path)
+        if not os.path.isdir(path):
+            return None
+
+        stamp = source_stamp(fasta_path)
+        opened = cls._opened.get(path)
+        if opened is not None and opened[0] == stamp:
+            return opened[1]
+
+        try:
+            arrays, meta = load_arrays(path)
+            if meta["fasta_hash"] != content_hash(fasta_path):
+                return None
+            store = cls(meta["fasta_hash"], meta["gene_count"], meta["gene_checksum"], meta["motifs"], **arrays)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        cls._opened[path] = (stamp, store)
+        return store
+
+    def hits_for(self, motif: Motif, rows: np.ndarray) -> Optional[HitTable]:
+        """
+        Returns the raw hits of a motif in some of the genes.
+        :param motif: The motif, matched by its definitions
+        :param rows: Rows of the genes in the FASTA file; gene indices of the hits refer to this array
+        :return: The hits, ordered by gene (in `rows` order), definition and position,
+            or None if the motif is not stored
+        """
+        entry = self.motifs.get(motif.id)
+        if entry is None:
+            return None
+        start, end = entry["start"], entry["end"]
+
+        gene_deltas = self.gene_deltas[start:end].astype(np.int64)
+        definition_ids = self.definition_ids[start:end].astype(np.int64)
+        gene_rows = np.cumsum(gene_deltas)
+        positions = _segmented_cumsum(self.position_deltas[start:end].astype(np.int64),
+                                      _run_starts(gene_rows, definition_ids))
+
+        index_of_row = np.full(self.gene_count, -1, dtype=np.int64)
+        index_of_row[rows] = np.arange(len(rows))
+        hits = HitTable(entry["definitions"], gene_rows, positions, definition_ids, self.strands[start:end])
+        return hits.remap_genes(index_of_row)
+
+
+def _run_starts(gene_rows: np.ndarray, definition_ids: np.ndarray) -> np.ndarray:
+    """Marks the first hit of every (gene, definition) run"""
+    starts = np.ones(len(gene_rows), dtype=bool)
+    starts[1:] = (gene_rows[1:] != gene_rows[:-1]) | (definition_ids[1:] != definition_ids[:-1])
+    return starts
+
+
+def _segmented_cumsum(values: np.ndarray, run_starts: np.ndarray) -> np.ndarray:
+    """Cumulative sum restarting at every run start"""
+    if not len(values):
+        return values
+    totals = np.cumsum(values)
+    first = np.flatnonzero(run_starts)
+    base = totals[first] - values[first]
+    return totals - np.repeat(base, np.diff(np.append(first, len(values))))
+
+
+def _compact(values: np.ndarray) -> np.ndarray:
+    """Casts non-negative integers to the smallest unsigned type that holds them"""
+    top = int(values.max()) if len(values) else 0
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if top <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+    return values.astype(np.uint64)
@@ -0,0 +1,270 @@
+from collections.abc import Sequence
+from typing import List, Dict, Optional, Any, Iterator, Union
+
+import numpy as np
+
+from lib.analysis.analysis_result import AnalysisResult
+from lib.analysis.motif import Motif
+from lib.genes.genes import Gene
+
+
+def first_fit(groups: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Greedy non-overlapping selection: within every group, keeps the first hit and then every
+    hit that starts at or after the end of the last kept one.
+    Hits must be ordered by (group, start).
+    :return: Boolean mask of the kept hits
+    """
+    count = len(starts)
+    keep = np.zeros(count, dtype=bool)
+    if count == 0:
+        return keep
+
+    # Shift every group past the previous one, so a single sorted key covers all groups
+    span = int(ends.max()) + 1
+    start_keys = groups.astype(np.int64) * span + starts
+    end_keys = groups.astype(np.int64) * span + ends
+
+    # A hit that starts after everything before it ends is always kept
+    reach = np.maximum.accumulate(end_keys)
+    heads = np.ones(count, dtype=bool)
+    heads[1:] = start_keys[1:] >= reach[:-1]
+    keep[heads] = True
+
+    # Every kept hit is followed by the first hit of its group starting at or after its end.
+    # Past the end of a group this lands on the first hit of the next group, which is a head.
+    following = np.searchsorted(start_keys, end_keys, side='left')
+    frontier = np.flatnonzero(heads)
+    while frontier.size:
+        frontier = following[frontier]
+        frontier = frontier[frontier < count]
+        frontier = frontier[~keep[frontier]]
+        keep[frontier] = True
+    return keep
+
+
+class HitTable:
+    """
+    Columnar storage of motif hits, one row per hit.
+
+    Hits refer to genes by their index in the scanned gene list and to the concrete definition
+    that matched by its index in `definitions`, so a table holds no Python objects per hit.
+    The matched sequence is not stored, it is the gene data at the hit (definitions have fixed length).
+    """
+
+    FORWARD = 0
+    REVERSE = 1
+    STRAND_SYMBOLS = ('+', '-')
+
+    def __init__(self, definitions: List[str], gene_indices: np.ndarray, raw_positions: np.ndarray,
+                 definition_ids: np.ndarray, strands: np.ndarray, positions: Optional[np.ndarray] = None):
+        """
+        :param definitions: The concrete definitions the hits refer to
+        :param gene_indices: Index of the gene of every hit
+        :param raw_positions: The start of every hit (in the gene data, starting from 0)
+        :param definition_ids: Index of the definition that matched, into `definitions`
+        :param strands: `FORWARD` or `REVERSE` for every hit
+        :param positions: The position of every hit midpoint, computed when not given
+        """
+        self.definitions = definitions
+        self.gene_indices = np.asarray(gene_indices, dtype=np.int32)
+        self.raw_positions = np.asarray(raw_positions, dtype=np.int32)
+        self.definition_ids = np.asarray(definition_ids, dtype=np.int32)
+        self.strands = np.asarray(strands, dtype=np.int8)
+        if positions is None:
+            positions = self.raw_positions + self.lengths // 2
+        self.positions = np.asarray(positions, dtype=np.int32)
+
+    @classmethod
+    def empty(cls, definitions: Optional[List[str]] = None) -> "HitTable":
+        return cls(definitions or [], *(np.zeros(0, dtype=np.int32) for _ in range(4)))
+
+    def __len__(self) -> int:
+        return len(self.raw_positions)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """The length of every hit"""
+        definition_lengths = np.array([len(definition) for definition in self.definitions], dtype=np.int32)
+        return definition_lengths[self.definition_ids] if len(definition_lengths) else np.zeros(0, dtype=np.int32)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the columns of the table"""
+        return sum(column.nbytes for column in (self.gene_indices, self.raw_positions, self.definition_ids,
+                                                self.strands, self.positions))
+
+    @property
+    def ends(self) -> np.ndarray:
+        """The end of every hit (exclusive)"""
+        return self.raw_positions + self.lengths
+
+    def take(self, selector: Union[np.ndarray, slice]) -> "HitTable":
+        """Returns the hits selected by a mask, index array or slice"""
+        return HitTable(
+            self.definitions,
+            self.gene_indices[selector],
+            self.raw_positions[selector],
+            self.definition_ids[selector],
+            self.strands[selector],
+            self.positions[selector],
+        )
+
+    def remap_genes(self, index_of_gene: np.ndarray) -> "HitTable":
+        """
+        Re-indexes the hits to another gene list, e.g. a subset of the scanned genes.
+        :param index_of_gene: New index of every scanned gene, -1 for genes to drop
+        :return: The hits of the kept genes, ordered by their new index and then in table order
+        """
+        gene_indices = np.asarray(index_of_gene)[self.gene_indices]
+        selected = np.flatnonzero(gene_indices >= 0)
+        selected = selected[np.argsort(gene_indices[selected], kind='stable')]
+        hits = self.take(selected)
+        hits.gene_indices = gene_indices[selected].astype(np.int32)
+        return hits
+
+    @classmethod
+    def concatenate(cls, tables: List["HitTable"], gene_offsets: Optional[List[int]] = None) -> "HitTable":
+        """
+        Joins tables, e.g. of consecutive gene batches.
+        :param gene_offsets: Added to the gene indices of every table
+        """
+        if not tables:
+            return cls.empty()
+
+        definitions = list(tables[0].definitions)
+        definition_ids = []
+        for table in tables:
+            if table.definitions == definitions:
+                definition_ids.append(table.definition_ids)
+                continue
+            for definition in table.definitions:
+                if definition not in definitions:
+                    definitions.append(definition)
+            remap = np.array([definitions.index(definition) for definition in table.definitions], dtype=np.int32)
+            definition_ids.append(remap[table.definition_ids] if len(remap) else table.definition_ids)
+
+        gene_indices = [table.gene_indices for table in tables]
+        if gene_offsets is not None:
+            gene_indices = [indices + offset for indices, offset in zip(gene_indices, gene_offsets)]
+
+        return cls(
+            definitions,
+            np.concatenate(gene_indices),
+            np.concatenate([table.raw_positions for table in tables]),
+            np.concatenate(definition_ids),
+            np.concatenate([table.strands for table in tables]),
+            np.concatenate([table.positions for table in tables]),
+        )
+
+    def without_overlaps(self, by_strand: bool = False) -> "HitTable":
+        """
+        Greedy non-overlapping selection, on all genes at once: within every gene, keeps the hit
+        that starts first and then every hit starting at or after the end of the last kept one.
+        Hits starting at the same position are taken in table order.
+        :param by_strand: Whether to select on each strand separately, so that forward and reverse
+            hits never suppress each other
+        :return: The kept hits, ordered by gene and position
+        """
+        if by_strand:
+            order = np.lexsort((self.raw_positions, self.strands, self.gene_indices))
+            groups = self.gene_indices[order].astype(np.int64) * 2 + self.strands[order]
+        else:
+            order = np.lexsort((self.raw_positions, self.gene_indices))
+            groups = self.gene_indices[order]
+
+        starts = self.raw_positions[order].astype(np.int64)
+        keep = first_fit(groups, starts, starts + self.lengths[order])
+        kept = order[keep]
+        if by_strand:
+            kept = kept[np.lexsort((self.raw_positions[kept], self.gene_indices[kept]))]
+        return self.take(kept)
+
+    @classmethod
+    def from_results(cls, results: List[AnalysisResult], genes: List[Gene]) -> "HitTable":
+        """
+        Builds a table from AnalysisResult objects.
+        :param genes: The genes the gene indices should refer to, matched by gene ID
+        """
+        rows = {gene.geneId: row for row, gene in enumerate(genes)}
+        definitions: List[str] = []
+        definition_ids: Dict[str, int] = {}
+        for result in results:
+            if result.match not in definition_ids:
+                definition_ids[result.match] = len(definitions)
+                definitions.append(result.match)
+
+        return cls(
+            definitions,
+            np.array([rows[result.gene.geneId] for result in results], dtype=np.int32),
+            np.array([result.raw_position for result in results], dtype=np.int32),
+            np.array([definition_ids[result.match] for result in results], dtype=np.int32),
+            np.array([cls.FORWARD if result.match in result.motif.definitions else cls.REVERSE
+                      for result in results], dtype=np.int8),
+            np.array([result.position for result in results], dtype=np.int32),
+        )
+
+    def result(self, row: int, genes: List[Gene], motif: Motif) -> AnalysisResult:
+        """Materializes a single hit"""
+        gene = genes[self.gene_indices[row]]
+        raw_position = int(self.raw_positions[row])
+        match = self.definitions[self.definition_ids[row]]
+        return AnalysisResult(
+            gene=gene,
+            motif=motif,
+            raw_position=raw_position,
+            position=int(self.positions[row]),
+            match=match,
+            matched_sequence=gene.data[raw_position:raw_position + len(match)],
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "definitions": self.definitions,
+            "gene_indices": self.gene_indices.tolist(),
+            "raw_positions": self.raw_positions.tolist(),
+            "definition_ids": self.definition_ids.tolist(),
+            "strands": self.strands.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "HitTable":
+        return cls(
+            definitions=data["definitions"],
+            gene_indices=np.array(data["gene_indices"], dtype=np.int32),
+            raw_positions=np.array(data["raw_positions"], dtype=np.int32),
+            definition_ids=np.array(data["definition_ids"], dtype=np.int32),
+            strands=np.array(data["strands"], dtype=np.int8),
+        )
+
+
+class HitResults(Sequence):
+    """
+    Read-only list of AnalysisResult over a HitTable. Results are created on access only.
+    """
+
+    def __init__(self, hits: HitTable, genes: List[Gene], motif: Motif):
+        """
+        :param hits: The hits
+        :param genes: The genes the gene indices of the hits refer to
+        :param motif: The motif that was searched
+        """
+        self.hits = hits
+        self.genes = genes
+        self.motif = motif
+
+    def __len__(self) -> int:
+        return len(self.hits)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return HitResults(self.hits.take(index), self.genes, self.motif)
+        if index < 0:
+            index += len(self.hits)
+        if not 0 <= index < len(self.hits):
+            raise IndexError("result index out of range")
+        return self.hits.result(index, self.genes, self.motif)
+
+    def __iter__(self) -> Iterator[AnalysisResult]:
+        for row in range(len(self.hits)):
+            yield self.hits.result(row, self.genes, self.motif)
@@ -0,0 +1,146 @@
+from typing import Optional, Dict, Any
+
+import numpy as np
+
+from lib.analysis.bitmask_scanner import NUCLEOTIDE_MASKS, definition_masks
+from lib.analysis.sequence_index import SequenceIndex, ranges
+from lib.genes.gene_list import GeneList
+
+# 2-bit codes of the indexed nucleotides, anything else (and the gene separator) is 4
+_BASES = 'ACGT'
+_UNINDEXED = 4
+
+_code_lookup = np.full(256, _UNINDEXED, dtype=np.uint8)
+for _code, _base in enumerate(_BASES):
+    _code_lookup[ord(_base)] = _code
+
+_base_masks = np.array([NUCLEOTIDE_MASKS[base] for base in _BASES], dtype=np.uint8)
+
+
+class KmerIndex(SequenceIndex):
+    """
+    Positional k-mer index of an organism.
+
+    Every window of `k` nucleotides of every gene is indexed by its k-mer; for each k-mer the
+    index holds the sorted positions of its windows in the concatenated sequences. Definitions
+    are answered by expanding their first `k` codes into concrete k-mers and verifying the
+    remaining codes against the stored sequence.
+
+    Only genes made purely of `ACGT` are indexed. Genes with other codes (or duplicate IDs)
+    are marked irregular and are scanned live, so answers are exact.
+
+    Built offline by the `build_kmer_index` management command.
+    """
+
+    SUFFIX = ".kmers"
+    DEFAULT_K = 8
+    # Definitions expanding into more k-mers than this are scanned live instead
+    MAX_EXPANSION = 1 << 14
+
+    def __init__(self, k: int, gene_ids: np.ndarray, gene_starts: np.ndarray, gene_lengths: np.ndarray,
+                 irregular: np.ndarray, sequence: np.ndarray, kmer_starts: np.ndarray, positions: np.ndarray):
+        """
+        :param k: The k-mer length
+        :param sequence: The concatenated sequences as 2-bit codes (4 for anything else)
+        :param kmer_starts: For every k-mer, the start of its positions (CSR offsets, size 4^k + 1)
+        :param positions: Positions of all indexed windows, grouped by k-mer, sorted within each k-mer
+        """
+        super().__init__(gene_ids, gene_starts, gene_lengths, irregular)
+        self.k = k
+        self.sequence = sequence
+        self.kmer_starts = kmer_starts
+        self.positions = positions
+
+    @classmethod
+    def build(cls, gene_list: GeneList, k: int = DEFAULT_K) -> "KmerIndex":
+        """
+        Builds the index of all genes of a GeneList.
+        """
+        genes = gene_list.genes
+        joined, gene_ids, gene_starts, gene_lengths, duplicated = cls.layout(genes)
+        sequence = _code_lookup[np.frombuffer(joined, dtype=np.uint8)]
+
+        unindexed = sequence == _UNINDEXED
+        # Each gene owns its sequence plus the separator that follows it
+        unindexed_per_gene = (np.add.reduceat(unindexed.astype(np.int64), gene_starts) if len(genes)
+                              else np.zeros(0, dtype=np.int64))
+        irregular = (unindexed_per_gene > 1) | duplicated
+
+        kmer_dtype = np.uint32 if k <= 16 else np.uint64
+        windows = max(len(sequence) - k + 1, 0)
+        kmers = np.zeros(windows, dtype=kmer_dtype)
+        valid = np.ones(windows, dtype=bool)
+        for i in range(k):
+            codes = sequence[i:i + windows]
+            valid &= codes != _UNINDEXED
+            kmers = kmers * 4 + (codes & 3)
+        if len(genes):
+            valid &= ~np.repeat(irregular, gene_lengths + 1)[:windows]
+
+        position_dtype = np.uint32 if len(sequence) < (1 << 32) else np.uint64
+        positions = np.flatnonzero(valid)
+        positions = positions[np.argsort(kmers[positions], kind='stable')].astype(position_dtype)
+        counts = np.bincount(kmers[positions], minlength=4 ** k)
+        kmer_starts = np.zeros(4 ** k + 1, dtype=np.int64)
+        np.cumsum(counts, out=kmer_starts[1:])
+
+        return cls(k, gene_ids, gene_starts, gene_lengths, irregular, sequence, kmer_starts, positions)
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            **super()._arrays(),
+            "sequence": self.sequence,
+            "kmer_starts": self.kmer_starts,
+            "positions": self.positions,
+        }
+
+    def _meta(self) -> Dict[str, Any]:
+        return {"k": self.k}
+
+    def find(self, definition: str) -> Optional[np.ndarray]:
+        """
+        Finds every (also overlapping) match of a definition in the indexed genes.
+        :return: Sorted positions in the concatenated sequences, or None when the definition
+            expands into too many k-mers and should be scanned live
+        """
+        k = self.k
+        length = len(definition)
+        # allowed[i, c]: whether 2-bit code c matches the definition at position i (never the separator)
+        allowed = np.zeros((max(length, k), 5), dtype=bool)
+        allowed[:length, :4] = (_base_masks[None, :] & np.invert(definition_masks(definition))[:, None]) == 0
+        allowed[length:, :4] = True
+
+        if int(np.prod(allowed[:k, :4].sum(axis=1), dtype=np.float64)) > self.MAX_EXPANSION:
+            return None
+
+        kmers = np.zeros(1, dtype=np.int64)
+        for i in range(k):
+            kmers = (kmers[:, None] * 4 + np.flatnonzero(allowed[i, :4])[None, :]).ravel()
+
+        candidates = _gather(self.positions, self.kmer_starts[kmers], self.kmer_starts[kmers + 1])
+        candidates = candidates[self._verify(candidates, allowed, k, length)]
+
+        if length < k:
+            # Windows too close to the gene end to hold a whole k-mer are not in the index
+            regular = ~self.irregular
+            tail_starts = self.gene_starts[regular] + np.maximum(self.gene_lengths[regular] - k + 1, 0)
+            tail_ends = self.gene_starts[regular] + self.gene_lengths[regular] - length + 1
+            tail = ranges(tail_starts, np.maximum(tail_ends, tail_starts))
+            candidates = np.concatenate([candidates, tail[self._verify(tail, allowed, 0, length)]])
+
+        return np.sort(candidates)
+
+    def _verify(self, candidates: np.ndarray, allowed: np.ndarray, start: int, end: int) -> np.ndarray:
+        matches = np.ones(len(candidates), dtype=bool)
+        candidates = candidates.astype(np.int64)
+        for i in range(start, end):
+            at = candidates + i
+            inside = at < len(self.sequence)
+            matches &= inside
+            matches[inside] &= allowed[i][self.sequence[at[inside]]]
+        return matches
+
+
+def _gather(values: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenates values[starts[i]:ends[i]] for all i"""
+    return values[ranges(starts, ends)].astype(np.int64)
@@ -1,6 +1,11 @@
 import re2
+from functools import lru_cache
 from typing import List, Optional, Dict, Set
 
+# Upper bound on the number of compiled definitions kept per process (least recently used are evicted)
+REGEX_CACHE_SIZE = 1024
+
+
 class Motif:
     """
     Stores motif to search
@@ -95,22 +100,53 @@ class Motif:
         """
         :return: List of reverse-complement definitions
         """
-        complements = []
-        for definition in self.definitions:
-            # Convert each code to its reverse complement
-            complement_chars = []
-            for char in definition:
-                if char not in self.reverse_complements:
-                    raise ValueError(f"Unsupported code `{char}`")
-                complement_chars.append(self.reverse_complements[char])
-            # Reverse and join
-            complements.append("".join(reversed(complement_chars)))
-        return complements
+        return [_reverse_complement(definition) for definition in self.definitions]
+
+    @staticmethod
+    def reverse_complement(definition: str) -> str:
+        """
+        :return: The reverse complement of a single definition
+        """
+        complement_chars = []
+        for char in definition:
+            if char not in Motif.reverse_complements:
+                raise ValueError(f"Unsupported code `{char}`")
+            complement_chars.append(Motif.reverse_complements[char])
+        return "".join(reversed(complement_chars))
 
     @staticmethod
     def to_reg_exp(definition: str, strict: bool = False) -> re2._Regexp:
         """
         Convert an IUPAC-like definition into a Python regex.
+        Compiled regexes are cached process-wide, keyed by definition, see `regex_cache_info`.
+        :param definition: e.g. 'ACGT'
+        :param strict: if True, anchors ^ and $ are added
+        """
+        return _compile_definition(definition, strict)
+
+    @staticmethod
+    def regex_cache_info() -> Dict[str, int]:
+        """
+        :return: Hit/miss counters and size of the compiled-definition cache of this process
+        """
+        info = _compile_definition.cache_info()
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "max_size": info.maxsize,
+        }
+
+    @staticmethod
+    def clear_regex_cache() -> None:
+        """Drops all compiled definitions and resets the counters."""
+        _compile_definition.cache_clear()
+        _reverse_complement.cache_clear()
+
+    @staticmethod
+    def to_pattern(definition: str, strict: bool = False) -> str:
+        """
+        Convert an IUPAC-like definition into a regex pattern string (not compiled).
         :param definition: e.g. 'ACGT'
         :param strict: if True, anchors ^ and $ are added
         """
@@ -124,7 +160,7 @@ class Motif:
         if strict:
             pattern_parts.append('$')
 
-        return re2.compile("".join(pattern_parts))
+        return "".join(pattern_parts)
 
     @staticmethod
     def _nucleotide_code_to_reg_exp_part(code: str) -> str:
@@ -244,3 +280,12 @@ class Motif:
             raise ValueError(f'Unsupported code `{code}`')
         return code_mapping[code]
 
+
+@lru_cache(maxsize=REGEX_CACHE_SIZE)
+def _compile_definition(definition: str, strict: bool) -> re2._Regexp:
+    return re2.compile(Motif.to_pattern(definition, strict))
+
+
+@lru_cache(maxsize=REGEX_CACHE_SIZE)
+def _reverse_complement(definition: str) -> str:
+    return Motif.reverse_complement(definition)
@@ -0,0 +1,192 @@
+from functools import lru_cache
+from typing import List, Dict, Tuple, Optional
+
+import numpy as np
+import re2
+
+import settings
+from lib.analysis.hit_table import HitTable
+from lib.analysis.motif import Motif
+from lib.genes.genes import Gene
+
+
+class MotifScanner:
+    """
+    Base class of the scan backends, which search gene sequences for several motifs at once.
+
+    All forward and reverse-complement definitions of all motifs are deduplicated into
+    `self.definitions`; backends locate each definition and the base class fans the matches
+    out to one HitTable per motif. Within every gene, hits are ordered by the motif's own
+    definition order and then by position, so that results are identical to scanning each
+    motif on its own.
+    """
+
+    def __init__(self, motifs: List[Motif]):
+        """
+        :param motifs: The motifs to search for
+        """
+        self.motifs = motifs
+        self.definitions: List[str] = []
+        # For every motif, its unique definitions as (definition index, strand) in motif order
+        self._motif_definitions: List[List[Tuple[int, int]]] = []
+
+        index: Dict[str, int] = {}
+        for motif in motifs:
+            motif_definitions = []
+            seen = set()
+            strands = ((HitTable.FORWARD, motif.definitions), (HitTable.REVERSE, motif.reverse_definitions))
+            for strand, definitions in strands:
+                for definition in definitions:
+                    # Palindromic definitions are reported once, as forward hits
+                    if definition in seen:
+                        continue
+                    seen.add(definition)
+                    if definition not in index:
+                        index[definition] = len(self.definitions)
+                        self.definitions.append(definition)
+                    motif_definitions.append((index[definition], strand))
+            self._motif_definitions.append(motif_definitions)
+
+    def scan(self, sequence: str) -> List[HitTable]:
+        """
+        Scans a single sequence for all motifs.
+        :param sequence: Raw nucleotides data
+        :return: HitTable for each motif, in the same order as `self.motifs`
+        """
+        return self.scan_many([sequence])
+
+    def scan_many(self, sequences: List[str]) -> List[HitTable]:
+        """
+        Scans several sequences for all motifs.
+        :return: HitTable for each motif, gene indices refer to `sequences`
+        """
+        return self._tables(self._find_definitions(sequences))
+
+    def scan_genes(self, genes: List[Gene]) -> List[HitTable]:
+        """
+        Scans several genes for all motifs. Index-backed scanners use the gene IDs.
+        :return: HitTable for each motif, gene indices refer to `genes`
+        """
+        return self.scan_many([gene.data for gene in genes])
+
+    def _find_definitions(self, sequences: List[str]) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Locates every definition in the sequences.
+        :return: Map of definition index -> (sequence indices, starts), ordered by sequence and start
+        """
+        raise NotImplementedError
+
+    def _tables(self, matches: Dict[int, Tuple[np.ndarray, np.ndarray]]) -> List[HitTable]:
+        """
+        Fans out the matches of all definitions to the motifs.
+        :param matches: See `_find_definitions`
+        """
+        tables: List[HitTable] = []
+        for motif_definitions in self._motif_definitions:
+            parts = [
+                (definition_index, strand, matches[definition_index])
+                for definition_index, strand in motif_definitions
+                if definition_index in matches and len(matches[definition_index][0])
+            ]
+            if not parts:
+                tables.append(HitTable.empty(self.definitions))
+                continue
+
+            gene_indices = np.concatenate([part[0] for _, _, part in parts])
+            # Stable, so hits of a gene stay in definition order and then by position
+            order = np.argsort(gene_indices, kind='stable')
+            tables.append(HitTable(
+                self.definitions,
+                gene_indices[order],
+                np.concatenate([part[1] for _, _, part in parts])[order],
+                np.concatenate([np.full(len(part[0]), index, dtype=np.int32) for index, _, part in parts])[order],
+                np.concatenate([np.full(len(part[0]), strand, dtype=np.int8) for _, strand, part in parts])[order],
+            ))
+        return tables
+
+
+class Re2MotifScanner(MotifScanner):
+    """
+    The default scan backend.
+
+    All definitions are compiled into a single `re2.Set`, which tells in one pass over the
+    sequence which definitions occur at all. Only those definitions are then located with
+    `finditer`, on a sequence that is encoded once per gene.
+    """
+
+    # RE2's default memory budget is too small for the DFA of many degenerate definitions
+    _set_max_mem = 64 << 20
+
+    def __init__(self, motifs: List[Motif]):
+        super().__init__(motifs)
+        self._reg_exps = [Motif.to_reg_exp(definition) for definition in self.definitions]
+
+        options = re2.Options()
+        options.max_mem = self._set_max_mem
+        self._set = re2.Set.SearchSet(options)
+        for definition in self.definitions:
+            self._set.Add(Motif.to_pattern(definition))
+        if self.definitions:
+            self._set.Compile()
+
+    def _find_definitions(self, sequences: List[str]) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        found: Dict[int, Tuple[List[int], List[int]]] = {}
+        if not self.definitions:
+            return {}
+
+        for sequence_index, sequence in enumerate(sequences):
+            encoded = sequence.encode()
+            for definition_index in self._set.Match(encoded) or []:
+                sequence_indices, starts = found.setdefault(definition_index, ([], []))
+                for match in self._reg_exps[definition_index].finditer(encoded):
+                    sequence_indices.append(sequence_index)
+                    starts.append(match.start())
+
+        return {
+            definition_index: (np.array(sequence_indices, dtype=np.int64), np.array(starts, dtype=np.int64))
+            for definition_index, (sequence_indices, starts) in found.items()
+        }
+
+
+def _create_bitmask_scanner(motifs: List[Motif], overlapping: bool = False) -> MotifScanner:
+    from lib.analysis.bitmask_scanner import BitmaskMotifScanner
+    return BitmaskMotifScanner(motifs, overlapping=overlapping)
+
+
+# Scan backends selectable by name, see `settings.MOTIF_SCAN_BACKEND`
+SCAN_BACKENDS = {
+    're2': Re2MotifScanner,
+    'bitmask': _create_bitmask_scanner,
+}
+# Scan backends that can report overlapping matches of a definition
+OVERLAPPING_BACKENDS = {'bitmask'}
+
+
+def get_scanner(motifs: List[Motif], backend: Optional[str] = None, overlapping: bool = False) -> MotifScanner:
+    """
+    Returns a scanner for the given motifs, reusing one built earlier in this process.
+    Scanners hold compiled objects, which cannot be pickled, so worker processes build
+    their own on first use.
+    :param motifs: The motifs to search for
+    :param backend: Name of the scan backend, defaults to `settings.MOTIF_SCAN_BACKEND`
+        (or `re2` when that names an index backend)
+    :param overlapping: Report overlapping matches of the same definition, e.g. to count every
+        occurrence of a motif. Only backends in `OVERLAPPING_BACKENDS` can.
+    """
+    if backend is None:
+        backend = getattr(settings, 'MOTIF_SCAN_BACKEND', 're2')
+        if backend not in SCAN_BACKENDS:
+            backend = 're2'
+    if backend not in SCAN_BACKENDS:
+        raise ValueError(f"Unknown scan backend `{backend}`")
+    if overlapping and backend not in OVERLAPPING_BACKENDS:
+        raise ValueError(f"Scan backend `{backend}` cannot report overlapping matches")
+    return _scanner_for_ids(tuple(motif.id for motif in motifs), backend, overlapping)
+
+
+@lru_cache(maxsize=32)
+def _scanner_for_ids(motif_ids: Tuple[str, ...], backend: str, overlapping: bool) -> MotifScanner:
+    motifs = [Motif(name=motif_id, definitions=motif_id.split(",")) for motif_id in motif_ids]
+    if overlapping:
+        return SCAN_BACKENDS[backend](motifs, overlapping=True)
+    return SCAN_BACKENDS[backend](motifs)
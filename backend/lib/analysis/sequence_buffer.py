@@ -0,0 +1,199 @@
+import atexit
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+
+from lib.genes.gene_columns import GeneColumns
+from lib.genes.genes import Gene
+from lib.utilities.array_store import save_arrays, load_arrays
+
+
+class SequenceBuffer:
+    """
+    The sequences of an organism packed into one memory-mapped file with an offsets table.
+
+    The process that loads an organism publishes its buffer once; process pool workers then
+    receive only the buffer path and the rows of the genes to scan, and map the file instead of
+    unpickling every gene. Buffers are written to `/dev/shm` while it has room for them, so they
+    live in shared memory, otherwise to the temporary directory, and are removed when the
+    publishing process exits. A replaced buffer is kept
+    until the next publish, so tasks already queued for it can still read it. Buffers that already
+    exist on disk, like the sequences of a compiled organism, are published without a copy (see
+    `publish_existing`) and are never removed. Organisms whose sequences stay in their file until
+    accessed are published on first use (see `defer`).
+    """
+
+    # Buffers published by this process, by organism key
+    _published: Dict[str, "SequenceBuffer"] = {}
+    # Genes of organisms to publish on first use, by organism key
+    _deferred: Dict[str, List[Gene]] = {}
+    _deferred_lock = threading.Lock()
+    # Replaced buffers, removed on the next publish
+    _retired: List[str] = []
+    # Buffers mapped by this (worker) process, by path
+    _attached: "OrderedDict[str, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+    _max_attached = 8
+
+    # Buffer directories of this process, by whether they are in shared memory
+    _roots: Dict[bool, str] = {}
+    # Space left free in `/dev/shm` for others, e.g. the semaphores of multiprocessing
+    _shm_reserve = 16 << 20
+    _counter = itertools.count()
+
+    def __init__(self, path: str, genes: List[Gene], owned: bool = True):
+        """
+        :param path: The directory holding the buffer
+        :param genes: The genes packed into the buffer, in row order
+        :param owned: Whether the buffer was written by this process, and is removed once replaced
+        """
+        self.path = path
+        self.owned = owned
+        # Genes are matched by identity, the list keeps them (and so their ids) alive
+        self._genes = genes
+        self._rows = {id(gene): row for row, gene in enumerate(genes)}
+
+    @property
+    def gene_count(self) -> int:
+        return len(self._genes)
+
+    @classmethod
+    def publish(cls, key: str, genes: List[Gene]) -> "SequenceBuffer":
+        """
+        Packs the sequences of an organism and makes them available to `for_key`.
+        :param key: Identifies the organism, usually the path of its FASTA file
+        :param genes: All genes of the organism
+        """
+        sequence, offsets = GeneColumns.packed_sequences(genes)
+
+        root = cls._buffer_root(sequence.nbytes + offsets.nbytes)
+        path = os.path.join(root, f"buffer-{next(cls._counter)}")
+        try:
+            save_arrays(path, {"sequence": sequence, "offsets": offsets}, {"key": key, "genes": len(genes)})
+        except OSError:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        return cls._replace(key, cls(path, genes))
+
+    @classmethod
+    def publish_existing(cls, key: str, path: str, genes: List[Gene]) -> "SequenceBuffer":
+        """
+        Makes a buffer written by someone else available to `for_key`, without copying it.
+        :param path: A store with `sequence` and `offsets` arrays, e.g. a compiled organism
+        :param genes: The genes of its rows, in row order
+        """
+        return cls._replace(key, cls(path, genes, owned=False))
+
+    @classmethod
+    def defer(cls, key: str, genes: List[Gene]) -> None:
+        """
+        Publishes the buffer of an organism when `for_key` first asks for it rather than now, so
+        loading an organism whose sequences are read lazily (see `FastaIndex`) does not read them.
+        :param genes: All genes of the organism, in file order
+        """
+        with cls._deferred_lock:
+            cls.withdraw(key)
+            # The gene list may be reordered before the buffer is published
+            cls._deferred[key] = list(genes)
+
+    @classmethod
+    def withdraw(cls, key: str) -> None:
+        """Stops publishing the buffer of an organism, it is removed on the next publish"""
+        cls._deferred.pop(key, None)
+        buffer = cls._published.pop(key, None)
+        if buffer is not None and buffer.owned:
+            cls._retired.append(buffer.path)
+
+    @classmethod
+    def _replace(cls, key: str, buffer: "SequenceBuffer") -> "SequenceBuffer":
+        for retired_path in cls._retired:
+            shutil.rmtree(retired_path, ignore_errors=True)
+        cls._retired = []
+
+        previous = cls._published.get(key)
+        if previous is not None and previous.owned:
+            cls._retired.append(previous.path)
+        cls._published[key] = buffer
+        return buffer
+
+    @classmethod
+    def for_key(cls, key: Optional[str]) -> Optional["SequenceBuffer"]:
+        """Returns the buffer published for an organism, if any, publishing a deferred one first"""
+        if not key:
+            return None
+        if key in cls._deferred:
+            with cls._deferred_lock:
+                genes = cls._deferred.pop(key, None)
+                if genes is not None:
+                    try:
+                        cls.publish(key, genes)
+                    except OSError as e:
+                        print(f"[DEBUG] Could not publish sequence buffer for {key}: {e}")
+        return cls._published.get(key)
+
+    def rows_of(self, genes: List[Gene]) -> Optional[np.ndarray]:
+        """
+        Returns the rows of genes in the buffer, or None if some of them are not in it.
+        """
+        rows = np.empty(len(genes), dtype=np.int32)
+        for i, gene in enumerate(genes):
+            row = self._rows.get(id(gene))
+            if row is None:
+                return None
+            rows[i] = row
+        return rows
+
+    @classmethod
+    def read(cls, path: str, rows: np.ndarray) -> List[str]:
+        """
+        Reads sequences from a buffer, mapping it on first use in this process.
+        :param path: The directory holding the buffer
+        :param rows: The rows to read
+        """
+        sequence, offsets = cls.arrays(path)
+        return [
+            sequence[offsets[row]:offsets[row + 1]].tobytes().decode()
+            for row in np.asarray(rows).tolist()
+        ]
+
+    @classmethod
+    def arrays(cls, path: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Maps a buffer, once per process.
+        :return: The sequences as one byte array, and the start of every row in it (plus the end)
+        """
+        attached = cls._attached.get(path)
+        if attached is None:
+            arrays, _ = load_arrays(path)
+            attached = (arrays["sequence"], arrays["offsets"])
+            cls._attached[path] = attached
+            while len(cls._attached) > cls._max_attached:
+                cls._attached.popitem(last=False)
+        else:
+            cls._attached.move_to_end(path)
+        return attached
+
+    @classmethod
+    def _buffer_root(cls, size: int) -> str:
+        """
+        The directory to write a buffer of `size` bytes into. `/dev/shm` is used only while it
+        has room for the buffer, as containers often mount a small one (64 MB in Docker unless
+        `shm_size` is set) and a full `/dev/shm` also breaks everything else using it.
+        """
+        shared = os.path.isdir("/dev/shm") and shutil.disk_usage("/dev/shm").free >= size + cls._shm_reserve
+        root = cls._roots.get(shared)
+        if root is None:
+            root = tempfile.mkdtemp(prefix=f"geneweb-sequences-{os.getpid()}-", dir="/dev/shm" if shared else None)
+            atexit.register(_remove_root, root, os.getpid())
+            cls._roots[shared] = root
+        return root
+
+def _remove_root(root: str, owner_pid: int) -> None:
+    # Forked children inherit the exit handler, but only the publishing process owns the buffers
+    if os.getpid() == owner_pid:
+        shutil.rmtree(root, ignore_errors=True)
@@ -0,0 +1,215 @@
+import os
+from typing import List, Dict, Optional, Tuple, Any
+
+import numpy as np
+
+from lib.analysis.motif import Motif
+from lib.analysis.hit_table import HitTable, first_fit
+from lib.analysis.motif_scanner import MotifScanner
+from lib.genes.genes import Gene
+from lib.utilities.array_store import save_arrays, load_arrays, source_stamp, SourceStamp
+
+# Separator written after every gene in the concatenated sequences
+GENE_SEPARATOR = b"\n"
+
+
+class SequenceIndex:
+    """
+    Base class of the prebuilt full-organism indexes.
+
+    An index covers all genes of a FASTA file, concatenated in file order with a separator after
+    every gene. It answers `find(definition)` with the positions of all (also overlapping)
+    matches in that concatenation; `IndexScanner` maps them back to genes.
+
+    Genes the index cannot answer for (e.g. duplicate gene IDs) are marked irregular and are
+    scanned live. Indexes are stored as a directory next to the FASTA file (see `path_for`),
+    memory-mapped when opened and ignored once the FASTA file changes.
+    """
+
+    # Suffix of the index directory, appended to the FASTA file name
+    SUFFIX = ""
+
+    _opened: Dict[str, Tuple[SourceStamp, "SequenceIndex"]] = {}
+
+    def __init__(self, gene_ids: np.ndarray, gene_starts: np.ndarray, gene_lengths: np.ndarray,
+                 irregular: np.ndarray):
+        """
+        :param gene_ids: ID of every gene, in file order
+        :param gene_starts: Start of every gene in the concatenated sequences
+        :param gene_lengths: Length of every gene
+        :param irregular: Whether a gene must be scanned live instead
+        """
+        self.gene_ids = gene_ids
+        self.gene_starts = gene_starts
+        self.gene_lengths = gene_lengths
+        self.irregular = irregular
+        self._rows: Optional[Dict[str, int]] = None
+
+    @staticmethod
+    def layout(genes: List[Gene]) -> Tuple[bytes, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Concatenates the sequences of genes, each followed by the separator.
+        :return: (concatenated sequences, gene IDs, gene starts, gene lengths, duplicate-ID mask)
+        """
+        joined = b"".join(gene.data.encode('ascii', 'replace') + GENE_SEPARATOR for gene in genes)
+
+        gene_ids = np.array([gene.geneId for gene in genes], dtype=str)
+        gene_lengths = np.array([len(gene.data) for gene in genes], dtype=np.int64)
+        gene_starts = np.zeros(len(genes), dtype=np.int64)
+        if len(genes) > 1:
+            np.cumsum(gene_lengths[:-1] + len(GENE_SEPARATOR), out=gene_starts[1:])
+
+        _, first_rows, id_counts = np.unique(gene_ids, return_index=True, return_counts=True)
+        duplicated = np.ones(len(genes), dtype=bool)
+        duplicated[first_rows[id_counts == 1]] = False
+
+        return joined, gene_ids, gene_starts, gene_lengths, duplicated
+
+    @classmethod
+    def path_for(cls, fasta_path: str) -> str:
+        """The location of the index of a FASTA file"""
+        return f"{fasta_path}{cls.SUFFIX}"
+
+    def find(self, definition: str) -> Optional[np.ndarray]:
+        """
+        Finds every (also overlapping) match of a definition in the regular genes.
+        :return: Sorted positions in the concatenated sequences, or None when the index cannot
+            answer the definition efficiently and it should be scanned live
+        """
+        raise NotImplementedError
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        """The arrays to persist, keyed by constructor argument"""
+        return {
+            "gene_ids": self.gene_ids,
+            "gene_starts": self.gene_starts,
+            "gene_lengths": self.gene_lengths,
+            "irregular": self.irregular,
+        }
+
+    def _meta(self) -> Dict[str, Any]:
+        """Scalar constructor arguments to persist"""
+        return {}
+
+    def save(self, path: str, fasta_path: Optional[str] = None) -> None:
+        """
+        :param path: Target directory, usually `path_for(fasta_path)`
+        :param fasta_path: The FASTA file the index was built from, used to detect stale indexes
+        """
+        meta = {"index": self._meta()}
+        if fasta_path:
+            meta.update(source_stamp(fasta_path))
+        save_arrays(path, self._arrays(), meta)
+
+    @classmethod
+    def open(cls, path: str) -> "SequenceIndex":
+        """Memory-maps a saved index"""
+        arrays, meta = load_arrays(path)
+        return cls(**meta["index"], **arrays)
+
+    @classmethod
+    def for_fasta(cls, fasta_path: str) -> Optional["SequenceIndex"]:
+        """
+        Returns the index of a FASTA file if one was built and is up to date, None otherwise.
+        Opened indexes are kept for the lifetime of the process.
+        """
+        path = cls.path_for(fasta_path)
+        if not os.path.isdir(path):
+            return None
+
+        stamp = source_stamp(fasta_path)
+        opened = SequenceIndex._opened.get(path)
+        if opened is not None and opened[0] == stamp:
+            return opened[1]
+
+        try:
+            arrays, meta = load_arrays(path)
+            if any(meta.get(key) != value for key, value in stamp.items()):
+                return None
+            index = cls(**meta["index"], **arrays)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        SequenceIndex._opened[path] = (stamp, index)
+        return index
+
+    def row_of(self, gene_id: str) -> Optional[int]:
+        """Returns the row of a gene in the index"""
+        if self._rows is None:
+            self._rows = {gene_id: row for row, gene_id in enumerate(self.gene_ids.tolist())}
+        return self._rows.get(gene_id)
+
+
+def ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenates range(starts[i], ends[i]) for all i"""
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(total)
+
+
+class IndexScanner(MotifScanner):
+    """
+    Scan backend answering definitions from a SequenceIndex.
+
+    Genes are matched to index rows by gene ID. Irregular genes, genes missing from the index
+    and definitions the index gives up on are scanned live with re2.
+    Like `re2.finditer`, only non-overlapping matches of every definition are reported.
+    """
+
+    def __init__(self, index: SequenceIndex, motifs: List[Motif]):
+        super().__init__(motifs)
+        self.index = index
+
+    def scan_many(self, sequences: List[str]) -> List[HitTable]:
+        # Without gene IDs the index cannot be used
+        return self.scan_genes([Gene(gene_id="", data=sequence, header="", notes=[]) for sequence in sequences])
+
+    def scan_genes(self, genes: List[Gene]) -> List[HitTable]:
+        index = self.index
+        matches: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+        # Index row -> position in `genes`, for genes answered from the index
+        batch_of_row = np.full(len(index.gene_ids), -1, dtype=np.int64)
+        live = []
+        for i, gene in enumerate(genes):
+            row = index.row_of(gene.geneId)
+            if row is None or index.irregular[row] or index.gene_lengths[row] != len(gene.data):
+                live.append(i)
+            else:
+                batch_of_row[row] = i
+
+        for definition_index, definition in enumerate(self.definitions):
+            length = len(definition)
+            positions = index.find(definition)
+            if positions is None:
+                found = self._scan_live(genes, range(len(genes)), definition_index)
+            else:
+                rows = np.searchsorted(index.gene_starts, positions, side='right') - 1
+                batch = batch_of_row[rows]
+                requested = batch >= 0
+                offsets = (positions - index.gene_starts[rows])[requested]
+                rows, batch = rows[requested], batch[requested]
+
+                keep = first_fit(rows, offsets, offsets + length)
+                live_batch, live_offsets = self._scan_live(genes, live, definition_index)
+                batch = np.concatenate([batch[keep], live_batch])
+                offsets = np.concatenate([offsets[keep], live_offsets])
+                order = np.lexsort((offsets, batch))
+                found = batch[order], offsets[order]
+
+            if len(found[0]):
+                matches[definition_index] = found
+
+        return self._tables(matches)
+
+    def _scan_live(self, genes: List[Gene], batch_indices, definition_index: int) -> Tuple[np.ndarray, np.ndarray]:
+        reg_exp = Motif.to_reg_exp(self.definitions[definition_index])
+        batch, offsets = [], []
+        for i in batch_indices:
+            for match in reg_exp.finditer(genes[i].data):
+                batch.append(i)
+                offsets.append(match.start())
+        return np.array(batch, dtype=np.int64), np.array(offsets, dtype=np.int64)
@@ -0,0 +1,177 @@
+import gc
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Tuple, Set, Callable, Any
+
+import settings
+from lib.genes.gene_columns import gene_id_checksum
+from lib.genes.gene_list import GeneList
+
+# Pool modes, see `settings.ANALYSIS_POOL_MODE`
+BLANK = 'blank'
+PRELOAD = 'preload'
+
+_pool: Optional[ProcessPoolExecutor] = None
+# Guards the pool globals, pools are requested from request and job threads
+_pool_lock = threading.Lock()
+# Organisms the workers of the pool could not load, their batches carry the sequences instead
+_not_resident: Set[str] = set()
+
+# Sequences of the organisms resident in this worker in file order, with the checksum of
+# their gene IDs (see `gene_id_checksum`), by FASTA path
+_resident: Dict[str, Tuple[List[str], int]] = {}
+# Organisms this worker failed to load
+_failed: Set[str] = set()
+
+
+class OrganismNotResident(Exception):
+    """Raised by a worker that could not load an organism, see `resident_sequences`"""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.path = path
+
+
+def pool_mode() -> str:
+    return getattr(settings, 'ANALYSIS_POOL_MODE', BLANK)
+
+
+def get_process_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    Returns the process pool of the analysis.
+
+    In `preload` mode, workers keep organisms resident across tasks, so tasks can reference
+    genes by their row in the organism file. Preset organisms are loaded when a worker starts
+    if `settings.ANALYSIS_POOL_PRELOAD` is `eager`, and on first use otherwise.
+
+    A worker is replaced by a fresh one once it ran `ANALYSIS_POOL_MAX_TASKS` tasks. Workers
+    using more than `ANALYSIS_POOL_MAX_MEMORY_MB` after a task drop their resident organisms,
+    see `run_task`.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if max_workers is None:
+                max_workers = max(1, min(os.cpu_count() - 1, 4))
+            options = {}
+            max_tasks = getattr(settings, 'ANALYSIS_POOL_MAX_TASKS', 0)
+            if max_tasks:
+                # Workers are then started with `spawn`, as forked workers cannot be replaced safely
+                options["max_tasks_per_child"] = max_tasks
+
+            if pool_mode() == PRELOAD:
+                eager = getattr(settings, 'ANALYSIS_POOL_PRELOAD', 'lazy') == 'eager'
+                _pool = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                            initargs=(_preset_paths() if eager else [],), **options)
+            else:
+                _pool = ProcessPoolExecutor(max_workers=max_workers, **options)
+            _not_resident.clear()
+        return _pool
+
+
+def shutdown_process_pool() -> None:
+    """
+    Shuts the process pool down once its tasks completed, e.g. in a process about to fork,
+    whose children cannot use its workers. The next `get_process_pool` starts a new one.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+def run_task(call: Callable[[], Any]) -> Any:
+    """
+    Runs a task in a worker, then checks the memory of the worker. A worker using more than
+    `ANALYSIS_POOL_MAX_MEMORY_MB` drops its resident organisms and mapped sequence buffers,
+    they are loaded again on next use.
+    """
+    try:
+        return call()
+    finally:
+        max_memory = getattr(settings, 'ANALYSIS_POOL_MAX_MEMORY_MB', 0) << 20
+        if max_memory and _resident_memory(os.getpid()) > max_memory:
+            from lib.analysis.sequence_buffer import SequenceBuffer
+            print(f"[DEBUG] Worker {os.getpid()} exceeds {max_memory >> 20} MB, releasing resident organisms")
+            _resident.clear()
+            SequenceBuffer._attached.clear()
+            gc.collect()
+
+
+def is_resident(path: Optional[str]) -> bool:
+    """Whether batches of an organism can be sent to the workers by row, see `resident_sequences`"""
+    return bool(path) and pool_mode() == PRELOAD and path not in _not_resident
+
+
+def mark_not_resident(path: str) -> None:
+    """Sends the batches of an organism the workers could not load with their sequences"""
+    print(f"[DEBUG] Organism {path} is not resident in the workers, sending its sequences")
+    _not_resident.add(path)
+
+
+def _resident_memory(pid: int) -> int:
+    """Resident set size of a process in bytes, 0 if unknown"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _preset_paths() -> List[str]:
+    from analysis.utils.file_utils import find_fasta_file
+    from lib.analysis.organism_presets import OrganismPresets
+
+    if not OrganismPresets._organisms:
+        OrganismPresets.reload_data()
+    paths = [find_fasta_file(organism.filename) for organism in OrganismPresets._organisms]
+    return [path for path in paths if path]
+
+
+def _init_worker(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            _load_resident(path)
+        except Exception as e:
+            # Batches of the organism are refused (see `resident_sequences`) rather than loaded again
+            print(f"[DEBUG] Worker {os.getpid()} could not preload {path}: {e}")
+            _failed.add(path)
+
+
+def _load_resident(path: str) -> Tuple[List[str], int]:
+    gene_list = GeneList.load_from_file(path)
+    genes = gene_list.columns.genes() if gene_list.columns is not None else gene_list.genes
+    resident = ([gene.data for gene in genes], gene_id_checksum(gene.geneId for gene in genes))
+    _resident[path] = resident
+    return resident
+
+
+def resident_sequences(path: str, rows: List[int], gene_count: int, gene_checksum: int) -> List[str]:
+    """
+    Reads sequences of an organism resident in this worker, loading it on first use.
+    :param path: The FASTA file of the organism
+    :param rows: Rows of the genes in the file
+    :param gene_count: The number of genes the caller loaded from the file
+    :param gene_checksum: Checksum of the gene IDs the caller loaded, in file order. When the count
+        or the checksum differ, the file changed and it is loaded again.
+    :raises OrganismNotResident: If this worker cannot load the organism, the caller should send
+        the sequences instead (see `mark_not_resident`)
+    :raises ValueError: If the file still does not hold the caller's genes
+    """
+    if path in _failed:
+        raise OrganismNotResident(path)
+    resident = _resident.get(path)
+    if resident is None or len(resident[0]) != gene_count or resident[1] != gene_checksum:
+        try:
+            resident = _load_resident(path)
+        except Exception as e:
+            print(f"[DEBUG] Worker {os.getpid()} could not load {path}: {e}")
+            _failed.add(path)
+            raise OrganismNotResident(path) from e
+    sequences, checksum = resident
+    if len(sequences) != gene_count or checksum != gene_checksum:
+        raise ValueError(f"{path} holds {len(sequences)} genes with checksum {checksum}, "
+                         f"expected {gene_count} genes with checksum {gene_checksum}")
+    return [sequences[row] for row in rows]
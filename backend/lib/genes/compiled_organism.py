@@ -0,0 +1,126 @@
+import os
+from typing import List, Dict, Optional, Tuple, Any
+
+import numpy as np
+
+from lib.genes.gene_columns import GeneColumns
+from lib.utilities.array_store import save_arrays, load_arrays, source_stamp, content_hash, SourceStamp
+
+
+class CompiledOrganism:
+    """
+    The genes of an organism FASTA file in a binary, memory-mapped form.
+
+    Holds the columns of its GeneList (see `GeneColumns`): all sequences in one contiguous
+    buffer with an offsets table (the same layout as a SequenceBuffer, so it is shared with scan
+    workers as it is), the gene ID table, headers and notes, a TPM matrix (genes x stages) and a
+    marker matrix (genes x markers). Rows are in file order.
+
+    Opening it maps the arrays instead of parsing text and JSON. Compiled organisms are built
+    by the `build_compiled_organism` management command and saved next to the FASTA file (see
+    `path_for`); one that no longer matches its FASTA file is ignored. Without the FASTA file,
+    the compiled organism is used on its own.
+    """
+
+    SUFFIX = ".organism"
+    FORMAT_VERSION = 1
+
+    _opened: Dict[str, Tuple[Optional[SourceStamp], "CompiledOrganism"]] = {}
+
+    def __init__(self, path: str, meta: Dict[str, Any], arrays: Dict[str, np.ndarray]):
+        """
+        :param path: The directory holding the compiled organism
+        :param meta: Its metadata, see `compile`
+        :param arrays: Its memory-mapped arrays
+        """
+        self.path = path
+        self.meta = meta
+        self.errors: List[str] = meta["errors"]
+        self._arrays = arrays
+        self._columns: Optional[GeneColumns] = None
+
+    @property
+    def gene_count(self) -> int:
+        return len(self._arrays["gene_ids"])
+
+    @classmethod
+    def path_for(cls, fasta_path: str) -> str:
+        return f"{fasta_path}{cls.SUFFIX}"
+
+    @classmethod
+    def is_compiled(cls, path: Optional[str]) -> bool:
+        """Whether a path is a compiled organism (rather than a FASTA file)"""
+        return bool(path) and path.endswith(cls.SUFFIX) and os.path.isdir(path)
+
+    @classmethod
+    def compile(cls, path: str, columns: GeneColumns, errors: List[Any], fasta_path: str) -> None:
+        """
+        Writes the genes of a FASTA file as a compiled organism.
+        :param path: Target directory, usually `path_for(fasta_path)`
+        :param columns: All genes parsed from the file, in file order
+        :param errors: Errors collected while parsing, kept as text
+        :param fasta_path: The FASTA file, used to detect stale compiled organisms
+        """
+        arrays, meta = columns.to_arrays()
+        sequence, offsets = GeneColumns.packed_sequences(columns.genes())
+        save_arrays(
+            path,
+            {"sequence": sequence, "offsets": offsets, **arrays},
+            {
+                "format_version": cls.FORMAT_VERSION,
+                "content_hash": content_hash(fasta_path),
+                **meta,
+                "errors": [str(e) for e in errors],
+                **source_stamp(fasta_path),
+            }
+        )
+
+    @classmethod
+    def open(cls, path: str) -> "CompiledOrganism":
+        """Memory-maps a compiled organism"""
+        arrays, meta = load_arrays(path)
+        if meta.get("format_version") != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported compiled organism format: {meta.get('format_version')}")
+        return cls(path, meta, arrays)
+
+    @classmethod
+    def for_fasta(cls, fasta_path: Optional[str]) -> Optional["CompiledOrganism"]:
+        """
+        Returns the compiled organism of a FASTA file if one was built from its current content
+        (or the FASTA file is gone), None otherwise. A path of a compiled organism returns that organism.
+        Opened organisms are kept for the lifetime of the process.
+        """
+        if not fasta_path:
+            return None
+        path = fasta_path if cls.is_compiled(fasta_path) else cls.path_for(fasta_path)
+        if not os.path.isdir(path):
+            return None
+
+        try:
+            stamp = source_stamp(fasta_path)
+        except OSError:
+            # Deployments may ship only the compiled organism, it cannot be stale then
+            stamp = None
+        opened = cls._opened.get(path)
+        if opened is not None and opened[0] == stamp:
+            return opened[1]
+
+        try:
+            compiled = cls.open(path)
+            # A copied FASTA file has a new modification time but the same content
+            if stamp is not None and path != fasta_path \
+                    and any(compiled.meta.get(key) != value for key, value in stamp.items()) \
+                    and compiled.meta.get("content_hash") != content_hash(fasta_path):
+                return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        cls._opened[path] = (stamp, compiled)
+        return compiled
+
+    def columns(self) -> GeneColumns:
+        """The genes as columns over the mapped arrays, created once"""
+        if self._columns is None:
+            self._columns = GeneColumns.from_arrays(self._arrays, self.meta, sequence=self._arrays["sequence"],
+                                                    offsets=self._arrays["offsets"])
+        return self._columns
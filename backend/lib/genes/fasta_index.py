@@ -0,0 +1,311 @@
+import mmap
+import os
+import zipfile
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Tuple, Any, Iterator
+
+import numpy as np
+
+from lib.genes.fasta_parser import record_lines
+from lib.genes.fasta_reader import is_gzip
+from lib.genes.gene_columns import GeneColumns
+from lib.genes.genes import Gene
+from lib.utilities.array_store import save_arrays, load_arrays, source_stamp, SourceStamp
+
+
+class FastaIndex:
+    """
+    A faidx-style index of a plain FASTA file, so its organism is loaded without reading sequences.
+
+    For every gene it stores where its sequence starts in the file, its length and its line layout
+    (bases per line, and bytes per line including the line break), next to the rest of the gene
+    (ID, header, notes, rates and markers) as columns (see `GeneColumns`). Genes of an indexed
+    organism read their sequence from the memory-mapped file when it is accessed, so metadata-only
+    work (organism details, stage filters, TPM percentiles) never touches sequence bytes.
+
+    The layout of every gene is checked against its parsed sequence when the index is built;
+    sequences it cannot describe (e.g. with notes or blank lines between sequence lines, or with
+    lines of uneven length) are stored in the index instead. Indexes are built by the
+    `build_fasta_index` management command, or when the hot organisms are warmed up (see
+    `FastaCache.warm_up`), and saved next to the FASTA file; an index that no longer matches its
+    file is ignored, files without one are parsed.
+    """
+
+    SUFFIX = ".faidx"
+    FORMAT_VERSION = 1
+    # Size of the byte ranges a file is parsed in by `build`, when it is parsed in parallel
+    RANGE_BYTES = 8 << 20
+
+    _opened: Dict[str, Tuple[SourceStamp, "FastaIndex"]] = {}
+    # Indexes that could not be saved, by the version of their file, so saving is not tried again
+    _unsaved: Dict[str, SourceStamp] = {}
+
+    def __init__(self, fasta_path: str, meta: Dict[str, Any], arrays: Dict[str, np.ndarray]):
+        """
+        :param fasta_path: The indexed FASTA file
+        :param meta: Its metadata, see `build`
+        :param arrays: The sequence layout of every gene, plus the arrays of its columns
+        """
+        self.fasta_path = fasta_path
+        self.meta = meta
+        self.errors: List[str] = meta["errors"]
+        self._arrays = arrays
+        # Read per gene, kept as lists to avoid a numpy scalar per access
+        self._starts: List[int] = arrays["starts"].tolist()
+        self._lengths: List[int] = arrays["lengths"].tolist()
+        self._line_bases: List[int] = arrays["line_bases"].tolist()
+        self._line_bytes: List[int] = arrays["line_bytes"].tolist()
+        self._mapped: Optional[mmap.mmap] = None
+        self._columns: Optional[GeneColumns] = None
+
+    @property
+    def gene_count(self) -> int:
+        return len(self._starts)
+
+    @property
+    def inline_count(self) -> int:
+        """Number of genes whose sequence is stored in the index rather than read from the file"""
+        return sum(1 for line_bytes, length in zip(self._line_bytes, self._lengths) if line_bytes == 0 and length)
+
+    @classmethod
+    def path_for(cls, fasta_path: str) -> str:
+        return f"{fasta_path}{cls.SUFFIX}"
+
+    @classmethod
+    def can_index(cls, fasta_path: Optional[str]) -> bool:
+        """Whether a path is a plain FASTA file, the only kind that can be indexed"""
+        return bool(fasta_path) and os.path.isfile(fasta_path) and not zipfile.is_zipfile(fasta_path) \
+            and not is_gzip(fasta_path)
+
+    @classmethod
+    def build(cls, fasta_path: str, executor: Optional[Executor] = None) -> "FastaIndex":
+        """
+        Parses a plain FASTA file and indexes the sequence of every gene.
+        Records are cut and parsed exactly like `GeneList.parse_file` does, so the genes and errors
+        are the same.
+        :param executor: Parses large files in parallel, e.g. the process pool of the analysis: the
+            file is split at record boundaries into byte ranges (see `RANGE_BYTES`), which are
+            parsed by its workers and joined in file order
+        """
+        with _map(fasta_path) as data:
+            ranges = _record_ranges(data, cls.RANGE_BYTES) if executor is not None else [(0, len(data))]
+        if len(ranges) > 1:
+            futures = [executor.submit(_index_range, fasta_path, start, end) for start, end in ranges]
+            parts = [future.result() for future in futures]
+        else:
+            parts = [_index_range(fasta_path, start, end) for start, end in ranges]
+
+        columns = GeneColumns.concat([part[0] for part in parts])
+        layouts = np.concatenate([part[1] for part in parts])
+        inline = [sequence for part in parts for sequence in part[2]]
+        inline_offsets = np.zeros(len(inline) + 1, dtype=np.int64)
+        np.cumsum([len(sequence) for sequence in inline], out=inline_offsets[1:])
+        arrays, meta = columns.to_arrays()
+        arrays.update({
+            "starts": layouts[:, 0],
+            "lengths": layouts[:, 3],
+            "line_bases": layouts[:, 1],
+            "line_bytes": layouts[:, 2],
+            "inline": np.frombuffer(b"".join(inline), dtype=np.uint8),
+            "inline_offsets": inline_offsets,
+        })
+        meta.update({
+            "format_version": cls.FORMAT_VERSION,
+            "errors": [error for part in parts for error in part[3]],
+            **source_stamp(fasta_path),
+        })
+        return cls(fasta_path, meta, arrays)
+
+    def save(self, path: str) -> None:
+        save_arrays(path, self._arrays, self.meta)
+
+    @classmethod
+    def for_fasta(cls, fasta_path: Optional[str], build: bool = False,
+                  executor: Optional[Executor] = None) -> Optional["FastaIndex"]:
+        """
+        Returns the index of a FASTA file if one was built and is up to date, None otherwise.
+        Opened indexes are kept for the lifetime of the process.
+        :param build: Build the index if there is none, and save it next to the file if possible.
+            Only for management commands and warm-up, not while serving a request
+        :param executor: Builds the index in parallel, see `build`
+        """
+        if not cls.can_index(fasta_path):
+            return None
+        path = cls.path_for(fasta_path)
+        stamp = source_stamp(fasta_path)
+        opened = cls._opened.get(path)
+        if opened is not None and opened[0] == stamp:
+            return opened[1]
+
+        index = cls._open(path, fasta_path, stamp)
+        if index is None:
+            if not build:
+                return None
+            print(f"[DEBUG] Indexing FASTA file: {fasta_path}")
+            index = cls.build(fasta_path, executor)
+            if cls._unsaved.get(path) != stamp:
+                try:
+                    index.save(path)
+                    # Mapped from the saved index, so its pages are shared through the page cache
+                    index = cls._open(path, fasta_path, stamp) or index
+                except OSError as e:
+                    print(f"[DEBUG] Could not save FASTA index {path}, it is kept in memory only: {e}")
+                    cls._unsaved[path] = stamp
+
+        cls._opened[path] = (stamp, index)
+        return index
+
+    @classmethod
+    def _open(cls, path: str, fasta_path: str, stamp: SourceStamp) -> Optional["FastaIndex"]:
+        """Maps a saved index if it was built from the current version of its file"""
+        if not os.path.isdir(path):
+            return None
+        try:
+            arrays, meta = load_arrays(path)
+            if meta.get("format_version") != cls.FORMAT_VERSION \
+                    or any(meta.get(key) != value for key, value in stamp.items()):
+                return None
+            return cls(fasta_path, meta, arrays)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def columns(self) -> GeneColumns:
+        """The genes as columns over the mapped arrays, reading sequences from the FASTA file; created once"""
+        if self._columns is None:
+            self._columns = GeneColumns.from_arrays(self._arrays, self.meta, indexed=self)
+        return self._columns
+
+    def sequence_of(self, row: int) -> str:
+        """Reads the sequence of a gene, mapping the FASTA file on first use"""
+        line_bytes = self._line_bytes[row]
+        if line_bytes == 0:
+            inline, offsets = self._arrays["inline"], self._arrays["inline_offsets"]
+            return inline[offsets[row]:offsets[row + 1]].tobytes().decode()
+
+        if self._mapped is None:
+            with open(self.fasta_path, 'rb') as f:
+                self._mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return _read_sequence(self._mapped, self._starts[row], self._lengths[row], self._line_bases[row], line_bytes)
+
+
+@contextmanager
+def _map(file_path: str) -> Iterator[Any]:
+    """Maps a file for reading, an empty file (which cannot be mapped) as empty bytes"""
+    if os.path.getsize(file_path) == 0:
+        yield b""
+        return
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        yield data
+
+
+def _index_range(fasta_path: str, start: int, end: int) -> Tuple[GeneColumns, np.ndarray, List[bytes], List[str]]:
+    """
+    Parses and indexes the records of a byte range of a FASTA file, see `_record_ranges`.
+    Runs in process pool workers, so it returns only what the index keeps: the columns without
+    the sequences, the sequence layout (start, bases per line, bytes per line, length) of every gene,
+    the sequences the layouts do not describe and the errors as text.
+    """
+    errors: List[Any] = []
+    layouts: List[Tuple[int, int, int]] = []
+    inline: List[bytes] = []
+    with _map(fasta_path) as data:
+        columns = GeneColumns.pack(_indexed_genes(data, start, end, errors, layouts, inline))
+
+    lengths = np.diff(columns.offsets)
+    columns.sequence = columns.offsets = None
+    layout_table = np.zeros((len(layouts), 4), dtype=np.int64)
+    if layouts:
+        layout_table[:, :3] = layouts
+        layout_table[:, 3] = lengths
+    return columns, layout_table, inline, [str(e) for e in errors]
+
+
+def _indexed_genes(data, start: int, end: int, errors: List[Any], layouts: List[Tuple[int, int, int]],
+                   inline: List[bytes]) -> Iterator[Gene]:
+    """
+    Parses the genes of a byte range of a mapped FASTA file, adding the sequence layout of every
+    gene to `layouts` and its sequence to `inline` if the layout does not describe it (and an
+    empty one if it does).
+    """
+    for chunk_start, chunk_end in _chunks(data, start, end):
+        # Decoded with universal newlines, as the file is when it is read as text
+        lines = record_lines(data[chunk_start:chunk_end].decode().replace("\r\n", "\n").replace("\r", "\n"))
+        if lines is None:
+            continue
+        try:
+            gene = Gene.from_fasta(lines)
+        except Exception as e:
+            errors.append(e)
+            continue
+
+        layout = _sequence_layout(data, chunk_start, chunk_end)
+        try:
+            matches = layout is not None and _read_sequence(data, layout[0], len(gene.data), *layout[1:]) == gene.data
+        except (ValueError, UnicodeDecodeError):
+            matches = False
+        layouts.append(layout if matches else (0, 0, 0))
+        inline.append(b"" if matches else gene.data.encode())
+        yield gene
+
+
+def _record_ranges(data, range_bytes: int) -> List[Tuple[int, int]]:
+    """
+    Splits mapped FASTA data into byte ranges of about `range_bytes` at record boundaries.
+    Every range but the first starts right after a `>` and every range but the last ends at one,
+    so parsing the ranges one after another cuts the same records as parsing the whole data.
+    """
+    starts = [0]
+    for target in range(range_bytes, len(data), range_bytes):
+        position = data.find(b">", max(target, starts[-1]))
+        if position < 0:
+            break
+        starts.append(position + 1)
+    ends = [start - 1 for start in starts[1:]] + [len(data)]
+    return list(zip(starts, ends))
+
+
+def _chunks(data, start: int, end: int) -> Iterator[Tuple[int, int]]:
+    """(start, end) of the text between every `>` in a byte range, like `data[start:end].split(b'>')`"""
+    while True:
+        position = data.find(b">", start, end)
+        if position < 0:
+            yield start, end
+            return
+        yield start, position
+        start = position + 1
+
+
+def _sequence_layout(data, start: int, end: int) -> Optional[Tuple[int, int, int]]:
+    """
+    The layout of the sequence lines of a record: (start of the first one, bases per line, bytes
+    per line), taken from its first two sequence lines. None if the record has no sequence lines.
+    The layout still has to be checked against the sequence, see `build`.
+    """
+    line_starts: List[int] = []
+    bases = 0
+    # The first line holds the header
+    position = data.find(b"\n", start, end)
+    while 0 <= position < end and len(line_starts) < 2:
+        line_start = position + 1
+        position = data.find(b"\n", line_start, end)
+        line = data[line_start:end if position < 0 else position]
+        if line.strip() and not line.startswith(b";"):
+            line_starts.append(line_start)
+            if len(line_starts) == 1:
+                bases = len(line.rstrip(b"\r"))
+    if not line_starts or bases == 0:
+        return None
+    line_bytes = line_starts[1] - line_starts[0] if len(line_starts) > 1 else bases + 1
+    return line_starts[0], bases, line_bytes
+
+
+def _read_sequence(data, start: int, length: int, line_bases: int, line_bytes: int) -> str:
+    if length == 0:
+        return ""
+    full_lines, rest = divmod(length, line_bases)
+    end = start + full_lines * line_bytes
+    if (end + rest if rest else end - line_bytes + line_bases) > len(data):
+        raise ValueError(f"Sequence at {start} runs past the end of the file")
+    lines = np.ndarray((full_lines, line_bases), dtype=np.uint8, buffer=data, offset=start, strides=(line_bytes, 1))
+    return (lines.tobytes() + data[end:end + rest]).decode().upper()
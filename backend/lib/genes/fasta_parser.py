@@ -0,0 +1,74 @@
+from typing import Iterable, Iterator, List, Any, Optional
+
+from lib.genes.genes import Gene
+
+
+def iter_fasta_records(lines: Iterable[str]) -> Iterator[List[str]]:
+    """
+    Groups the lines of a FASTA file into records, holding one record at a time.
+
+    Records are cut at every `>`, like `data.split('>')` does, and each record is returned as
+    `('>' + chunk).split('\\n')` would be, so `Gene.from_fasta` sees exactly the same lines
+    (and raises the same errors) as when the whole file is split at once.
+    :param lines: Lines of the file, with or without their line ends (e.g. a text file handle)
+    """
+    record = ['>']
+    pending_newline = False
+    for raw_line in lines:
+        line = raw_line[:-1] if raw_line.endswith('\n') else raw_line
+        parts = line.split('>')
+        if pending_newline:
+            record.append(parts[0])
+        else:
+            record[-1] += parts[0]
+        for part in parts[1:]:
+            if _has_content(record):
+                yield record
+            record = ['>' + part]
+        pending_newline = raw_line.endswith('\n')
+
+    if pending_newline:
+        record.append('')
+    if _has_content(record):
+        yield record
+
+
+def iter_genes(lines: Iterable[str], errors: Optional[List[Any]] = None) -> Iterator[Gene]:
+    """
+    Parses FASTA lines into genes, one record at a time.
+    :param lines: Lines of the file, e.g. a text file handle
+    :param errors: Records that cannot be parsed add their exception here
+    """
+    for record in iter_fasta_records(lines):
+        try:
+            yield Gene.from_fasta(record)
+        except Exception as e:
+            if errors is not None:
+                errors.append(e)
+
+
+def record_lines(chunk: str) -> Optional[List[str]]:
+    """
+    The lines of the record following a `>`, as `iter_fasta_records` returns them, or None if
+    the record is empty.
+    :param chunk: Text between a `>` and the next one (or the end of the file)
+    """
+    record = ('>' + chunk).split('\n')
+    return record if _has_content(record) else None
+
+
+def iter_string_lines(data: str) -> Iterator[str]:
+    """Lines of FASTA data held in a string, split at `\\n` only like `str.split('\\n')`, without copying the data"""
+    start = 0
+    while start < len(data):
+        end = data.find('\n', start)
+        if end < 0:
+            yield data[start:]
+            return
+        yield data[start:end + 1]
+        start = end + 1
+
+
+def _has_content(record: List[str]) -> bool:
+    # The first line is prefixed with `>`, the record is empty if nothing else is there
+    return bool(record[0][1:].strip()) or any(line.strip() for line in record[1:])
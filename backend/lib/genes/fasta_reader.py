@@ -0,0 +1,203 @@
+import bisect
+import gzip
+import io
+import os
+import zipfile
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Tuple, Iterator, TextIO
+
+import numpy as np
+from Bio import bgzf
+
+from lib.genes.fasta_parser import iter_genes
+from lib.genes.genes import Gene
+from lib.utilities.array_store import save_arrays, load_arrays, source_stamp, SourceStamp
+
+GZIP_MAGIC = b"\x1f\x8b"
+# Extensions of compressed organism files, tried by `find_fasta_file` next to the plain name
+COMPRESSED_EXTENSIONS = (".zip", ".gz", ".bgz")
+
+
+@contextmanager
+def open_fasta(file_path: str) -> Iterator[TextIO]:
+    """
+    Opens an organism file as text, decompressing zip and gzip (including BGZF) files while
+    they are read. A zip archive is read from its first file.
+    """
+    if zipfile.is_zipfile(file_path):
+        with zipfile.ZipFile(file_path) as archive:
+            member = _fasta_member(archive)
+            with archive.open(member) as f:
+                yield io.TextIOWrapper(f)
+    elif is_gzip(file_path):
+        with gzip.open(file_path, 'rt') as f:
+            yield f
+    else:
+        with open(file_path, 'r') as f:
+            yield f
+
+
+def is_gzip(file_path: str) -> bool:
+    with open(file_path, 'rb') as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def is_bgzf(file_path: str) -> bool:
+    """Whether a file is BGZF compressed (e.g. by `bgzip`), which allows seeking by block"""
+    with open(file_path, 'rb') as f:
+        header = f.read(16)
+    # gzip member with an extra field (FLG.FEXTRA) holding the `BC` subfield first
+    return len(header) == 16 and header[:2] == GZIP_MAGIC and bool(header[3] & 4) and header[12:14] == b"BC"
+
+
+def _fasta_member(archive: zipfile.ZipFile) -> str:
+    members = [
+        info.filename for info in archive.infolist()
+        if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+    ]
+    if not members:
+        raise ValueError(f"No file in archive {archive.filename}")
+    return members[0]
+
+
+class FastaBlockIndex:
+    """
+    Locates the record of every gene in a BGZF compressed FASTA file.
+
+    Records are stored by the BGZF virtual offset of their `>` (the start of the compressed block
+    plus the offset into its decompressed data) and their decompressed length, so reading one
+    gene inflates only the blocks holding it. Records are cut at every `>`, like the parser does.
+
+    Indexes are built by the `build_fasta_block_index` management command and saved next to the
+    compressed file; an index that no longer matches its file is ignored.
+    """
+
+    SUFFIX = ".blocks"
+
+    _opened: Dict[str, Tuple[SourceStamp, "FastaBlockIndex"]] = {}
+
+    def __init__(self, gene_ids: np.ndarray, virtual_offsets: np.ndarray, lengths: np.ndarray):
+        """
+        :param gene_ids: ID of every record's gene, in file order
+        :param virtual_offsets: BGZF virtual offset of every record
+        :param lengths: Decompressed length of every record
+        """
+        self.gene_ids = gene_ids
+        self.virtual_offsets = virtual_offsets
+        self.lengths = lengths
+        self._rows: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def path_for(cls, fasta_path: str) -> str:
+        return f"{fasta_path}{cls.SUFFIX}"
+
+    @classmethod
+    def build(cls, fasta_path: str, chunk_size: int = 1 << 20) -> "FastaBlockIndex":
+        """
+        Indexes a BGZF compressed FASTA file, decompressing it as a stream.
+        :raises ValueError: If the file is not BGZF compressed
+        """
+        if not is_bgzf(fasta_path):
+            raise ValueError(f"{fasta_path} is not BGZF compressed, recompress it with `bgzip`")
+
+        with open(fasta_path, 'rb') as f:
+            blocks = [(start, data_start) for start, _, data_start, _ in bgzf.BgzfBlocks(f)]
+        block_data_starts = [data_start for _, data_start in blocks]
+
+        starts: List[int] = []
+        headers: List[bytes] = []
+        total = 0
+        with gzip.open(fasta_path, 'rb') as f:
+            # The header line of the last record may continue in the next chunk
+            pending = None
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                if pending is not None:
+                    line_end = chunk.find(b"\n")
+                    headers[pending] += chunk if line_end < 0 else chunk[:line_end]
+                    if line_end >= 0:
+                        pending = None
+                position = chunk.find(b">")
+                while position >= 0:
+                    starts.append(total + position)
+                    line_end = chunk.find(b"\n", position)
+                    headers.append(chunk[position:] if line_end < 0 else chunk[position:line_end])
+                    pending = len(headers) - 1 if line_end < 0 else None
+                    position = chunk.find(b">", position + 1)
+                total += len(chunk)
+
+        gene_ids, virtual_offsets, lengths = [], [], []
+        for row, start in enumerate(starts):
+            end = starts[row + 1] if row + 1 < len(starts) else total
+            # Records are cut at every `>`, the header line ends at the next one
+            header = headers[row].split(b">")[1].decode(errors='replace')
+            match = Gene.gene_id_reg_exp.search(">" + header)
+            if match is None:
+                continue
+            block = bisect.bisect_right(block_data_starts, start) - 1
+            gene_ids.append(match.group("gene"))
+            virtual_offsets.append(bgzf.make_virtual_offset(blocks[block][0], start - blocks[block][1]))
+            lengths.append(end - start)
+
+        return cls(
+            np.array(gene_ids, dtype=str),
+            np.array(virtual_offsets, dtype=np.uint64),
+            np.array(lengths, dtype=np.int64),
+        )
+
+    def save(self, path: str, fasta_path: str) -> None:
+        save_arrays(
+            path,
+            {"gene_ids": self.gene_ids, "virtual_offsets": self.virtual_offsets, "lengths": self.lengths},
+            source_stamp(fasta_path),
+        )
+
+    @classmethod
+    def for_fasta(cls, fasta_path: Optional[str]) -> Optional["FastaBlockIndex"]:
+        """
+        Returns the index of a compressed FASTA file if one was built and is up to date, None otherwise.
+        """
+        if not fasta_path:
+            return None
+        path = cls.path_for(fasta_path)
+        if not os.path.isdir(path):
+            return None
+
+        stamp = source_stamp(fasta_path)
+        opened = cls._opened.get(path)
+        if opened is not None and opened[0] == stamp:
+            return opened[1]
+
+        try:
+            arrays, meta = load_arrays(path)
+            if any(meta.get(key) != value for key, value in stamp.items()):
+                return None
+            index = cls(**arrays)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        cls._opened[path] = (stamp, index)
+        return index
+
+    def row_of(self, gene_id: str) -> Optional[int]:
+        """Returns the first record of a gene"""
+        if self._rows is None:
+            self._rows = {}
+            for row, row_gene_id in enumerate(self.gene_ids.tolist()):
+                self._rows.setdefault(row_gene_id, row)
+        return self._rows.get(gene_id)
+
+    def read_gene(self, fasta_path: str, gene_id: str) -> Optional[Gene]:
+        """
+        Reads and parses the record of one gene, inflating only the blocks that hold it.
+        :return: The gene, or None if the file has no record of it or the record cannot be parsed
+        """
+        row = self.row_of(gene_id)
+        if row is None:
+            return None
+
+        with bgzf.BgzfReader(fasta_path, 'rb') as reader:
+            reader.seek(int(self.virtual_offsets[row]))
+            record = reader.read(int(self.lengths[row]))
+        # Decoded with universal newlines, as the file is when it is parsed as a whole
+        genes = list(iter_genes(io.TextIOWrapper(io.BytesIO(record))))
+        return genes[0] if genes else None
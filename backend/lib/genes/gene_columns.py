@@ -0,0 +1,315 @@
+import math
+import sys
+import zlib
+from array import array
+from typing import List, Dict, Optional, Iterable, Tuple, Any
+
+import numpy as np
+
+from lib.genes.genes import Gene
+
+# Marks a gene without a marker in the marker matrix
+NO_MARKER = np.iinfo(np.int64).min
+
+
+class GeneColumns:
+    """
+    Columnar storage of the genes of an organism, owned by its GeneList.
+
+    Holds all sequences in one buffer with an offsets table, the gene ID table, the headers and
+    notes packed the same way, a TPM matrix (genes x stages, NaN where a gene has no rate) and a
+    marker matrix (genes x markers, `NO_MARKER` where a gene has no marker). The genes are `Gene`
+    views over its rows (see `genes`), so an organism is a handful of arrays instead of several
+    objects per gene. Arrays may be memory-mapped, see `CompiledOrganism`. The sequences may be
+    left in the FASTA file instead, and read from there when a gene's sequence is accessed (see
+    `FastaIndex`).
+    """
+
+    def __init__(self, gene_ids: List[str], sequence: Optional[np.ndarray], offsets: Optional[np.ndarray],
+                 headers: np.ndarray, header_offsets: np.ndarray, notes: np.ndarray, note_offsets: np.ndarray,
+                 stages: List[str], tpm: np.ndarray, marker_names: List[str], markers: np.ndarray,
+                 indexed: Optional["FastaIndex"] = None):
+        """
+        :param gene_ids: ID of every gene
+        :param sequence: UTF-8 sequences of all genes, concatenated; None if they are read from `indexed`
+        :param offsets: Start of every gene's sequence (plus the end)
+        :param headers: UTF-8 header lines, concatenated, with `header_offsets` like `offsets`
+        :param notes: UTF-8 note lines of every gene joined by line breaks, concatenated, with `note_offsets`
+        :param stages: Stage of every TPM matrix column, in order of first appearance
+        :param tpm: Expression level of every gene (row) in every stage (column)
+        :param marker_names: Marker of every marker matrix column, in order of first appearance
+        :param markers: Position of every marker (column) in every gene (row)
+        :param indexed: Index of the FASTA file to read the sequences from, if they are not in `sequence`
+        """
+        self.gene_ids = gene_ids
+        self.sequence = sequence
+        self.offsets = offsets
+        self.headers = headers
+        self.header_offsets = header_offsets
+        self.notes = notes
+        self.note_offsets = note_offsets
+        self.stages = stages
+        self.tpm = tpm
+        self.marker_names = marker_names
+        self.markers = markers
+        self.indexed = indexed
+        self._stage_columns = {stage: column for column, stage in enumerate(stages)}
+        self._marker_columns = {marker: column for column, marker in enumerate(marker_names)}
+        self._genes: Optional[List[Gene]] = None
+        self._gene_checksum: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.gene_ids)
+
+    def genes(self) -> List[Gene]:
+        """
+        Views of all rows, in row order. Views are created once, so genes keep their identity;
+        the list is a new one on every call, so callers may reorder it.
+        """
+        if self._genes is None:
+            self._genes = [Gene.view(self, row) for row in range(len(self.gene_ids))]
+        return list(self._genes)
+
+    def gene_checksum(self) -> int:
+        """
+        Checksum of the gene IDs in row order (see `gene_id_checksum`), identifies the rows of an
+        organism in stores and workers that refer to genes by row.
+        """
+        if self._gene_checksum is None:
+            self._gene_checksum = gene_id_checksum(self.gene_ids)
+        return self._gene_checksum
+
+    @classmethod
+    def pack(cls, genes: Iterable[Gene]) -> "GeneColumns":
+        """
+        Packs genes into columns, one at a time, so parsed genes are never all held as objects.
+        """
+        gene_ids: List[str] = []
+        sequence, offsets = bytearray(), array('q', [0])
+        headers, header_offsets = bytearray(), array('q', [0])
+        notes, note_offsets = bytearray(), array('q', [0])
+        stage_columns: Dict[str, int] = {}
+        marker_columns: Dict[str, int] = {}
+        # (row, column, value) of every rate and marker, turned into matrices at the end
+        rates = (array('q'), array('q'), array('d'))
+        markers = (array('q'), array('q'), array('q'))
+
+        for row, gene in enumerate(genes):
+            gene_ids.append(gene.geneId)
+            sequence += gene.data.encode()
+            offsets.append(len(sequence))
+            headers += gene.header.encode()
+            header_offsets.append(len(headers))
+            # Note lines never contain a line break
+            notes += "\n".join(gene.notes).encode()
+            note_offsets.append(len(notes))
+            for stage, rate in gene.transcriptionRates.items():
+                _append(rates, row, stage_columns.setdefault(stage, len(stage_columns)), rate)
+            for marker, position in gene.markers.items():
+                _append(markers, row, marker_columns.setdefault(marker, len(marker_columns)), position)
+
+        return cls(
+            gene_ids,
+            np.frombuffer(sequence, dtype=np.uint8),
+            np.frombuffer(offsets, dtype=np.int64),
+            np.frombuffer(headers, dtype=np.uint8),
+            np.frombuffer(header_offsets, dtype=np.int64),
+            np.frombuffer(notes, dtype=np.uint8),
+            np.frombuffer(note_offsets, dtype=np.int64),
+            list(stage_columns),
+            _matrix(rates, len(gene_ids), len(stage_columns), np.float64, np.nan),
+            list(marker_columns),
+            _matrix(markers, len(gene_ids), len(marker_columns), np.int64, NO_MARKER),
+        )
+
+    @classmethod
+    def concat(cls, parts: List["GeneColumns"]) -> "GeneColumns":
+        """
+        Joins the columns of consecutive parts of a file, e.g. parsed in parallel. Stages and
+        markers keep the order of their first appearance, as if the file was packed at once.
+        The sequences are joined only if every part holds them.
+        """
+        stages = list(dict.fromkeys(stage for part in parts for stage in part.stages))
+        marker_names = list(dict.fromkeys(marker for part in parts for marker in part.marker_names))
+        rows = sum(len(part) for part in parts)
+        tpm = np.full((rows, len(stages)), np.nan, dtype=np.float64)
+        markers = np.full((rows, len(marker_names)), NO_MARKER, dtype=np.int64)
+        start = 0
+        for part in parts:
+            end = start + len(part)
+            tpm[start:end, [stages.index(stage) for stage in part.stages]] = part.tpm
+            markers[start:end, [marker_names.index(marker) for marker in part.marker_names]] = part.markers
+            start = end
+
+        has_sequences = all(part.sequence is not None for part in parts)
+        sequence, offsets = _concat_packed([(part.sequence, part.offsets) for part in parts]) \
+            if has_sequences else (None, None)
+        headers, header_offsets = _concat_packed([(part.headers, part.header_offsets) for part in parts])
+        notes, note_offsets = _concat_packed([(part.notes, part.note_offsets) for part in parts])
+        return cls(
+            [gene_id for part in parts for gene_id in part.gene_ids],
+            sequence,
+            offsets,
+            headers,
+            header_offsets,
+            notes,
+            note_offsets,
+            stages,
+            tpm,
+            marker_names,
+            markers,
+        )
+
+    def to_arrays(self) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+        """
+        The columns except the sequences as arrays and metadata, to be saved by `save_arrays`.
+        See `from_arrays`.
+        """
+        arrays = {
+            "gene_ids": np.array([gene_id.encode() for gene_id in self.gene_ids], dtype=bytes),
+            "headers": self.headers,
+            "header_offsets": self.header_offsets,
+            "notes": self.notes,
+            "note_offsets": self.note_offsets,
+            "tpm": self.tpm,
+            "markers": self.markers,
+        }
+        return arrays, {"stages": self.stages, "markers": self.marker_names}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], meta: Dict[str, Any], sequence: Optional[np.ndarray] = None,
+                    offsets: Optional[np.ndarray] = None, indexed: Optional["FastaIndex"] = None) -> "GeneColumns":
+        """
+        Creates columns over arrays and metadata saved from `to_arrays`, with the sequences either
+        given as arrays or read through a FASTA index.
+        """
+        return cls(
+            gene_ids=[gene_id.decode() for gene_id in arrays["gene_ids"].tolist()],
+            sequence=sequence,
+            offsets=offsets,
+            headers=arrays["headers"],
+            header_offsets=arrays["header_offsets"],
+            notes=arrays["notes"],
+            note_offsets=arrays["note_offsets"],
+            stages=meta["stages"],
+            tpm=arrays["tpm"],
+            marker_names=meta["markers"],
+            markers=arrays["markers"],
+            indexed=indexed,
+        )
+
+    def sequence_of(self, row: int) -> str:
+        if self.sequence is None:
+            return self.indexed.sequence_of(row)
+        return _text(self.sequence, self.offsets, row)
+
+    def header_of(self, row: int) -> str:
+        return _text(self.headers, self.header_offsets, row)
+
+    def notes_of(self, row: int) -> List[str]:
+        notes = _text(self.notes, self.note_offsets, row)
+        return notes.split("\n") if notes else []
+
+    def rates_of(self, row: int) -> Dict[str, float]:
+        return {
+            stage: rate for stage, rate in zip(self.stages, self.tpm[row].tolist()) if not math.isnan(rate)
+        }
+
+    def markers_of(self, row: int) -> Dict[str, int]:
+        return {
+            marker: position for marker, position in zip(self.marker_names, self.markers[row].tolist())
+            if position != NO_MARKER
+        }
+
+    def stage_rates(self, stage: str, rows: np.ndarray) -> Optional[np.ndarray]:
+        """Expression levels of some rows in a stage, NaN where a gene has none; None for unknown stages"""
+        column = self._stage_columns.get(stage)
+        return None if column is None else self.tpm[rows, column]
+
+    def marker_positions(self, marker: str, rows: np.ndarray) -> Optional[np.ndarray]:
+        """Positions of a marker in some rows, `NO_MARKER` where a gene has none; None for unknown markers"""
+        column = self._marker_columns.get(marker)
+        return None if column is None else self.markers[rows, column]
+
+    def memory_size(self) -> int:
+        """
+        Size of the columns and gene views in memory in bytes. Memory-mapped arrays are not counted,
+        they are shared through the page cache.
+        """
+        arrays = (self.sequence, self.offsets, self.headers, self.header_offsets, self.notes, self.note_offsets,
+                  self.tpm, self.markers)
+        size = sum(array.nbytes for array in arrays if array is not None and not isinstance(array, np.memmap))
+        size += sys.getsizeof(self.gene_ids) + sum(sys.getsizeof(gene_id) for gene_id in self.gene_ids)
+        if self._genes is not None:
+            size += sys.getsizeof(self._genes) + sum(sys.getsizeof(gene) for gene in self._genes)
+        return size
+
+    @staticmethod
+    def rows_of(genes: List[Gene]) -> Tuple[Optional["GeneColumns"], Optional[np.ndarray]]:
+        """
+        Returns the columns all genes are views of and their rows, or (None, None) if they are
+        not views of the same columns.
+        """
+        if not genes:
+            return None, None
+        columns = genes[0]._columns
+        if columns is None:
+            return None, None
+        rows = np.empty(len(genes), dtype=np.int64)
+        for i, gene in enumerate(genes):
+            if gene._columns is not columns:
+                return None, None
+            rows[i] = gene._row
+        return columns, rows
+
+    @staticmethod
+    def packed_sequences(genes: List[Gene]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The sequences of genes as one byte array and the start of every gene in it (plus the end).
+        All rows of columns, in row order, are returned as they are stored.
+        """
+        columns = genes[0]._columns if genes else None
+        if columns is not None and columns.sequence is not None and columns._genes is not None and len(genes) == len(columns) \
+                and all(gene is view for gene, view in zip(genes, columns._genes)):
+            return columns.sequence, columns.offsets
+
+        encoded = [gene.data.encode() for gene in genes]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def gene_id_checksum(gene_ids: Iterable[str]) -> int:
+    """CRC-32 of gene IDs, in order"""
+    checksum = 0
+    for gene_id in gene_ids:
+        checksum = zlib.crc32(gene_id.encode() + b"\n", checksum)
+    return checksum
+
+
+def _append(entries: Tuple[array, array, array], row: int, column: int, value) -> None:
+    entries[0].append(row)
+    entries[1].append(column)
+    entries[2].append(value)
+
+
+def _matrix(entries: Tuple[array, array, array], rows: int, columns: int, dtype, missing) -> np.ndarray:
+    matrix = np.full((rows, columns), missing, dtype=dtype)
+    matrix[np.frombuffer(entries[0], dtype=np.int64), np.frombuffer(entries[1], dtype=np.int64)] = \
+        np.frombuffer(entries[2], dtype=dtype)
+    return matrix
+
+
+def _concat_packed(parts: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Joins packed texts with their offsets tables (see `GeneColumns`)"""
+    data = np.concatenate([np.empty(0, dtype=np.uint8)] + [part[0] for part in parts])
+    offsets = [np.zeros(1, dtype=np.int64)]
+    total = 0
+    for part_data, part_offsets in parts:
+        offsets.append(part_offsets[1:] + total)
+        total += len(part_data)
+    return data, np.concatenate(offsets)
+
+
+def _text(data: np.ndarray, offsets: np.ndarray, row: int) -> str:
+    return data[offsets[row]:offsets[row + 1]].tobytes().decode()
@@ -1,5 +1,14 @@
+import sys
 from typing import List, Dict, Set, Any, Optional, Tuple
+
+import numpy as np
+
 from lib.analysis.organism import Organism
+from lib.genes.compiled_organism import CompiledOrganism
+from lib.genes.fasta_index import FastaIndex
+from lib.genes.fasta_parser import iter_genes, iter_string_lines
+from lib.genes.fasta_reader import open_fasta, FastaBlockIndex
+from lib.genes.gene_columns import GeneColumns, NO_MARKER
 from lib.genes.genes import Gene
 from lib.genes.stage_selection import StageSelection, FilterSelection, FilterStrategy
 
@@ -29,14 +38,25 @@ class GeneList:
             genes: List["Gene"],
             stages: Optional[Dict[str, Set[str]]],
             colors: Optional[Dict[str, Any]],
-            errors: List[Any]
+            errors: List[Any],
+            source: Optional[str] = None
     ):
+        """
+        :param organism: The organism the genes belong to
+        :param genes: The genes
+        :param stages: Map of stage -> gene IDs, if stages are given explicitly
+        :param colors: Map of stage -> color
+        :param errors: Errors collected while parsing
+        :param source: Path of the FASTA file the genes were loaded from (if any)
+        """
         self.organism = organism
         self._genes = genes
         self.stages = stages
         self._colors = colors
         self.errors = errors
+        self.source = source
         self.transcriptionRates = self._transcription_rates(self._genes)
+        self._marker_offsets: Dict[str, np.ndarray] = {}
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, GeneList):
@@ -56,6 +76,49 @@ class GeneList:
         """
         return self._genes
 
+    @property
+    def columns(self) -> Optional[GeneColumns]:
+        """
+        The columnar storage of the organism the genes are views of, if they are (see `GeneColumns`)
+        """
+        return self._genes[0]._columns if self._genes else None
+
+    def memory_size(self) -> int:
+        """
+        Estimated size of the genes in memory in bytes, used to budget caches of loaded organisms.
+        """
+        columns, rows = GeneColumns.rows_of(self._genes)
+        if columns is not None:
+            return columns.memory_size() + sys.getsizeof(self._genes)
+
+        size = sys.getsizeof(self._genes)
+        for gene in self._genes:
+            size += (
+                sys.getsizeof(gene) + sys.getsizeof(gene._fields)
+                + sys.getsizeof(gene.geneId) + sys.getsizeof(gene.data) + sys.getsizeof(gene.header)
+                + sys.getsizeof(gene.notes) + sum(sys.getsizeof(note) for note in gene.notes)
+                + sys.getsizeof(gene.transcriptionRates) + sys.getsizeof(gene.markers)
+            )
+        return size
+
+    def marker_offsets(self, marker: str) -> np.ndarray:
+        """
+        Position of a marker in every gene (0 for genes without it), in the same order as `genes`.
+        Computed once per marker.
+        """
+        offsets = self._marker_offsets.get(marker)
+        if offsets is None:
+            columns, rows = GeneColumns.rows_of(self._genes)
+            if columns is not None:
+                positions = columns.marker_positions(marker, rows)
+                offsets = np.zeros(len(rows), dtype=np.int64) if positions is None \
+                    else np.where(positions == NO_MARKER, 0, positions)
+            else:
+                offsets = np.fromiter((gene.markers.get(marker, 0) for gene in self._genes),
+                                      dtype=np.int64, count=len(self._genes))
+            self._marker_offsets[marker] = offsets
+        return offsets
+
     @property
     def colors(self) -> Dict[str, Any]:
         """
@@ -81,21 +144,8 @@ class GeneList:
         Parse fasta file into list of genes.
         Returns (genes, errors).
         """
-        chunks = data.split('>')
-        genes: List["Gene"] = []
         errors: List[Any] = []
-        for i, chunk in enumerate(chunks):
-
-            if not chunk.strip():
-                continue
-
-            lines = ('>' + chunk).split('\n')
-            try:
-                gene = Gene.from_fasta(lines)
-                genes.append(gene)
-            except Exception as e:
-                errors.append(e)
-
+        genes = GeneColumns.pack(iter_genes(iter_string_lines(data), errors)).genes()
         return genes, errors
 
     @classmethod
@@ -125,7 +175,8 @@ class GeneList:
             cls,
             genes: List["Gene"],
             errors: List[Any],
-            organism: Optional["Organism"] = None
+            organism: Optional["Organism"] = None,
+            source: Optional[str] = None
     ) -> "GeneList":
         """
         Create a new GeneList from a list of genes.
@@ -135,7 +186,8 @@ class GeneList:
             genes=genes,
             stages=None,
             colors=None,
-            errors=errors
+            errors=errors,
+            source=source
         )
         return result
 
@@ -178,6 +230,7 @@ class GeneList:
             stages=stages if stages is not None else self.stages,
             colors=colors if colors is not None else self._colors,
             errors=errors if errors is not None else self.errors,
+            source=self.source,
         )
 
     @property
@@ -229,10 +282,7 @@ class GeneList:
             return self.copy_with(genes=[g for g in self.genes if g.geneId in ids])
         else:
             assert stage in stageSelection.selectedStages
-            self.genes.sort(
-                key=lambda g: g.transcriptionRates[stage]
-                if stage in g.transcriptionRates else 0.0
-            )
+            self._sort_by_rate(stage)
 
             if stageSelection.selection == FilterSelection.percentile:
                 if stageSelection.strategy == FilterStrategy.top:
@@ -246,11 +296,47 @@ class GeneList:
                 else:
                     return self.copy_with(genes=self._bottom(stageSelection.count))
 
+    def _sort_by_rate(self, stage: str) -> None:
+        """
+        Sorts the genes by their expression level in a stage (0 if they have none), keeping the
+        order of equal genes. The sorted genes are a new list, lists shared with other gene lists
+        (e.g. copies of a cached organism) keep their order.
+        """
+        columns, rows = GeneColumns.rows_of(self._genes)
+        if columns is None:
+            self._genes = sorted(
+                self._genes,
+                key=lambda g: g.transcriptionRates[stage]
+                if stage in g.transcriptionRates else 0.0
+            )
+        else:
+            rates = self._stage_rates(columns, rows, stage)
+            genes = self._genes
+            self._genes = [genes[i] for i in np.argsort(rates, kind='stable').tolist()]
+        # Offsets are cached in gene order
+        self._marker_offsets = {}
+
+    @staticmethod
+    def _stage_rates(columns: GeneColumns, rows: np.ndarray, stage: str) -> np.ndarray:
+        """Expression levels of rows of the columns in a stage, 0 where a gene has none"""
+        rates = columns.stage_rates(stage, rows)
+        return np.zeros(len(rows)) if rates is None else np.nan_to_num(rates, nan=0.0)
+
     @staticmethod
     def _transcription_rates(genes: List["Gene"]) -> Dict[str, Series]:
         """
         Aggregates transcription rates across all genes for each stage
         """
+        columns, rows = GeneColumns.rows_of(genes)
+        if columns is not None:
+            result = {}
+            for stage in columns.stages:
+                rates = columns.stage_rates(stage, rows)
+                rates = rates[~np.isnan(rates)]
+                if len(rates):
+                    result[stage] = Series(rates.tolist())
+            return result
+
         result: Dict[str, List[float]] = {}
         for gene in genes:
             for key, val in gene.transcriptionRates.items():
@@ -282,17 +368,7 @@ class GeneList:
         """
         series = self.transcriptionRates[transcriptionKey]
         total_rate = series.sum + 0.0001  # correction for floating point error
-        reversed_genes = list(reversed(self.genes))
-        rate_sum = 0.0
-        i = 0
-        result: List["Gene"] = []
-        while rate_sum < total_rate * percentile and i < len(reversed_genes):
-            g = reversed_genes[i]
-            val = g.transcriptionRates.get(transcriptionKey, 0.0)
-            result.append(g)
-            rate_sum += val
-            i += 1
-        return result
+        return self._accumulate(list(reversed(self.genes)), transcriptionKey, total_rate * percentile)
 
     def _bottomPercentile(self, percentile: float, transcriptionKey: str) -> List["Gene"]:
         """
@@ -301,12 +377,27 @@ class GeneList:
         """
         series = self.transcriptionRates[transcriptionKey]
         total_rate = series.sum + 0.0001
-        normal_genes = self.genes
+        return self._accumulate(self.genes, transcriptionKey, total_rate * percentile)
+
+    @staticmethod
+    def _accumulate(genes: List["Gene"], transcriptionKey: str, threshold: float) -> List["Gene"]:
+        """
+        Return the first genes, up to and including the one their expression adds up to the threshold with.
+        """
+        columns, rows = GeneColumns.rows_of(genes)
+        if columns is not None:
+            if not threshold > 0:
+                return []
+            # Summed in order, exactly like adding the rates one by one
+            totals = np.cumsum(GeneList._stage_rates(columns, rows, transcriptionKey))
+            reached = np.flatnonzero(totals >= threshold)
+            return genes[:reached[0] + 1] if len(reached) else list(genes)
+
         rate_sum = 0.0
         i = 0
         result: List["Gene"] = []
-        while rate_sum < total_rate * percentile and i < len(normal_genes):
-            g = normal_genes[i]
+        while rate_sum < threshold and i < len(genes):
+            g = genes[i]
             val = g.transcriptionRates.get(transcriptionKey, 0.0)
             result.append(g)
             rate_sum += val
@@ -351,24 +442,57 @@ class GeneList:
 
     @classmethod
     def load_from_file(cls, file_path: str) -> "GeneList":
-        try:
-            with open(file_path, 'r') as f:
-                data = f.read()
-
-            genes, errors = [], []
-            chunks = data.split('>')
-            for i, chunk in enumerate(chunks):
-                if not chunk.strip():
-                    continue
-
-                lines = ('>' + chunk).split('\n')
-                try:
-                    gene = Gene.from_fasta(lines)
-                    genes.append(gene)
-                except Exception as e:
-                    errors.append(e)
-
-            result = cls.from_list(genes=genes, errors=errors)
-            return result
-        except Exception as e:
-            raise
+        """
+        Loads the genes of an organism file, opening its compiled organism (see `CompiledOrganism`)
+        instead of parsing the FASTA file when one is up to date. Plain FASTA files with an index
+        (see `FastaIndex`) are loaded through it, so sequences are read only when they are accessed.
+        """
+        compiled = CompiledOrganism.for_fasta(file_path)
+        if compiled is not None:
+            return cls.from_compiled(compiled, source=file_path)
+        index = FastaIndex.for_fasta(file_path)
+        if index is not None:
+            return cls.from_index(index, source=file_path)
+        return cls.parse_file(file_path)
+
+    @classmethod
+    def read_gene(cls, file_path: str, gene_id: str) -> Optional["Gene"]:
+        """
+        Reads one gene of an organism file. BGZF compressed files with a block index (see
+        `FastaBlockIndex`) inflate only the blocks holding the gene, other files are loaded
+        like by `load_from_file` (which reads no sequences of indexed plain files).
+        :return: The first gene with the ID, or None if the file has none
+        """
+        block_index = FastaBlockIndex.for_fasta(file_path)
+        if block_index is not None:
+            return block_index.read_gene(file_path, gene_id)
+        return next((gene for gene in cls.load_from_file(file_path).genes if gene.geneId == gene_id), None)
+
+    @classmethod
+    def parse_file(cls, file_path: str) -> "GeneList":
+        """
+        Parses a FASTA file record by record, so only the genes (not the file) are held in memory.
+        Zip and gzip compressed files are decompressed as they are read.
+        """
+        errors: List[Any] = []
+        with open_fasta(file_path) as f:
+            columns = GeneColumns.pack(iter_genes(f, errors))
+        return cls.from_list(genes=columns.genes(), errors=errors, source=file_path)
+
+    @classmethod
+    def from_compiled(cls, compiled: "CompiledOrganism", source: Optional[str] = None) -> "GeneList":
+        """
+        Creates a GeneList from a compiled organism, in the row order of the FASTA file.
+        :param source: Path the organism was loaded from, defaults to the compiled organism itself
+        """
+        return cls.from_list(genes=compiled.columns().genes(), errors=list(compiled.errors),
+                             source=source or compiled.path)
+
+    @classmethod
+    def from_index(cls, index: "FastaIndex", source: Optional[str] = None) -> "GeneList":
+        """
+        Creates a GeneList from an indexed FASTA file, in file order, without reading sequences.
+        :param source: Path the organism was loaded from, defaults to the FASTA file
+        """
+        return cls.from_list(genes=index.columns().genes(), errors=list(index.errors),
+                             source=source or index.fasta_path)
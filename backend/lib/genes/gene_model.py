@@ -1,5 +1,5 @@
-import asyncio
-from typing import List, Optional, Dict, Any
+import traceback
+from typing import List, Optional, Dict, Any, Callable
 
 import aiofiles
 
@@ -10,6 +10,11 @@ from lib.analysis.organism import Organism
 from lib.genes.gene_list import GeneList
 from lib.genes.stage_selection import StageSelection
 
+
+class AnalysisCancelled(Exception):
+    """Raised by the `on_series` callback of `GeneModel.analyze` to stop the analysis, analyze re-raises it"""
+
+
 class AnalysisOptions:
     def __init__(
             self,
@@ -68,9 +73,11 @@ class GeneModel:
 
         if organism and organism.take_first_transcript_only:
             genes, errors = await GeneList.take_single_transcript(gene_list.genes, gene_list.errors)
-            self.sourceGenes = GeneList.from_list(genes=genes, errors=errors, organism=organism)
+            self.sourceGenes = GeneList.from_list(genes=genes, errors=errors, organism=organism,
+                                                  source=gene_list.source)
         else:
-            self.sourceGenes = gene_list.copy_with(organism=organism)
+            # The cached gene list is shared by concurrent analyses, filtering reorders the genes
+            self.sourceGenes = gene_list.copy_with(genes=list(gene_list.genes), organism=organism)
 
         self.name = organism.name if organism else None
 
@@ -104,20 +111,13 @@ class GeneModel:
         blue = (final_hash & 0xFF)
         return f"#{red:02X}{green:02X}{blue:02X}"
 
-    async def _run_single_analysis(self, params):
-        return await AnalysisSeries.run_async(
-            gene_list=params['genes'],
-            motif=params['motif'],
-            name=params['name'],
-            color=params['color'],
-            minimal=params['min'],
-            maximal=params['max'],
-            bucket_size=params['interval'],
-            align_marker=params['alignMarker'],
-            no_overlaps=params.get('no_overlaps', True)
-        )
-
-    async def analyze(self) -> bool:
+    async def analyze(self, on_series: Optional[Callable[["AnalysisSeries"], None]] = None) -> bool:
+        """
+        Runs all motifs over the genes of all selected stages, adding the series to `analyses`.
+        :param on_series: Called with every series as soon as it is complete, in the order of `analyses`
+        :return: Whether the analysis succeeded
+        :raises AnalysisCancelled: If `on_series` raised it
+        """
         try:
             if not self._stageSelection or not self._stageSelection.selectedStages:
                 raise ValueError("No selected stages")
@@ -135,59 +135,72 @@ class GeneModel:
             completed_tasks = 0
             color_preferences = {}
 
-            import multiprocessing
-            cpu_count = multiprocessing.cpu_count()
-            analysis_params = []
-
-            for motif in self._motifs:
-                for stage_key in self._stageSelection.selectedStages:
-                    filteredGenes = (
-                        self.sourceGenes if stage_key == "__ALL__"
-                        else self.sourceGenes.filter(stage=stage_key, stageSelection=self._stageSelection)
-                    )
-
-                    if not filteredGenes or not filteredGenes.genes:
-                        completed_tasks += 1
-                        self.analysisProgress = completed_tasks / total_tasks
-                        continue
-
-                    name = f"{'all' if stage_key == '__ALL__' else stage_key} - {motif.name}"
-                    color = color_preferences.get(f"{stage_key}_{motif.name}") or self.randomColorOf(name)
-
-                    analysis_params.append({
-                        'genes': filteredGenes,
-                        'motif': motif,
-                        'name': name,
-                        'color': color,
-                        'min': self.analysisOptions.min,
-                        'max': self.analysisOptions.max,
-                        'interval': self.analysisOptions.bucketSize,
-                        'alignMarker': self.analysisOptions.alignMarker,
-                        'no_overlaps': True,
-                    })
-
-            results = []
-
-            batch_size = min(len(analysis_params), 2)
-
-            for i in range(0, len(analysis_params), batch_size):
-                batch = analysis_params[i:i + batch_size]
-
-                batch_tasks = []
-                for params in batch:
-                    task = self._run_single_analysis(params)
-                    batch_tasks.append(task)
-
-                batch_results = await asyncio.gather(*batch_tasks)
-                results.extend(batch_results)
-
-                completed_tasks += len(batch)
+            # Every motif is scanned once over the genes of all stages, hits are then split per stage
+            stage_lists = []
+            stage_names = []
+            stage_colors = []
+
+            for stage_key in self._stageSelection.selectedStages:
+                filteredGenes = (
+                    self.sourceGenes if stage_key == "__ALL__"
+                    else self.sourceGenes.filter(stage=stage_key, stageSelection=self._stageSelection)
+                )
+
+                if not filteredGenes or not filteredGenes.genes:
+                    completed_tasks += len(self._motifs)
+                    self.analysisProgress = completed_tasks / total_tasks
+                    continue
+
+                names = [f"{'all' if stage_key == '__ALL__' else stage_key} - {motif.name}" for motif in self._motifs]
+                colors = [
+                    color_preferences.get(f"{stage_key}_{motif.name}") or self.randomColorOf(name)
+                    for motif, name in zip(self._motifs, names)
+                ]
+
+                stage_lists.append(filteredGenes)
+                stage_names.append(names)
+                stage_colors.append(colors)
+
+            # Streaming callers get the series of every motif as soon as it is scanned,
+            # otherwise all motifs are scanned together
+            motif_groups = (
+                [[motif_index] for motif_index in range(len(self._motifs))] if on_series
+                else [list(range(len(self._motifs)))]
+            )
+            for group in motif_groups:
+                stage_results = await AnalysisSeries.run_stages_async(
+                    gene_lists=stage_lists,
+                    motifs=[self._motifs[motif_index] for motif_index in group],
+                    names=[[names[motif_index] for motif_index in group] for names in stage_names],
+                    colors=[[colors[motif_index] for motif_index in group] for colors in stage_colors],
+                    minimal=self.analysisOptions.min,
+                    maximal=self.analysisOptions.max,
+                    bucket_size=self.analysisOptions.bucketSize,
+                    align_marker=self.analysisOptions.alignMarker,
+                    no_overlaps=True,
+                )
+                completed_tasks += len(stage_lists) * len(group)
                 self.analysisProgress = completed_tasks / total_tasks
 
-            self.analyses.extend(results)
+                # Keep the motif-major order of the series
+                results = [
+                    series[i]
+                    for i in range(len(group))
+                    for series in stage_results
+                ]
+
+                self.analyses.extend(results)
+                if on_series:
+                    for series in results:
+                        on_series(series)
+
             self.analysisProgress = 1.0
             return True
-        except:
+        except AnalysisCancelled:
+            raise
+        except Exception as e:
+            print(f"ERROR in analyze: {e}")
+            traceback.print_exc()
             return False
 
 
@@ -5,8 +5,13 @@ from typing import List, Dict, Optional
 class Gene:
     """
     Holds a single gene data
+
+    A gene either holds its fields itself, or is a view over a row of the columnar storage of
+    its organism (see `GeneColumns`), reading them from there when accessed.
     """
 
+    __slots__ = ("_columns", "_row", "_fields", "_geneCode")
+
     gene_id_reg_exp = re2.compile(r"(?P<gene>[A-Za-z0-9+_.-]+)")
     markers_reg_exp = re2.compile(r";MARKERS (?P<json>\{.*})$")
     transcription_rates_reg_exp = re2.compile(r";TRANSCRIPTION_RATES (?P<json>\{.*})$")
@@ -28,15 +33,56 @@ class Gene:
         :param transcription_rates: Map of (stage -> expression level)
         :param markers: Map of marker name -> position
         """
-        self.geneId = gene_id
-        self.data = data
-        self.header = header
-        self.notes = notes
-        self.transcriptionRates = transcription_rates if transcription_rates else {}
-        self.markers = markers if markers else {}
-
+        self._columns: Optional["GeneColumns"] = None
+        self._row = -1
+        self._fields = (
+            gene_id,
+            data,
+            header,
+            notes,
+            transcription_rates if transcription_rates else {},
+            markers if markers else {},
+        )
         self._geneCode: Optional[str] = None
 
+    @classmethod
+    def view(cls, columns: "GeneColumns", row: int) -> "Gene":
+        """Creates a gene reading its fields from a row of columnar storage"""
+        gene = cls.__new__(cls)
+        gene._columns = columns
+        gene._row = row
+        gene._fields = None
+        gene._geneCode = None
+        return gene
+
+    @property
+    def geneId(self) -> str:
+        return self._fields[0] if self._columns is None else self._columns.gene_ids[self._row]
+
+    @property
+    def data(self) -> str:
+        return self._fields[1] if self._columns is None else self._columns.sequence_of(self._row)
+
+    @property
+    def header(self) -> str:
+        return self._fields[2] if self._columns is None else self._columns.header_of(self._row)
+
+    @property
+    def notes(self) -> List[str]:
+        return self._fields[3] if self._columns is None else self._columns.notes_of(self._row)
+
+    @property
+    def transcriptionRates(self) -> Dict[str, float]:
+        return self._fields[4] if self._columns is None else self._columns.rates_of(self._row)
+
+    @property
+    def markers(self) -> Dict[str, int]:
+        return self._fields[5] if self._columns is None else self._columns.markers_of(self._row)
+
+    def __reduce__(self):
+        # Views are sent to other processes as standalone genes, not with their whole organism
+        return Gene, (self.geneId, self.data, self.header, self.notes, self.transcriptionRates, self.markers)
+
     @classmethod
     def from_fasta(cls, lines: List[str]) -> "Gene":
         header: Optional[str] = None
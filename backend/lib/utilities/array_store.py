@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, Any, Tuple
+
+import numpy as np
+
+META_FILE = "meta.json"
+
+# file path -> (source stamp, SHA-256 of the content)
+# Identifies the version of a file, see `source_stamp`
+SourceStamp = Dict[str, int]
+
+_content_hashes: Dict[str, Tuple[SourceStamp, str]] = {}
+
+
+def save_arrays(path: str, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> None:
+    """
+    Saves arrays as a directory of `.npy` files plus a `meta.json`.
+    The directory is written next to the target and swapped in at the end, so readers
+    never see a half-written store.
+    :param path: Target directory
+    :param arrays: Map of name -> array
+    :param meta: JSON-serializable metadata
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array, allow_pickle=False)
+    with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+        json.dump({**meta, "arrays": sorted(arrays.keys())}, f)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+
+def load_arrays(path: str, mmap: bool = True) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    Loads a store written by `save_arrays`.
+    :param path: Store directory
+    :param mmap: Whether to memory-map the arrays instead of reading them into memory
+    :return: (arrays, metadata)
+    """
+    with open(os.path.join(path, META_FILE), 'r') as f:
+        meta = json.load(f)
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r' if mmap else None, allow_pickle=False)
+        for name in meta["arrays"]
+    }
+    return arrays, meta
+
+
+def source_stamp(file_path: str) -> SourceStamp:
+    """
+    Identifies the version of a source file an index was built from.
+    """
+    stat = os.stat(file_path)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def content_hash(file_path: str) -> str:
+    """
+    SHA-256 of a file's content, computed once per version of the file (see `source_stamp`).
+    A store written by `save_arrays` from a file (e.g. a compiled organism) has the hash of that
+    file recorded in its metadata as `content_hash`.
+    """
+    if os.path.isdir(file_path):
+        with open(os.path.join(file_path, META_FILE), 'r') as f:
+            return json.load(f)["content_hash"]
+
+    stamp = source_stamp(file_path)
+    cached = _content_hashes.get(file_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    _content_hashes[file_path] = (stamp, digest.hexdigest())
+    return digest.hexdigest()
@@ -27,6 +27,11 @@ else:
     SECURE_HSTS_INCLUDE_SUBDOMAINS = True
     SECURE_HSTS_PRELOAD = True
 
+# Loaded organisms kept per process (0 = only pinned ones), and organism filenames kept regardless (comma-separated,
+# '*' for all preset organisms). Pinned organisms are loaded before gunicorn forks its workers, see gunicorn_config.py
+FASTA_CACHE_MB = int(os.environ.get('FASTA_CACHE_MB', '2048'))
+FASTA_CACHE_PINNED = [name for name in os.environ.get('FASTA_CACHE_PINNED', '').split(',') if name]
+
 SESSION_ENGINE = "django.contrib.sessions.backends.db"
 SESSION_COOKIE_AGE = 86400  # 1-day
 SESSION_COOKIE_SAMESITE = "Lax"
@@ -34,6 +39,33 @@ SESSION_COOKIE_SAMESITE = "Lax"
 ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'golem-dev.biodata.ceitec.cz,127.0.0.1,147.251.245.200,localhost,0.0.0.0,127.0.0.1').split(',')
 DATA_DIR = BASE_DIR / "data"
 
+# Motif scan engine used by the analysis: 're2' or 'bitmask' (live), 'kmer' or 'fm' (prebuilt index)
+MOTIF_SCAN_BACKEND = os.environ.get('MOTIF_SCAN_BACKEND', 're2')
+
+# Process pool of the analysis: 'blank' workers get the sequences with every task,
+# 'preload' workers keep organisms resident ('lazy': on first use, 'eager': preset organisms at start)
+ANALYSIS_POOL_MODE = os.environ.get('ANALYSIS_POOL_MODE', 'blank')
+ANALYSIS_POOL_PRELOAD = os.environ.get('ANALYSIS_POOL_PRELOAD', 'lazy')
+# Replace a worker after this many tasks, and drop the organisms of a worker using this many MB (0 = never)
+ANALYSIS_POOL_MAX_TASKS = int(os.environ.get('ANALYSIS_POOL_MAX_TASKS', '0'))
+ANALYSIS_POOL_MAX_MEMORY_MB = int(os.environ.get('ANALYSIS_POOL_MAX_MEMORY_MB', '0'))
+
+# Background analysis jobs: worker threads per server process, queued jobs overall, queued or running jobs per user
+ANALYSIS_JOB_WORKERS = int(os.environ.get('ANALYSIS_JOB_WORKERS', '1'))
+ANALYSIS_JOB_QUEUE_SIZE = int(os.environ.get('ANALYSIS_JOB_QUEUE_SIZE', '20'))
+ANALYSIS_JOB_USER_LIMIT = int(os.environ.get('ANALYSIS_JOB_USER_LIMIT', '2'))
+
+# Streamed analyses running at once per server process, further streams wait for a free one
+ANALYSIS_STREAM_WORKERS = int(os.environ.get('ANALYSIS_STREAM_WORKERS', '4'))
+
+# Analysis result cache: size of the in-memory tier (per process) and of the on-disk tier (0 = off)
+RESULT_CACHE_MEMORY_MB = int(os.environ.get('RESULT_CACHE_MEMORY_MB', '256'))
+RESULT_CACHE_DISK_MB = int(os.environ.get('RESULT_CACHE_DISK_MB', '2048'))
+RESULT_CACHE_DIR = Path(os.environ.get('RESULT_CACHE_DIR', DATA_DIR / 'result_cache'))
+
+# Series kept in memory (per process) for repeated drill-downs, by the size of their hits
+DRILL_DOWN_CACHE_MB = int(os.environ.get('DRILL_DOWN_CACHE_MB', '128'))
+
 SESSION_ENGINE = "django.contrib.sessions.backends.db"
 SESSION_COOKIE_AGE = 86400  # 1-day
 # AUTH_USER_MODEL = "auth_app.AppUser"